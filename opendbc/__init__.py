@@ -5,6 +5,15 @@ DBC_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'dbc')
 # -I include path for e.g. "#include <opendbc/safety/safety.h>"
 INCLUDE_PATH = os.path.abspath(os.path.join(os.path.dirname(os.path.realpath(__file__)), "../"))
 
+
+def get_cache_dir(*subdirs: str) -> str:
+  """Persistent per-user cache directory, overridable with OPENDBC_CACHE_DIR."""
+  base = os.environ.get("OPENDBC_CACHE_DIR")
+  if not base:
+    base = os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "opendbc")
+  return os.path.join(base, *subdirs)
+
+
 _generated_dbc_cache: dict[str, str] | None = None
 
 def get_generated_dbcs() -> dict[str, str]:
@@ -15,3 +24,12 @@ def get_generated_dbcs() -> dict[str, str]:
     from opendbc.dbc.generator.generator import generate_all
     _generated_dbc_cache = generate_all()
   return _generated_dbc_cache
+
+
+def get_generated_dbc(name: str) -> str | None:
+  """Lazily generate a single *_generated DBC, only building it and its includes.
+  Returns None if name is not a generated DBC."""
+  if _generated_dbc_cache is not None:
+    return _generated_dbc_cache.get(name)
+  from opendbc.dbc.generator.generator import generate_dbc
+  return generate_dbc(name)
@@ -1,8 +1,9 @@
 from opendbc.can.packer import CANPacker
-from opendbc.can.parser import CANParser, CANDefine
+from opendbc.can.parser import CANParser, CANDefine, decode_frames
 
 __all__ = [
   "CANDefine",
   "CANParser",
   "CANPacker",
+  "decode_frames",
 ]
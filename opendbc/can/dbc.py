@@ -1,21 +1,25 @@
 import re
 import os
+import io
+import hashlib
+import pickle
+import tempfile
 from collections.abc import Callable
 from dataclasses import dataclass
 from functools import cache
 
-from opendbc import DBC_PATH, get_generated_dbcs
+from opendbc import DBC_PATH, get_cache_dir, get_generated_dbc
 
 # TODO: these should just be passed in along with the DBC file
 from opendbc.car.honda.hondacan import honda_checksum
 from opendbc.car.toyota.toyotacan import toyota_checksum
 from opendbc.car.subaru.subarucan import subaru_checksum
-from opendbc.car.chrysler.chryslercan import chrysler_checksum, fca_giorgio_checksum
-from opendbc.car.hyundai.hyundaicanfd import hkg_can_fd_checksum
+from opendbc.car.chrysler.chryslercan import chrysler_checksum, fca_giorgio_checksum, fca_giorgio_checksum_batch
+from opendbc.car.hyundai.hyundaicanfd import hkg_can_fd_checksum, hkg_can_fd_checksum_batch
 from opendbc.car.volkswagen.mlbcan import volkswagen_mlb_checksum
-from opendbc.car.volkswagen.mqbcan import volkswagen_mqb_meb_checksum, xor_checksum
+from opendbc.car.volkswagen.mqbcan import volkswagen_mqb_meb_checksum, volkswagen_mqb_meb_checksum_batch, xor_checksum
 from opendbc.car.tesla.teslacan import tesla_checksum
-from opendbc.car.body.bodycan import body_checksum
+from opendbc.car.body.bodycan import body_checksum, body_checksum_batch
 from opendbc.car.psa.psacan import psa_checksum
 
 
@@ -48,7 +52,7 @@ class Signal:
   offset: float
   is_little_endian: bool
   type: int = SignalType.DEFAULT
-  calc_checksum: 'Callable[[int, Signal, bytearray], int] | None' = None
+  calc_checksum: 'Callable[[int, Signal, bytes | bytearray | memoryview], int] | None' = None
 
 
 @dataclass
@@ -73,6 +77,23 @@ SGM_RE = re.compile(r"^SG_ (\w+) (\w+) *: (\d+)\|(\d+)@(\d)([+-]) \(([0-9.+\-eE]
 VAL_RE = re.compile(r"^VAL_ (\w+) (\w+) (.*);")
 VAL_SPLIT_RE = re.compile(r'["]+')
 
+# bump when the pickled layout of Msg/Signal/Val changes
+DBC_CACHE_VERSION = 1
+
+
+@cache
+def _parser_hash() -> bytes:
+  # parsed tables depend on this module (regexes, checksum setup), so any change to it invalidates the cache
+  with open(__file__, 'rb') as f:
+    return hashlib.sha256(f.read()).digest()
+
+
+def get_dbc_cache_path(name: str, content: str) -> str:
+  h = hashlib.sha256(_parser_hash())
+  h.update(f"{DBC_CACHE_VERSION}\0{name}\0".encode())
+  h.update(content.encode())
+  return os.path.join(get_cache_dir("dbc"), f"{name}-{h.hexdigest()[:32]}.pkl")
+
 
 @cache
 class DBC:
@@ -81,7 +102,7 @@ class DBC:
       self._parse_file(name)
     else:
       dbc_path = os.path.join(DBC_PATH, name + ".dbc")
-      if content := get_generated_dbcs().get(name):
+      if content := get_generated_dbc(name):
         self._parse_content(name, content)
       elif os.path.exists(dbc_path):
         self._parse_file(dbc_path)
@@ -91,13 +112,42 @@ class DBC:
   def _parse_file(self, path: str):
     self.name = os.path.basename(path).replace(".dbc", "")
     with open(path) as f:
-      lines = f.readlines()
-    self._parse_lines(lines)
+      content = f.read()
+    self._parse_cached(content, io.StringIO(content).readlines)
 
   def _parse_content(self, name: str, content: str):
     self.name = name
-    lines = content.splitlines(keepends=True)
-    self._parse_lines(lines)
+    self._parse_cached(content, lambda: content.splitlines(keepends=True))
+
+  def _parse_cached(self, content: str, get_lines: Callable[[], list[str]]):
+    if os.environ.get("DISABLE_DBC_CACHE"):
+      self._parse_lines(get_lines())
+      return
+
+    cache_path = get_dbc_cache_path(self.name, content)
+    try:
+      with open(cache_path, 'rb') as f:
+        self.msgs, self.name_to_msg, self.vals = pickle.load(f)
+      self.addr_to_msg = dict(self.msgs)
+      return
+    except Exception:
+      # missing, stale or corrupt cache entry, fall back to parsing
+      pass
+
+    self._parse_lines(get_lines())
+
+    # publish atomically so concurrent processes never read a partial file
+    try:
+      os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+      fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(cache_path), suffix=".tmp")
+    except OSError:
+      return
+    try:
+      with os.fdopen(fd, 'wb') as f:
+        pickle.dump((self.msgs, self.name_to_msg, self.vals), f, protocol=pickle.HIGHEST_PROTOCOL)
+      os.replace(tmp_path, cache_path)
+    except OSError:
+      os.unlink(tmp_path)
 
   def _parse_lines(self, lines: list[str]):
 
@@ -167,6 +217,15 @@ class DBC:
 
 # ***** checksum functions *****
 
+# vectorized variants, over a 2D array with one payload of the message per row
+CHECKSUM_BATCH_FUNCS: dict[Callable, Callable] = {
+  fca_giorgio_checksum: fca_giorgio_checksum_batch,
+  hkg_can_fd_checksum: hkg_can_fd_checksum_batch,
+  volkswagen_mqb_meb_checksum: volkswagen_mqb_meb_checksum_batch,
+  body_checksum: body_checksum_batch,
+}
+
+
 def tesla_setup_signal(sig: Signal, dbc_name: str, line_num: int) -> None:
   if sig.name.endswith("Counter"):
     sig.type = SignalType.COUNTER
@@ -183,7 +242,7 @@ class ChecksumState:
   counter_start_bit: int
   little_endian: bool
   checksum_type: int
-  calc_checksum: Callable[[int, Signal, bytearray], int] | None
+  calc_checksum: Callable[[int, Signal, bytes | bytearray | memoryview], int] | None
   setup_signal: Callable[[Signal, str, int], None] | None = None
 
 
@@ -1,45 +1,119 @@
 import math
 
 from opendbc.car.carlog import carlog
-from opendbc.can.dbc import DBC, Signal, SignalType
+from opendbc.can.dbc import DBC, Msg, Signal, SignalType
+from opendbc.can.parser import get_signal_decoder
 
 
-class CANPacker:
-  def __init__(self, dbc_name: str):
-    self.dbc = DBC(dbc_name)
-    self.counters: dict[int, int] = {}
+class PreparedMessage:
+  """Pack handle for one message, with its signal encoders and counter/checksum signals resolved once."""
 
-  def pack(self, address: int, values: dict[str, float]) -> bytearray:
-    msg = self.dbc.addr_to_msg.get(address)
-    if msg is None:
-      carlog.error(f"msg not found for {address=}")
-      return bytearray()
-    dat = bytearray(msg.size)
+  def __init__(self, msg: Msg, counters: dict[int, int]):
+    self.msg = msg
+    self.address = msg.address
+    self.size = msg.size
+    self.counters = counters
+
+    self.counter_sig = next((s for s in msg.sigs.values() if s.type == SignalType.COUNTER or s.name == "COUNTER"), None)
+    sig_checksum = next((s for s in msg.sigs.values() if s.type > SignalType.COUNTER), None)
+    self.checksum_sig = sig_checksum if sig_checksum and sig_checksum.calc_checksum else None
+
+    # (sig, is_counter, is_little_endian, shift, mask) to place each signal into the payload as one int
+    self.encoders: dict[str, tuple[Signal, bool, bool, int, int]] = {}
+    size_bits = msg.size * 8
+    le_bits = be_bits = 0
+    in_bounds = True
+    for sig in msg.sigs.values():
+      little_endian, shift, mask, _ = get_signal_decoder(sig)
+      if little_endian:
+        in_bounds &= sig.msb // 8 < msg.size
+        le_bits |= mask << shift
+      else:
+        shift = size_bits - shift
+        in_bounds &= sig.lsb // 8 < msg.size
+        if in_bounds:
+          be_bits |= mask << shift
+      is_counter = sig.type == SignalType.COUNTER or sig.name == "COUNTER"
+      self.encoders[sig.name] = (sig, is_counter, little_endian, shift, mask)
+
+    # signals past the end of the payload, or overlapping little and big endian signals, are set byte by byte
+    be_bits = int.from_bytes(be_bits.to_bytes(msg.size, 'big'), 'little') if in_bounds else 0
+    self.fast = in_bounds and (le_bits & be_bits) == 0
+
+  def pack(self, values: dict[str, float]) -> bytearray:
+    le_dat = be_dat = 0
+    dat = None if self.fast else bytearray(self.size)
     counter_set = False
     for name, value in values.items():
-      sig = msg.sigs.get(name)
-      if sig is None:
-        carlog.error(f"unknown signal {name=} in {msg.name}")
+      enc = self.encoders.get(name)
+      if enc is None:
+        carlog.error(f"unknown signal {name=} in {self.msg.name}")
         continue
+      sig, is_counter, little_endian, shift, mask = enc
       ival = int(math.floor((value - sig.offset) / sig.factor + 0.5))
       if ival < 0:
         ival = (1 << sig.size) + ival
-      set_value(dat, sig, ival)
-      if sig.type == SignalType.COUNTER or sig.name == "COUNTER":
-        self.counters[address] = int(value)
+      if dat is not None:
+        set_value(dat, sig, ival)
+      elif little_endian:
+        le_dat = (le_dat & ~(mask << shift)) | ((ival & mask) << shift)
+      else:
+        be_dat = (be_dat & ~(mask << shift)) | ((ival & mask) << shift)
+      if is_counter:
+        self.counters[self.address] = int(value)
         counter_set = True
-    sig_counter = next((s for s in msg.sigs.values() if s.type == SignalType.COUNTER or s.name == "COUNTER"), None)
+
+    if dat is None:
+      if be_dat:
+        le_dat |= int.from_bytes(be_dat.to_bytes(self.size, 'big'), 'little')
+      dat = bytearray(le_dat.to_bytes(self.size, 'little'))
+
+    sig_counter = self.counter_sig
     if sig_counter and not counter_set:
-      if address not in self.counters:
-        self.counters[address] = 0
-      set_value(dat, sig_counter, self.counters[address])
-      self.counters[address] = (self.counters[address] + 1) % (1 << sig_counter.size)
-    sig_checksum = next((s for s in msg.sigs.values() if s.type > SignalType.COUNTER), None)
-    if sig_checksum and sig_checksum.calc_checksum:
-      checksum = sig_checksum.calc_checksum(address, sig_checksum, dat)
+      if self.address not in self.counters:
+        self.counters[self.address] = 0
+      set_value(dat, sig_counter, self.counters[self.address])
+      self.counters[self.address] = (self.counters[self.address] + 1) % (1 << sig_counter.size)
+    sig_checksum = self.checksum_sig
+    if sig_checksum:
+      checksum = sig_checksum.calc_checksum(self.address, sig_checksum, dat)
       set_value(dat, sig_checksum, checksum)
     return dat
 
+  def make_can_msg(self, bus: int, values: dict[str, float]):
+    return self.address, bytes(self.pack(values)), bus
+
+
+class CANPacker:
+  def __init__(self, dbc_name: str):
+    self.dbc = DBC(dbc_name)
+    self.counters: dict[int, int] = {}
+    self.prepared: dict[int, PreparedMessage] = {}
+
+  def prepare(self, name_or_addr: str | int) -> PreparedMessage:
+    if isinstance(name_or_addr, int):
+      msg = self.dbc.addr_to_msg.get(name_or_addr)
+    else:
+      msg = self.dbc.name_to_msg.get(name_or_addr)
+    if msg is None:
+      raise RuntimeError(f"could not find message {name_or_addr!r} in DBC {self.dbc.name}")
+    if msg.address not in self.prepared:
+      self.prepared[msg.address] = PreparedMessage(msg, self.counters)
+    return self.prepared[msg.address]
+
+  def pack(self, address: int, values: dict[str, float]) -> bytearray:
+    prepared = self.prepared.get(address)
+    if prepared is None:
+      msg = self.dbc.addr_to_msg.get(address)
+      if msg is None:
+        carlog.error(f"msg not found for {address=}")
+        return bytearray()
+      prepared = self.prepared[address] = PreparedMessage(msg, self.counters)
+    return prepared.pack(values)
+
+  def pack_many(self, msgs: list[tuple[int, dict[str, float]]]) -> list[bytearray]:
+    return [self.pack(address, values) for address, values in msgs]
+
   def make_can_msg(self, name_or_addr, bus: int, values: dict[str, float]):
     if isinstance(name_or_addr, int):
       addr = name_or_addr
@@ -3,12 +3,15 @@ import numbers
 from collections import defaultdict, deque
 from dataclasses import dataclass, field
 
+import numpy as np
+
 from opendbc.car.carlog import carlog
-from opendbc.can.dbc import DBC, Signal
+from opendbc.can.dbc import CHECKSUM_BATCH_FUNCS, DBC, Signal
 
 
 MAX_BAD_COUNTER = 5
 CAN_INVALID_CNT = 5
+CHECKSUM_CACHE_SIZE = 256  # per message
 
 
 def get_raw_value(dat: bytes | bytearray, sig: Signal) -> int:
@@ -26,6 +29,36 @@ def get_raw_value(dat: bytes | bytearray, sig: Signal) -> int:
   return ret
 
 
+def get_signal_decoder(sig: Signal) -> tuple[bool, int, int, int]:
+  """Precompute (is_little_endian, shift, mask, sign_bit) to extract a signal from the whole payload as one int.
+
+  Little endian signals are shifted out of int.from_bytes(dat, "little") by their lsb. Big endian signals are
+  shifted out of int.from_bytes(dat, "big"), where the shift depends on the payload length, so the value stored
+  is subtracted from the payload size in bits at decode time.
+  """
+  mask = (1 << sig.size) - 1
+  sign_bit = (1 << (sig.size - 1)) if sig.is_signed else 0
+  if sig.is_little_endian:
+    return True, sig.lsb, mask, sign_bit
+  return False, (sig.lsb // 8) * 8 + 8 - (sig.lsb % 8), mask, sign_bit
+
+
+def get_raw_values(dat: np.ndarray, sig: Signal) -> np.ndarray:
+  """Vectorized get_raw_value over a 2D array of payloads, one frame per row."""
+  ret = np.zeros(dat.shape[0], dtype=np.uint64)
+  i = sig.msb // 8
+  bits = sig.size
+  while 0 <= i < dat.shape[1] and bits > 0:
+    lsb = sig.lsb if (sig.lsb // 8) == i else i * 8
+    msb = sig.msb if (sig.msb // 8) == i else (i + 1) * 8 - 1
+    size = msb - lsb + 1
+    d = (dat[:, i] >> (lsb - (i * 8))) & ((1 << size) - 1)
+    ret |= d.astype(np.uint64) << np.uint64(bits - size)
+    bits -= size
+    i = i - 1 if sig.is_little_endian else i + 1
+  return ret
+
+
 @dataclass
 class MessageState:
   address: int
@@ -45,6 +78,25 @@ class MessageState:
   first_seen_nanos: int = 0
   last_warning_log_nanos: int = 0
 
+  # decoder plan, compiled once from signals
+  decoders: list[tuple[bool, int, int, int]] = field(init=False, default_factory=list)
+  min_size: int = field(init=False, default=0)
+  has_little_endian: bool = field(init=False, default=False)
+  has_big_endian: bool = field(init=False, default=False)
+  checksum_idx: int = field(init=False, default=-1)
+
+  # opt-in {payload: expected checksum} cache, for static frames that repeat byte for byte
+  checksum_cache: dict[bytes, int] | None = None
+
+  def __post_init__(self) -> None:
+    self.decoders = [get_signal_decoder(sig) for sig in self.signals]
+    # shorter frames fall back to get_raw_value, which truncates signals past the end of the payload
+    self.min_size = max(((sig.msb if sig.is_little_endian else sig.lsb) // 8 + 1 for sig in self.signals), default=0)
+    self.has_little_endian = any(sig.is_little_endian for sig in self.signals)
+    self.has_big_endian = not all(sig.is_little_endian for sig in self.signals)
+    # like CANPacker, only one checksum signal per message
+    self.checksum_idx = next((i for i, sig in enumerate(self.signals) if sig.calc_checksum is not None), -1)
+
   def rate_limited_log(self, last_update_nanos: int, msg: str) -> None:
     if (last_update_nanos - self.last_warning_log_nanos) >= 1_000_000_000:
       carlog.warning(f"CANParser: {hex(self.address)} {self.name} {msg}")
@@ -58,22 +110,36 @@ class MessageState:
     if self.first_seen_nanos == 0:
       self.first_seen_nanos = nanos
 
-    for i, sig in enumerate(self.signals):
-      tmp = get_raw_value(dat, sig)
-      if sig.is_signed:
-        tmp -= ((tmp >> (sig.size - 1)) & 0x1) * (1 << sig.size)
+    fast = len(dat) >= self.min_size
+    size_bits = len(dat) * 8
+    le_dat = int.from_bytes(dat, "little") if fast and self.has_little_endian else 0
+    be_dat = int.from_bytes(dat, "big") if fast and self.has_big_endian else 0
 
-      if not self.ignore_checksum and sig.calc_checksum is not None:
-        expected_checksum = sig.calc_checksum(self.address, sig, bytearray(dat))
-        if tmp != expected_checksum:
-          checksum_failed = True
-          self.rate_limited_log(nanos, f"checksum failed: received {hex(tmp)}, calculated {hex(expected_checksum)}")
+    checksum = 0
+    for i, sig in enumerate(self.signals):
+      little_endian, shift, mask, sign_bit = self.decoders[i]
+      if not fast:
+        tmp = get_raw_value(dat, sig)
+      elif little_endian:
+        tmp = (le_dat >> shift) & mask
+      else:
+        tmp = (be_dat >> (size_bits - shift)) & mask
+      if tmp & sign_bit:
+        tmp -= sign_bit << 1
 
       if not self.ignore_counter and sig.type == 1:  # COUNTER
         if not self.update_counter(tmp, sig.size):
           counter_failed = True
 
       tmp_vals[i] = tmp * sig.factor + sig.offset
+      if i == self.checksum_idx:
+        checksum = tmp
+
+    if not self.ignore_checksum and self.checksum_idx >= 0:
+      expected_checksum = self.calc_checksum(dat)
+      if checksum != expected_checksum:
+        checksum_failed = True
+        self.rate_limited_log(nanos, f"checksum failed: received {hex(checksum)}, calculated {hex(expected_checksum)}")
 
     # must have good counter and checksum to update data
     if checksum_failed or counter_failed:
@@ -96,6 +162,20 @@ class MessageState:
         self.timeout_threshold = (1_000_000_000 / self.frequency) * 10
     return True
 
+  def calc_checksum(self, dat: bytes) -> int:
+    sig = self.signals[self.checksum_idx]
+    if self.checksum_cache is None:
+      return sig.calc_checksum(self.address, sig, memoryview(dat).toreadonly())
+
+    key = bytes(dat)
+    expected_checksum = self.checksum_cache.get(key)
+    if expected_checksum is None:
+      if len(self.checksum_cache) >= CHECKSUM_CACHE_SIZE:
+        self.checksum_cache.clear()
+      expected_checksum = sig.calc_checksum(self.address, sig, memoryview(dat).toreadonly())
+      self.checksum_cache[key] = expected_checksum
+    return expected_checksum
+
   def update_counter(self, cur_count: int, cnt_size: int) -> bool:
     if ((self.counter + 1) & ((1 << cnt_size) - 1)) != cur_count:
       self.counter_fail = min(self.counter_fail + 1, MAX_BAD_COUNTER)
@@ -126,9 +206,10 @@ class VLDict(dict):
 
 
 class CANParser:
-  def __init__(self, dbc_name: str, messages: list[tuple[str | int, int]], bus: int):
+  def __init__(self, dbc_name: str, messages: list[tuple[str | int, int]], bus: int, cache_checksums: bool = False):
     self.dbc_name: str = dbc_name
     self.bus: int = bus
+    self.cache_checksums: bool = cache_checksums
     self.dbc: DBC = DBC(dbc_name)
 
     self.vl: dict[int | str, dict[str, float]] = VLDict(self)
@@ -177,6 +258,7 @@ class CANParser:
       size=msg.size,
       signals=list(msg.sigs.values()),
       ignore_alive=freq is not None and math.isnan(freq),
+      checksum_cache={} if self.cache_checksums else None,
     )
     if freq is not None and freq > 0:
       state.frequency = freq
@@ -253,6 +335,60 @@ class CANParser:
     return updated_addrs
 
 
+def decode_frames(dbc_name: str, addresses, timestamps, data, verify_checksums: bool = False) -> dict[str, dict[str, np.ndarray]]:
+  """Decode a whole log in one vectorized pass per signal.
+
+  addresses and timestamps have one entry per frame, and data is a 2D uint8 array of the payloads, zero
+  padded to the widest frame. Returns {msg_name: {sig_name: values}} for every DBC message present in the
+  log, with the frame timestamps of each message under "ts_nanos". Unlike CANParser, frames with a bad
+  counter or checksum are not dropped. With verify_checksums, messages with a checksum signal also get a
+  boolean "checksum_valid" array.
+  """
+  dbc = DBC(dbc_name)
+  addresses = np.asarray(addresses)
+  timestamps = np.asarray(timestamps)
+  data = np.asarray(data, dtype=np.uint8)
+  if data.ndim != 2 or not (len(addresses) == len(timestamps) == len(data)):
+    raise ValueError(f"expected one address, timestamp and payload row per frame, got {addresses.shape}, {timestamps.shape}, {data.shape}")
+
+  # group frames by address, keeping log order within each message
+  order = np.argsort(addresses, kind="stable")
+  msg_addrs, starts = np.unique(addresses[order], return_index=True)
+  ends = np.append(starts[1:], len(order))
+
+  ret: dict[str, dict[str, np.ndarray]] = {}
+  for address, start, end in zip(msg_addrs, starts, ends, strict=True):
+    msg = dbc.addr_to_msg.get(int(address))
+    if msg is None:
+      continue
+    idxs = order[start:end]
+    dat = data[idxs]
+    if dat.shape[1] < msg.size:
+      dat = np.pad(dat, ((0, 0), (0, msg.size - dat.shape[1])))
+
+    vals: dict[str, np.ndarray] = {"ts_nanos": timestamps[idxs]}
+    for sig in msg.sigs.values():
+      raw = get_raw_values(dat, sig)
+      if verify_checksums and sig.calc_checksum is not None:
+        calc_checksum_batch = CHECKSUM_BATCH_FUNCS.get(sig.calc_checksum)
+        if calc_checksum_batch is not None:
+          expected = calc_checksum_batch(msg.address, sig, dat[:, :msg.size])
+        else:
+          expected = np.array([sig.calc_checksum(msg.address, sig, memoryview(row).toreadonly()) for row in dat[:, :msg.size]])
+        vals["checksum_valid"] = raw == expected
+      if not sig.is_signed:
+        tmp = raw.astype(np.float64)
+      elif sig.size == 64:
+        tmp = raw.view(np.int64).astype(np.float64)
+      else:
+        signed = raw.astype(np.int64)
+        signed -= ((signed >> (sig.size - 1)) & 0x1) << sig.size
+        tmp = signed.astype(np.float64)
+      vals[sig.name] = tmp * sig.factor + sig.offset
+    ret[msg.name] = vals
+  return ret
+
+
 class CANDefine:
   def __init__(self, dbc_name: str):
     dbc = DBC(dbc_name)
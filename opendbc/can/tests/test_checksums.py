@@ -1,6 +1,11 @@
 import copy
+import random
 import unittest
-from opendbc.can import CANPacker, CANParser
+import numpy as np
+
+from opendbc.can import CANPacker, CANParser, decode_frames
+from opendbc.can.dbc import CHECKSUM_BATCH_FUNCS, DBC
+from opendbc.can.tests import ALL_DBCS
 
 
 class TestCanChecksums(unittest.TestCase):
@@ -555,3 +560,55 @@ class TestCanChecksums(unittest.TestCase):
       b'\x9b\x3e\x2b\x10\x00\x00\x22\x81',
       b'\x72\x3f\x2b\x10\x00\x00\x22\x81',
     ])
+
+  def test_readonly_payload(self):
+    # checksums are verified on a read-only view of the received payload, so they must not modify it
+    for dbc_file in ALL_DBCS:
+      dbc = DBC(dbc_file)
+      for msg in dbc.msgs.values():
+        sig = next((s for s in msg.sigs.values() if s.calc_checksum is not None), None)
+        if sig is None:
+          continue
+        with self.subTest(dbc=dbc_file, msg=msg.name):
+          dat = bytes(random.getrandbits(8) for _ in range(msg.size))
+          assert sig.calc_checksum(msg.address, sig, memoryview(dat).toreadonly()) == sig.calc_checksum(msg.address, sig, bytearray(dat))
+
+  def test_checksum_cache(self):
+    dbc_file = "honda_civic_touring_2016_can_generated"
+    packer = CANPacker(dbc_file)
+    parser = CANParser(dbc_file, [("STEERING_CONTROL", 0)], 0)
+    parser_cached = CANParser(dbc_file, [("STEERING_CONTROL", 0)], 0, cache_checksums=True)
+
+    for i in range(100):
+      msg = packer.make_can_msg("STEERING_CONTROL", 0, {"STEER_TORQUE": i % 3})
+      if i % 10 == 0:
+        # corrupt checksum
+        msg = (msg[0], msg[1][:-1] + bytes([msg[1][-1] ^ 0x1]), msg[2])
+      assert parser.update([0, [msg]]) == parser_cached.update([0, [msg]])
+      assert parser.vl["STEERING_CONTROL"] == parser_cached.vl["STEERING_CONTROL"]
+    assert 0 < len(parser_cached.message_states[0xe4].checksum_cache) < 100
+
+  def test_batch_checksums(self):
+    for dbc_file in ALL_DBCS:
+      dbc = DBC(dbc_file)
+      for msg in dbc.msgs.values():
+        sig = next((s for s in msg.sigs.values() if s.calc_checksum in CHECKSUM_BATCH_FUNCS), None)
+        if sig is None:
+          continue
+        with self.subTest(dbc=dbc_file, msg=msg.name):
+          data = np.random.randint(0, 256, (20, msg.size), dtype=np.uint8)
+          expected = [sig.calc_checksum(msg.address, sig, bytes(row)) for row in data]
+          assert CHECKSUM_BATCH_FUNCS[sig.calc_checksum](msg.address, sig, data).tolist() == expected
+
+  def test_decode_frames_checksums(self):
+    dbc_file = "vw_mqb"
+    packer = CANPacker(dbc_file)
+    msgs = [packer.make_can_msg(name, 0, {}) for name in ("HCA_01", "LWI_01", "HCA_01", "Airbag_01")]
+    data = np.array([list(dat) for _, dat, _ in msgs], dtype=np.uint8)
+    data[2, 0] ^= 0x1  # corrupt checksum
+
+    decoded = decode_frames(dbc_file, [addr for addr, _, _ in msgs], range(len(msgs)), data, verify_checksums=True)
+    assert decoded["HCA_01"]["checksum_valid"].tolist() == [True, False]
+    assert decoded["LWI_01"]["checksum_valid"].tolist() == [True]
+    assert decoded["Airbag_01"]["checksum_valid"].tolist() == [True]
+    assert "checksum_valid" not in decode_frames(dbc_file, [addr for addr, _, _ in msgs], range(len(msgs)), data)["HCA_01"]
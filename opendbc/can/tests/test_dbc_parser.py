@@ -1,6 +1,15 @@
+import os
+import subprocess
+import sys
+import tempfile
 import unittest
+from unittest import mock
+
+from opendbc import get_generated_dbcs
 from opendbc.can import CANParser
-from opendbc.can.tests import ALL_DBCS
+from opendbc.can.dbc import DBC, get_dbc_cache_path
+from opendbc.can.tests import ALL_DBCS, TEST_DBC
+from opendbc.dbc.generator.generator import generate_dbc
 
 
 class TestDBCParser(unittest.TestCase):
@@ -20,3 +29,39 @@ class TestDBCParser(unittest.TestCase):
     for dbc in ALL_DBCS:
       with self.subTest(dbc=dbc):
         CANParser(dbc, [], 0)
+
+  def test_dbc_cache(self):
+    with tempfile.TemporaryDirectory() as cache_dir, mock.patch.dict(os.environ, {"OPENDBC_CACHE_DIR": cache_dir}):
+      for dbc_name in (TEST_DBC, "honda_civic_touring_2016_can_generated"):
+        with self.subTest(dbc=dbc_name):
+          # bypass the in-process cache
+          parsed = DBC.__wrapped__(dbc_name)
+          assert len(os.listdir(os.path.join(cache_dir, "dbc"))) > 0
+
+          cached = DBC.__wrapped__(dbc_name)
+          assert cached.name == parsed.name
+          assert cached.msgs == parsed.msgs
+          assert cached.addr_to_msg == parsed.addr_to_msg
+          assert cached.name_to_msg == parsed.name_to_msg
+          assert cached.vals == parsed.vals
+
+      # key changes with content
+      assert get_dbc_cache_path("test", "BO_ 1 A: 8 XXX") != get_dbc_cache_path("test", "BO_ 2 A: 8 XXX")
+
+      # corrupt entries are reparsed
+      for fn in os.listdir(os.path.join(cache_dir, "dbc")):
+        with open(os.path.join(cache_dir, "dbc", fn), "wb") as f:
+          f.write(b"garbage")
+      assert DBC.__wrapped__(TEST_DBC).msgs == DBC(TEST_DBC).msgs
+
+  def test_lazy_generated_dbcs(self):
+    for name, content in get_generated_dbcs().items():
+      with self.subTest(dbc=name):
+        assert generate_dbc(name) == content
+    assert generate_dbc("vw_mqb") is None
+    assert generate_dbc("nonexistent_generated") is None
+
+    # single brand processes shouldn't run other brands' generator scripts
+    code = "import sys; from opendbc.can.dbc import DBC; DBC('toyota_new_mc_pt_generated'); " + \
+           "assert not any(m.startswith(('opendbc.dbc.generator.tesla', 'opendbc.dbc.generator.hyundai')) for m in sys.modules)"
+    subprocess.check_call([sys.executable, "-c", code])
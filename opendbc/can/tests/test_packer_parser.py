@@ -1,8 +1,12 @@
 import unittest
 import random
+import numpy as np
 
-from opendbc.can import CANPacker, CANParser
-from opendbc.can.tests import TEST_DBC
+from opendbc.can import CANPacker, CANParser, decode_frames
+from opendbc.can.dbc import DBC
+from opendbc.can.packer import PreparedMessage
+from opendbc.can.parser import MessageState, get_raw_value
+from opendbc.can.tests import ALL_DBCS, TEST_DBC
 
 MAX_BAD_COUNTER = 5
 
@@ -366,3 +370,71 @@ class TestCanParserPacker(unittest.TestCase):
     assert packer.make_can_msg("ACC_CONTROL", 0, {"UNKNOWN_SIGNAL": 0}) == (835, b'\x00\x00\x00\x00\x00\x00\x00N', 0)
     assert packer.make_can_msg("UNKNOWN_MESSAGE", 0, {"UNKNOWN_SIGNAL": 0}) == (0, b'', 0)
     assert packer.make_can_msg(0, 0, {"UNKNOWN_SIGNAL": 0}) == (0, b'', 0)
+
+  def test_decoder_plan(self):
+    # precompiled decoders must match the per-byte reference decode, including truncated frames
+    for dbc_name in ALL_DBCS:
+      dbc = DBC(dbc_name)
+      for msg in dbc.msgs.values():
+        state = MessageState(msg.address, msg.name, msg.size, list(msg.sigs.values()), ignore_checksum=True, ignore_counter=True)
+        for size in {msg.size, state.min_size, max(state.min_size - 1, 0)}:
+          dat = bytes(random.getrandbits(8) for _ in range(size))
+          assert state.parse(0, dat)
+          for i, sig in enumerate(state.signals):
+            raw = get_raw_value(dat, sig)
+            if sig.is_signed:
+              raw -= ((raw >> (sig.size - 1)) & 0x1) * (1 << sig.size)
+            assert state.vals[i] == raw * sig.factor + sig.offset, (dbc_name, msg.name, sig.name, size)
+
+  def test_decode_frames(self):
+    # bulk decode must match frame by frame parsing
+    for dbc_name in (TEST_DBC, "honda_civic_touring_2016_can_generated", "vw_mqb"):
+      dbc = DBC(dbc_name)
+      packer = CANPacker(dbc_name)
+      parser = CANParser(dbc_name, [(addr, 0) for addr in dbc.msgs], 0)
+
+      frames = []
+      for i in range(200):
+        msg = random.choice(list(dbc.msgs.values()))
+        values = {s.name: random.randint(0, 3) for s in msg.sigs.values() if s.name not in ("COUNTER", "CHECKSUM")}
+        frames.append((i * 1000, packer.make_can_msg(msg.address, 0, values)))
+      parser.update([[t, [f]] for t, f in frames])
+
+      data = np.zeros((len(frames), 64), dtype=np.uint8)
+      for i, (_, (_, dat, _)) in enumerate(frames):
+        data[i, :len(dat)] = np.frombuffer(dat, dtype=np.uint8)
+      decoded = decode_frames(dbc_name, [f[0] for _, f in frames], [t for t, _ in frames], data)
+
+      assert set(decoded) == {dbc.addr_to_msg[f[0]].name for _, f in frames}
+      for msg_name, vals in decoded.items():
+        assert vals["ts_nanos"].tolist() == [t for t, f in frames if dbc.addr_to_msg[f[0]].name == msg_name]
+        for sig_name, sig_vals in parser.vl_all[msg_name].items():
+          np.testing.assert_allclose(vals[sig_name], sig_vals)
+
+  def test_prepared_message(self):
+    # int-based encoders must match byte by byte packing, for little, big and mixed endian messages
+    for dbc_name in (TEST_DBC, "honda_civic_touring_2016_can_generated", "vw_mqb", "hyundai_canfd_generated"):
+      dbc = DBC(dbc_name)
+      for msg in dbc.msgs.values():
+        fast = PreparedMessage(msg, {})
+        slow = PreparedMessage(msg, {})
+        slow.fast = False
+        for _ in range(5):
+          values = {s.name: random.randint(-(1 << s.size), 1 << s.size) * s.factor + s.offset for s in msg.sigs.values()}
+          assert fast.pack(values) == slow.pack(values), (dbc_name, msg.name)
+          assert fast.pack({}) == slow.pack({}), (dbc_name, msg.name)
+
+  def test_pack_many(self):
+    dbc_name = "honda_civic_touring_2016_can_generated"
+    packer = CANPacker(dbc_name)
+    packer_many = CANPacker(dbc_name)
+
+    steering_control = packer_many.prepare("STEERING_CONTROL")
+    assert steering_control is packer_many.prepare(steering_control.address)
+    with self.assertRaises(RuntimeError):
+      packer_many.prepare("UNKNOWN_MESSAGE")
+
+    for steer in range(-100, 100):
+      msgs = [(0xe4, {"STEER_TORQUE": steer}), (0x1fa, {"COMPUTER_BRAKE": abs(steer)}), (0xe4, {})]
+      assert packer_many.pack_many(msgs) == [packer.pack(addr, values) for addr, values in msgs]
+      assert steering_control.make_can_msg(0, {"STEER_TORQUE": steer}) == packer.make_can_msg("STEERING_CONTROL", 0, {"STEER_TORQUE": steer})
@@ -0,0 +1,94 @@
+import os
+import shutil
+import tempfile
+import numpy as np
+from dataclasses import dataclass, fields
+
+from opendbc.car.can_definitions import CanData
+from opendbc.car.logreader import LogReader, get_log_cache_path
+
+CAN_LOG_VERSION = 1
+
+
+@dataclass
+class CanLog:
+  """Columnar store of the CAN packets in a log, replayable without decoding any capnp.
+  Packet i holds frames packet_offsets[i]:packet_offsets[i+1], and frame j's payload is payload[offsets[j]:offsets[j+1]]."""
+  mono_times: np.ndarray  # per packet
+  packet_offsets: np.ndarray
+  addresses: np.ndarray  # per frame
+  buses: np.ndarray
+  offsets: np.ndarray
+  payload: np.ndarray
+
+  @classmethod
+  def from_events(cls, events) -> 'CanLog':
+    mono_times, packet_offsets, addresses, buses, offsets, payload = [], [0], [], [], [0], []
+    for evt in events:
+      mono_times.append(evt.logMonoTime)
+      for c in evt.can:
+        addresses.append(c.address)
+        buses.append(c.src)
+        payload.append(c.dat)
+        offsets.append(offsets[-1] + len(c.dat))
+      packet_offsets.append(len(addresses))
+
+    return cls(np.array(mono_times, dtype=np.uint64), np.array(packet_offsets, dtype=np.uint64), np.array(addresses, dtype=np.uint32),
+               np.array(buses, dtype=np.uint8), np.array(offsets, dtype=np.uint64), np.frombuffer(b"".join(payload), dtype=np.uint8))
+
+  @classmethod
+  def from_log(cls, fn: str) -> 'CanLog':
+    """Convert the can events of a log, sorted by time as replays expect."""
+    return cls.from_events(LogReader(fn, sort_by_time=True, types={'can'}))
+
+  def save(self, path: str):
+    """Save as a single .npz, or as a directory of .npy files that load() memory-maps."""
+    columns = {f.name: getattr(self, f.name) for f in fields(self)}
+    if path.endswith(".npz"):
+      np.savez(path, **columns)
+    else:
+      os.makedirs(path, exist_ok=True)
+      for name, arr in columns.items():
+        np.save(os.path.join(path, f"{name}.npy"), arr)
+
+  @classmethod
+  def load(cls, path: str) -> 'CanLog':
+    if path.endswith(".npz"):
+      with np.load(path) as columns:
+        return cls(**{f.name: columns[f.name] for f in fields(cls)})
+    return cls(**{f.name: np.load(os.path.join(path, f"{f.name}.npy"), mmap_mode='r') for f in fields(cls)})
+
+  def __len__(self) -> int:
+    return len(self.mono_times)
+
+  def __iter__(self):
+    """Yield (nanos, [CanData, ...]) packets, as CarInterfaceBase.update and CANParser.update take them."""
+    packet_offsets, addresses, buses, offsets = self.packet_offsets.tolist(), self.addresses.tolist(), self.buses.tolist(), self.offsets.tolist()
+    payload = self.payload.tobytes()
+    for i, nanos in enumerate(self.mono_times.tolist()):
+      yield nanos, [CanData(addresses[j], payload[offsets[j]:offsets[j + 1]], buses[j]) for j in range(packet_offsets[i], packet_offsets[i + 1])]
+
+
+def load_can_log(fn: str) -> CanLog:
+  """CAN packets of a log, converted on first use into a memory-mappable store in the cache dir."""
+  cache_path = get_log_cache_path(fn, f".can{CAN_LOG_VERSION}")
+  try:
+    return CanLog.load(cache_path)
+  except Exception:
+    # missing or corrupt store, convert the log
+    pass
+
+  can_log = CanLog.from_log(fn)
+
+  # publish atomically so concurrent processes never load a partial store
+  try:
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    tmp_path = tempfile.mkdtemp(dir=os.path.dirname(cache_path), suffix=".tmp")
+  except OSError:
+    return can_log
+  try:
+    can_log.save(tmp_path)
+    os.replace(tmp_path, cache_path)
+  except OSError:
+    shutil.rmtree(tmp_path, ignore_errors=True)
+  return can_log
@@ -5,8 +5,9 @@ from opendbc.car import gen_empty_fingerprint
 from opendbc.car.can_definitions import CanRecvCallable, CanSendCallable
 from opendbc.car.carlog import carlog
 from opendbc.car.structs import CarParams, CarParamsT
-from opendbc.car.fingerprints import eliminate_incompatible_cars, all_legacy_fingerprint_cars
-from opendbc.car.fw_versions import ObdCallback, get_fw_versions_ordered, get_present_ecus, match_fw_to_car
+from opendbc.car.fingerprints import all_legacy_fingerprint_cars, cars_to_mask, eliminate_incompatible_cars_mask, mask_to_cars
+from opendbc.car.fingerprint_cache import load_cached_fw, save_cached_fw
+from opendbc.car.fw_versions import ObdCallback, get_fw_versions_ordered, get_present_ecus, match_fw_to_car, verify_fw_versions
 from opendbc.car.mock.values import CAR as MOCK
 from opendbc.car.values import BRANDS
 from opendbc.car.vin import get_vin, is_valid_vin, VIN_UNKNOWN
@@ -41,7 +42,8 @@ interfaces = load_interfaces(interface_names)
 
 def can_fingerprint(can_recv: CanRecvCallable) -> tuple[str | None, dict[int, dict]]:
   finger = gen_empty_fingerprint()
-  candidate_cars = {i: all_legacy_fingerprint_cars() for i in [0, 1]}  # attempt fingerprint on both bus 0 and 1
+  # candidates as bitmasks of cars, so eliminating is one lookup and AND per msg
+  candidate_cars = {i: cars_to_mask(all_legacy_fingerprint_cars()) for i in [0, 1]}  # attempt fingerprint on both bus 0 and 1
   frame = 0
   car_fingerprint = None
   done = False
@@ -58,20 +60,19 @@ def can_fingerprint(can_recv: CanRecvCallable) -> tuple[str | None, dict[int, di
             finger[can.src] = {}
           finger[can.src][can.address] = len(can.dat)
 
-        for b in candidate_cars:
-          # Ignore extended messages and VIN query response.
-          if can.src == b and can.address < 0x800 and can.address not in (0x7df, 0x7e0, 0x7e8):
-            candidate_cars[b] = eliminate_incompatible_cars(can, candidate_cars[b])
+        # Ignore extended messages and VIN query response.
+        if can.src in candidate_cars and can.address < 0x800 and can.address not in (0x7df, 0x7e0, 0x7e8):
+          candidate_cars[can.src] = eliminate_incompatible_cars_mask(can, candidate_cars[can.src])
 
       # if we only have one car choice and the time since we got our first
       # message has elapsed, exit
       for b in candidate_cars:
-        if len(candidate_cars[b]) == 1 and frame > FRAME_FINGERPRINT:
+        if candidate_cars[b].bit_count() == 1 and frame > FRAME_FINGERPRINT:
           # fingerprint done
-          car_fingerprint = candidate_cars[b][0]
+          car_fingerprint = mask_to_cars(candidate_cars[b])[0]
 
       # bail if no cars left or we've been waiting for more than 2s
-      failed = (all(len(cc) == 0 for cc in candidate_cars.values()) and frame > FRAME_FINGERPRINT) or frame > 200
+      failed = (all(cc == 0 for cc in candidate_cars.values()) and frame > FRAME_FINGERPRINT) or frame > 200
       succeeded = car_fingerprint is not None
       done = failed or succeeded
 
@@ -83,9 +84,13 @@ def can_fingerprint(can_recv: CanRecvCallable) -> tuple[str | None, dict[int, di
 # **** for use live only ****
 def fingerprint(can_recv: CanRecvCallable, can_send: CanSendCallable, set_obd_multiplexing: ObdCallback,
                 cached_params: CarParamsT | None) -> tuple[str | None, dict, str, list[CarParams.CarFw], CarParams.FingerprintSource, bool]:
+  """Identifies the car from its VIN, FW versions and CAN fingerprint.
+  Set ENABLE_FW_CACHE to reuse the FW versions saved for a VIN after re-checking its essential ECUs. Unlike a background
+  revalidation, that check runs here and blocks startup, so the cache is opt-in until it's been exercised on hardware"""
   fixed_fingerprint = os.environ.get('FINGERPRINT', "")
   skip_fw_query = os.environ.get('SKIP_FW_QUERY', False)
   disable_fw_cache = os.environ.get('DISABLE_FW_CACHE', False)
+  enable_fw_cache = os.environ.get('ENABLE_FW_CACHE', False)
   ecu_rx_addrs = set()
 
   start_time = time.monotonic()
@@ -104,8 +109,19 @@ def fingerprint(can_recv: CanRecvCallable, can_send: CanSendCallable, set_obd_mu
       # VIN query only reliably works through OBDII
       vin_rx_addr, vin_rx_bus, vin = get_vin(can_recv, can_send, (0, 1))
       ecu_rx_addrs = get_present_ecus(can_recv, can_send, set_obd_multiplexing)
-      car_fw = get_fw_versions_ordered(can_recv, can_send, set_obd_multiplexing, vin, ecu_rx_addrs)
-      cached = False
+
+      # a car seen before only needs its essential ECUs re-checked
+      use_fw_cache = enable_fw_cache and is_valid_vin(vin) and vin != VIN_UNKNOWN and not disable_fw_cache
+      cached_fw = load_cached_fw(vin, ecu_rx_addrs) if use_fw_cache else None
+      if cached_fw is not None and verify_fw_versions(can_recv, can_send, set_obd_multiplexing, cached_fw):
+        carlog.warning("Using cached FW versions")
+        car_fw = cached_fw
+        cached = True
+      else:
+        car_fw = get_fw_versions_ordered(can_recv, can_send, set_obd_multiplexing, vin, ecu_rx_addrs)
+        cached = False
+        if use_fw_cache and len(car_fw) > 0:
+          save_cached_fw(vin, ecu_rx_addrs, car_fw)
 
     exact_fw_match, fw_candidates = match_fw_to_car(car_fw, vin)
   else:
@@ -1,5 +1,7 @@
+import numpy as np
+
 from opendbc.car import structs
-from opendbc.car.crc import CRC8J1850
+from opendbc.car.crc import CRC8J1850, crc8_batch
 from opendbc.car.chrysler.values import CUSW_CARS, RAM_CARS
 
 GearShifter = structs.CarState.GearShifter
@@ -73,7 +75,7 @@ def create_cruise_buttons(packer, frame, bus, cancel=False, resume=False):
   return packer.make_can_msg("CRUISE_BUTTONS", bus, values)
 
 
-def chrysler_checksum(address: int, sig, d: bytearray) -> int:
+def chrysler_checksum(address: int, sig, d: bytes | bytearray | memoryview) -> int:
   checksum = 0xFF
   for j in range(len(d) - 1):
     curr = d[j]
@@ -98,16 +100,20 @@ def chrysler_checksum(address: int, sig, d: bytearray) -> int:
   return (~checksum) & 0xFF
 
 
-def fca_giorgio_checksum(address: int, sig, d: bytearray) -> int:
+FCA_GIORGIO_FINAL_XOR = {
+  0xDE: 0x10,
+  0x106: 0xF6,
+  0x122: 0xF1,
+}
+
+
+def fca_giorgio_checksum(address: int, sig, d: bytes | bytearray | memoryview) -> int:
   crc = 0
   for i in range(len(d) - 1):
     crc ^= d[i]
     crc = CRC8J1850[crc]
-  if address == 0xDE:
-    return crc ^ 0x10
-  elif address == 0x106:
-    return crc ^ 0xF6
-  elif address == 0x122:
-    return crc ^ 0xF1
-  else:
-    return crc ^ 0x0A
+  return crc ^ FCA_GIORGIO_FINAL_XOR.get(address, 0x0A)
+
+
+def fca_giorgio_checksum_batch(address: int, sig, data: np.ndarray) -> np.ndarray:
+  return crc8_batch(CRC8J1850, data[:, :-1]) ^ FCA_GIORGIO_FINAL_XOR.get(address, 0x0A)
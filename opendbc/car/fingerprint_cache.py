@@ -0,0 +1,50 @@
+import hashlib
+import os
+import tempfile
+
+from opendbc import get_cache_dir
+from opendbc.car.carlog import carlog
+from opendbc.car.fw_query_definitions import EcuAddrBusType
+from opendbc.car.structs import CarParams
+
+# bump to invalidate cached FW versions
+FINGERPRINT_CACHE_VERSION = 1
+
+
+def get_fingerprint_cache_path(vin: str, ecu_rx_addrs: set[EcuAddrBusType]) -> str:
+  """A car is identified by its VIN and the ECUs that answered get_present_ecus"""
+  key = f"{FINGERPRINT_CACHE_VERSION}:{vin}:{sorted(ecu_rx_addrs, key=repr)}"
+  return os.path.join(get_cache_dir("fingerprints"), f"{hashlib.sha256(key.encode()).hexdigest()[:32]}.bin")
+
+
+def load_cached_fw(vin: str, ecu_rx_addrs: set[EcuAddrBusType]) -> list[CarParams.CarFw] | None:
+  """FW versions last queried from this car, None if it hasn't been seen"""
+  try:
+    with open(get_fingerprint_cache_path(vin, ecu_rx_addrs), "rb") as f:
+      dat = f.read()
+    with CarParams.from_bytes(dat) as CP:
+      if CP.carVin != vin:
+        return None
+      return [fw.as_builder() for fw in CP.carFw]
+  except Exception:
+    # missing or corrupt
+    return None
+
+
+def save_cached_fw(vin: str, ecu_rx_addrs: set[EcuAddrBusType], car_fw: list[CarParams.CarFw]) -> None:
+  path = get_fingerprint_cache_path(vin, ecu_rx_addrs)
+
+  # publish atomically so a concurrent load never reads a partial file
+  try:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+  except OSError:
+    carlog.warning("failed to save FW versions to the fingerprint cache")
+    return
+  try:
+    with os.fdopen(fd, "wb") as f:
+      f.write(CarParams.new_message(carVin=vin, carFw=car_fw).to_bytes())
+    os.replace(tmp_path, path)
+  except OSError:
+    os.unlink(tmp_path)
+    carlog.warning("failed to save FW versions to the fingerprint cache")
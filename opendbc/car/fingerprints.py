@@ -25,6 +25,41 @@ def is_valid_for_fingerprint(msg, car_fingerprint: dict[int, int]):
   return (adr in car_fingerprint and car_fingerprint[adr] == len(msg.dat)) or adr >= 0x800
 
 
+def _build_fingerprint_index(fingerprints: dict[str, list[dict[int, int]]]) -> dict[tuple[int, int], int]:
+  """Maps each (address, length) to a bitmask of the cars with any fingerprint containing it, bit i being the i-th car."""
+  index: dict[tuple[int, int], int] = {}
+  for i, fingerprints_car in enumerate(fingerprints.values()):
+    for fingerprint in fingerprints_car:
+      # add alien debug address
+      for msg in (fingerprint | _DEBUG_ADDRESS).items():
+        index[msg] = index.get(msg, 0) | (1 << i)
+  return index
+
+
+_FINGERPRINT_INDEX = _build_fingerprint_index(_FINGERPRINTS)
+_CAR_BITS = {car_name: 1 << i for i, car_name in enumerate(_FINGERPRINTS)}
+
+
+def cars_to_mask(cars) -> int:
+  """Bitmask of legacy fingerprint cars, as used by eliminate_incompatible_cars_mask."""
+  mask = 0
+  for car_name in cars:
+    mask |= _CAR_BITS[car_name]
+  return mask
+
+
+def mask_to_cars(mask: int) -> list[str]:
+  return [car_name for car_name, bit in _CAR_BITS.items() if mask & bit]
+
+
+def eliminate_incompatible_cars_mask(msg, candidates: int) -> int:
+  """Like eliminate_incompatible_cars, with the candidates as a bitmask from cars_to_mask. Costs one dict lookup per msg."""
+  # ignore addresses that are more than 11 bits
+  if msg.address >= 0x800:
+    return candidates
+  return candidates & _FINGERPRINT_INDEX.get((msg.address, len(msg.dat)), 0)
+
+
 def eliminate_incompatible_cars(msg, candidate_cars):
   """Removes cars that could not have sent msg.
 
@@ -35,18 +70,8 @@ def eliminate_incompatible_cars(msg, candidate_cars):
      Returns:
       A list containing the subset of candidate_cars that could have sent msg.
   """
-  compatible_cars = []
-
-  for car_name in candidate_cars:
-    car_fingerprints = _FINGERPRINTS[car_name]
-
-    for fingerprint in car_fingerprints:
-      # add alien debug address
-      if is_valid_for_fingerprint(msg, fingerprint | _DEBUG_ADDRESS):
-        compatible_cars.append(car_name)
-        break
-
-  return compatible_cars
+  compatible = eliminate_incompatible_cars_mask(msg, cars_to_mask(candidate_cars))
+  return [car_name for car_name in candidate_cars if compatible & _CAR_BITS[car_name]]
 
 
 def all_legacy_fingerprint_cars():
@@ -1,22 +1,30 @@
+import json
+import os
 from collections import defaultdict
 from collections.abc import Callable, Iterator
+from dataclasses import dataclass, field
+from functools import cache
 from typing import Protocol, TypeVar
 
 from tqdm import tqdm
 
+from opendbc import get_cache_dir
 from opendbc.car import uds
 from opendbc.car.can_definitions import CanRecvCallable, CanSendCallable
 from opendbc.car.carlog import carlog
 from opendbc.car.structs import CarParams
 from opendbc.car.ecu_addrs import get_ecu_addrs
 from opendbc.car.fingerprints import FW_VERSIONS
-from opendbc.car.fw_query_definitions import ESSENTIAL_ECUS, AddrType, EcuAddrBusType, FwQueryConfig, LiveFwVersions, OfflineFwVersions
+from opendbc.car.fw_query_definitions import ESSENTIAL_ECUS, AddrType, EcuAddrBusType, FwQueryConfig, LiveFwVersions, OfflineFwVersions, Request
 from opendbc.car.interfaces import get_interface_attr
-from opendbc.car.isotp_parallel_query import IsoTpParallelQuery
+from opendbc.car.isotp_parallel_query import IsoTpParallelQuery, get_data_concurrently
 
 Ecu = CarParams.Ecu
 FUZZY_EXCLUDE_ECUS = [Ecu.fwdCamera, Ecu.fwdRadar, Ecu.eps, Ecu.debug]
 
+# with adaptive timeouts, how long past the expected response latency to keep waiting on silent ECUs
+EARLY_EXIT_GRACE = 0.03
+
 FW_QUERY_CONFIGS: dict[str, FwQueryConfig] = get_interface_attr('FW_QUERY_CONFIG', ignore_none=True)
 VERSIONS = get_interface_attr('FW_VERSIONS', ignore_none=True)
 
@@ -46,25 +54,25 @@ def build_fw_dict(fw_versions: list[CarParams.CarFw], filter_brand: str | None =
   return dict(fw_versions_dict)
 
 
-class MatchFwToCar(Protocol):
-  def __call__(self, live_fw_versions: LiveFwVersions, match_brand: str | None = None, log: bool = True) -> set[str]:
-    ...
+@dataclass(frozen=True)
+class FwIndex:
+  """Lookup tables over the offline FW versions of some cars, shared by the exact and fuzzy matchers"""
+  # (addr, sub_addr, fw) -> cars with that FW version, excluding ECUs shared between models
+  fuzzy: dict[tuple[int, int | None, bytes], tuple[str, ...]]
+  # car -> ((ecu, expected FW versions), ...)
+  expected: dict[str, tuple[tuple[tuple[CarParams.Ecu, int, int | None], frozenset[bytes]], ...]]
 
 
-def match_fw_to_car_fuzzy(live_fw_versions: LiveFwVersions, match_brand: str | None = None, log: bool = True, exclude: str | None = None) -> set[str]:
-  """Do a fuzzy FW match. This function will return a match, and the number of firmware version
-  that were matched uniquely to that specific car. If multiple ECUs uniquely match to different cars
-  the match is rejected."""
-
-  # Build lookup table from (addr, sub_addr, fw) to list of candidate cars
-  all_fw_versions = defaultdict(list)
+@cache
+def get_fw_index(brand: str | None) -> FwIndex:
+  """Index of the cars of a brand, or of all brands. Built once per process, on first use"""
+  fuzzy: defaultdict[tuple[int, int | None, bytes], list[str]] = defaultdict(list)
+  expected = {}
   for candidate, fw_by_addr in FW_VERSIONS.items():
-    if not is_brand(MODEL_TO_BRAND[candidate], match_brand):
-      continue
-
-    if candidate == exclude:
+    if not is_brand(MODEL_TO_BRAND[candidate], brand):
       continue
 
+    expected[candidate] = tuple((ecu, frozenset(fws)) for ecu, fws in fw_by_addr.items())
     for addr, fws in fw_by_addr.items():
       # These ECUs are known to be shared between models (EPS only between hybrid/ICE version)
       # Getting this exactly right isn't crucial, but excluding camera and radar makes it almost
@@ -73,7 +81,23 @@ def match_fw_to_car_fuzzy(live_fw_versions: LiveFwVersions, match_brand: str | N
       if addr[0] in FUZZY_EXCLUDE_ECUS:
         continue
       for f in fws:
-        all_fw_versions[(addr[1], addr[2], f)].append(candidate)
+        fuzzy[(addr[1], addr[2], f)].append(candidate)
+
+  return FwIndex({k: tuple(v) for k, v in fuzzy.items()}, expected)
+
+
+class MatchFwToCar(Protocol):
+  def __call__(self, live_fw_versions: LiveFwVersions, match_brand: str | None = None, log: bool = True) -> set[str]:
+    ...
+
+
+def match_fw_to_car_fuzzy(live_fw_versions: LiveFwVersions, match_brand: str | None = None, log: bool = True, exclude: str | None = None) -> set[str]:
+  """Do a fuzzy FW match. This function will return a match, and the number of firmware version
+  that were matched uniquely to that specific car. If multiple ECUs uniquely match to different cars
+  the match is rejected."""
+
+  # Lookup table from (addr, sub_addr, fw) to candidate cars
+  all_fw_versions = get_fw_index(match_brand).fuzzy
 
   matched_ecus = set()
   match: str | None = None
@@ -81,7 +105,9 @@ def match_fw_to_car_fuzzy(live_fw_versions: LiveFwVersions, match_brand: str | N
     ecu_key = (addr[0], addr[1])
     for version in versions:
       # All cars that have this FW response on the specified address
-      candidates = all_fw_versions[(*ecu_key, version)]
+      candidates = all_fw_versions.get((*ecu_key, version), ())
+      if exclude is not None:
+        candidates = tuple(c for c in candidates if c != exclude)
 
       if len(candidates) == 1:
         matched_ecus.add(ecu_key)
@@ -111,13 +137,14 @@ def match_fw_to_car_exact(live_fw_versions: LiveFwVersions, match_brand: str | N
     extra_fw_versions = {}
 
   invalid = set()
-  candidates = {c: f for c, f in FW_VERSIONS.items() if
-                is_brand(MODEL_TO_BRAND[c], match_brand)}
+  candidates = get_fw_index(match_brand).expected
 
   for candidate, fws in candidates.items():
     config = FW_QUERY_CONFIGS[MODEL_TO_BRAND[candidate]]
-    for ecu, expected_versions in fws.items():
-      expected_versions = expected_versions + extra_fw_versions.get(candidate, {}).get(ecu, [])
+    extra_versions = extra_fw_versions.get(candidate, {})
+    for ecu, expected_versions in fws:
+      if ecu in extra_versions:
+        expected_versions = expected_versions | set(extra_versions[ecu])
       ecu_type = ecu[0]
       addr = ecu[1:]
 
@@ -136,7 +163,7 @@ def match_fw_to_car_exact(live_fw_versions: LiveFwVersions, match_brand: str | N
       if ecu_type == Ecu.debug:
         continue
 
-      if not any(found_version in expected_versions for found_version in found_versions):
+      if expected_versions.isdisjoint(found_versions):
         invalid.add(candidate)
         break
 
@@ -224,8 +251,99 @@ def get_brand_ecu_matches(ecu_rx_addrs: set[EcuAddrBusType]) -> dict[str, list[b
   return brand_matches
 
 
+@dataclass(eq=False)
+class FwQueryJob:
+  """One request to a set of ECUs, as run by a single IsoTpParallelQuery"""
+  brand: str
+  config: FwQueryConfig
+  request: Request
+  addrs: list[AddrType]
+
+  @property
+  def obd_multiplexing(self) -> bool | None:
+    """OBD multiplexing mode this query needs, None if its bus isn't multiplexed"""
+    return self.request.obd_multiplexing if self.request.bus % 4 == 1 else None
+
+  def conflicts(self, other: 'FwQueryJob') -> bool:
+    """Queries on the same bus conflict if they share an address, either would take the other's responses"""
+    if self.request.bus != other.request.bus:
+      return False
+    addrs = {a for a, _ in self.addrs} | {uds.get_rx_addr_for_tx_addr(a, self.request.rx_offset) for a, _ in self.addrs}
+    other_addrs = {a for a, _ in other.addrs} | {uds.get_rx_addr_for_tx_addr(a, other.request.rx_offset) for a, _ in other.addrs}
+    return not addrs.isdisjoint(other_addrs)
+
+
+def schedule_fw_queries(jobs: list[FwQueryJob]) -> list[list[int]]:
+  """Packs queries into rounds to run concurrently, returning the indexes of each round's jobs. Each round uses one
+  OBD multiplexing mode, and a query never runs before or alongside an earlier query it conflicts with."""
+  rounds = []
+  pending = list(range(len(jobs)))
+  while len(pending):
+    scheduled: list[int] = []
+    skipped: list[int] = []
+    obd_multiplexing = None
+    for i in pending:
+      job = jobs[i]
+      if any(job.conflicts(jobs[other]) for other in scheduled + skipped) or \
+         (job.obd_multiplexing is not None and obd_multiplexing not in (None, job.obd_multiplexing)):
+        skipped.append(i)
+      else:
+        scheduled.append(i)
+        if job.obd_multiplexing is not None:
+          obd_multiplexing = job.obd_multiplexing
+    rounds.append(scheduled)
+    pending = skipped
+  return rounds
+
+
+@dataclass
+class FwQueryLatencies:
+  """Slowest first response seen from each ECU, and for each brand's request, kept across runs"""
+  latencies: dict[str, float] = field(default_factory=dict)
+  path: str | None = None
+
+  @staticmethod
+  def _key(job: FwQueryJob, addr: AddrType | None = None) -> str:
+    key = f"{job.brand}:{job.request.bus}:{b','.join(job.request.request).hex()}"
+    return key if addr is None else f"{key}:{addr[0]:x}:{addr[1]}"
+
+  @classmethod
+  def load(cls, path: str | None = None) -> 'FwQueryLatencies':
+    path = path or os.path.join(get_cache_dir("fw_versions"), "response_latencies.json")
+    try:
+      with open(path) as f:
+        return cls(json.load(f), path)
+    except (OSError, ValueError):
+      return cls(path=path)
+
+  def save(self) -> None:
+    if self.path is None:
+      return
+    try:
+      os.makedirs(os.path.dirname(self.path), exist_ok=True)
+      tmp_path = f"{self.path}.{os.getpid()}.tmp"
+      with open(tmp_path, "w") as f:
+        json.dump(self.latencies, f)
+      os.replace(tmp_path, self.path)
+    except OSError:
+      carlog.exception("failed to save FW query latencies")
+
+  def expected(self, job: FwQueryJob) -> float:
+    """Latency of the ECUs of a query that have answered it before, else of the brand's request. 0 if never answered"""
+    ecu_latencies = [self.latencies[k] for addr in job.addrs if (k := self._key(job, addr)) in self.latencies]
+    if len(ecu_latencies):
+      return max(ecu_latencies)
+    return self.latencies.get(self._key(job), 0.)
+
+  def update(self, job: FwQueryJob, response_latencies: dict[AddrType, float]) -> None:
+    for addr, latency in response_latencies.items():
+      for key in (self._key(job, addr), self._key(job)):
+        self.latencies[key] = max(self.latencies.get(key, 0.), latency)
+
+
 def get_fw_versions_ordered(can_recv: CanRecvCallable, can_send: CanSendCallable, set_obd_multiplexing: ObdCallback, vin: str,
-                            ecu_rx_addrs: set[EcuAddrBusType], timeout: float = 0.1, progress: bool = False) -> list[CarParams.CarFw]:
+                            ecu_rx_addrs: set[EcuAddrBusType], timeout: float = 0.1, progress: bool = False,
+                            adaptive_timeout: bool = False) -> list[CarParams.CarFw]:
   """Queries for FW versions ordering brands by likelihood, breaks when exact match is found"""
 
   all_car_fw = []
@@ -238,7 +356,8 @@ def get_fw_versions_ordered(can_recv: CanRecvCallable, can_send: CanSendCallable
     if True not in brand_matches[brand]:
       continue
 
-    car_fw = get_fw_versions(can_recv, can_send, set_obd_multiplexing, query_brand=brand, timeout=timeout, progress=progress)
+    car_fw = get_fw_versions(can_recv, can_send, set_obd_multiplexing, query_brand=brand, timeout=timeout, progress=progress,
+                             adaptive_timeout=adaptive_timeout)
     all_car_fw.extend(car_fw)
 
     # If there is a match using this brand's FW alone, finish querying early
@@ -250,7 +369,10 @@ def get_fw_versions_ordered(can_recv: CanRecvCallable, can_send: CanSendCallable
 
 
 def get_fw_versions(can_recv: CanRecvCallable, can_send: CanSendCallable, set_obd_multiplexing: ObdCallback, query_brand: str | None = None,
-                    extra: OfflineFwVersions | None = None, timeout: float = 0.1, progress: bool = False) -> list[CarParams.CarFw]:
+                    extra: OfflineFwVersions | None = None, timeout: float = 0.1, progress: bool = False,
+                    adaptive_timeout: bool = False) -> list[CarParams.CarFw]:
+  """With adaptive_timeout, queries stop waiting on silent ECUs once those expected to answer had the time to,
+  going by the response latencies of past runs and of the current query"""
   versions = VERSIONS.copy()
 
   if query_brand is not None:
@@ -281,40 +403,114 @@ def get_fw_versions(can_recv: CanRecvCallable, can_send: CanSendCallable, set_ob
 
   addrs.insert(0, parallel_addrs)
 
-  # Get versions and build capnp list to put into CarParams
-  car_fw = []
+  # Build every query, then run them in rounds of non-conflicting queries
+  jobs = []
   requests = [(brand, config, r) for brand, config, r in REQUESTS if is_brand(brand, query_brand)]
-  for addr_group in tqdm(addrs, disable=not progress):  # split by subaddr, if any
+  for addr_group in addrs:  # split by subaddr, if any
     for addr_chunk in chunks(addr_group):
       for brand, config, r in requests:
-        # Toggle OBD multiplexing for each request
-        if r.bus % 4 == 1:
-          set_obd_multiplexing(r.obd_multiplexing)
-
-        try:
-          query_addrs = [(a, s) for (b, a, s) in addr_chunk if b in (brand, 'any') and
-                         (len(r.whitelist_ecus) == 0 or ecu_types[(b, a, s)] in r.whitelist_ecus)]
-
-          if query_addrs:
-            query = IsoTpParallelQuery(can_send, can_recv, r.bus, query_addrs, r.request, r.response, r.rx_offset)
-            for (tx_addr, sub_addr), version in query.get_data(timeout).items():
-              f = CarParams.CarFw()
-
-              f.ecu = ecu_types.get((brand, tx_addr, sub_addr), Ecu.unknown)
-              f.fwVersion = version
-              f.address = tx_addr
-              f.responseAddress = uds.get_rx_addr_for_tx_addr(tx_addr, r.rx_offset)
-              f.request = r.request
-              f.brand = brand
-              f.bus = r.bus
-              f.logging = r.logging or (f.ecu, tx_addr, sub_addr) in config.extra_ecus
-              f.obdMultiplexing = r.obd_multiplexing
-
-              if sub_addr is not None:
-                f.subAddress = sub_addr
-
-              car_fw.append(f)
-        except Exception:
-          carlog.exception("FW query exception")
+        query_addrs = [(a, s) for (b, a, s) in addr_chunk if b in (brand, 'any') and
+                       (len(r.whitelist_ecus) == 0 or ecu_types[(b, a, s)] in r.whitelist_ecus)]
+        if query_addrs:
+          jobs.append(FwQueryJob(brand, config, r, query_addrs))
+
+  latencies = FwQueryLatencies.load() if adaptive_timeout else None
+  results = run_fw_queries(can_recv, can_send, set_obd_multiplexing, jobs, timeout, progress, latencies)
 
+  # Build capnp list to put into CarParams, in the same order as querying one at a time
+  car_fw = []
+  for job, job_results in zip(jobs, results, strict=True):
+    car_fw.extend(build_car_fw(job, tx_addr, sub_addr, version, ecu_types) for (tx_addr, sub_addr), version in job_results.items())
   return car_fw
+
+
+def run_fw_queries(can_recv: CanRecvCallable, can_send: CanSendCallable, set_obd_multiplexing: ObdCallback, jobs: list[FwQueryJob],
+                   timeout: float = 0.1, progress: bool = False, latencies: FwQueryLatencies | None = None) -> list[dict[AddrType, bytes]]:
+  """Runs queries in rounds of non-conflicting queries, returns the versions each one got"""
+  results: list[dict[AddrType, bytes]] = [{} for _ in jobs]
+  for round_idxs in tqdm(schedule_fw_queries(jobs), disable=not progress):
+    # Toggle OBD multiplexing for the round, its queries on the multiplexed bus all use the same mode
+    obd_multiplexing = {jobs[i].obd_multiplexing for i in round_idxs} - {None}
+    if len(obd_multiplexing):
+      set_obd_multiplexing(obd_multiplexing.pop())
+
+    queries: dict[int, IsoTpParallelQuery] = {}
+    for i in round_idxs:
+      job = jobs[i]
+      try:
+        queries[i] = IsoTpParallelQuery(can_send, can_recv, job.request.bus, job.addrs, job.request.request, job.request.response, job.request.rx_offset,
+                                        early_exit_grace=EARLY_EXIT_GRACE if latencies is not None else None,
+                                        expected_latency=latencies.expected(job) if latencies is not None else 0.)
+      except Exception:
+        carlog.exception("FW query exception")
+
+    # each query that fails only loses its own results
+    try:
+      round_results = get_data_concurrently(list(queries.values()), timeout)
+    except Exception:
+      carlog.exception("FW query exception")
+      continue
+
+    for (i, query), job_results in zip(queries.items(), round_results, strict=True):
+      results[i] = job_results
+      if latencies is not None:
+        latencies.update(jobs[i], query.response_latencies)
+
+  if latencies is not None:
+    latencies.save()
+  return results
+
+
+def verify_fw_versions(can_recv: CanRecvCallable, can_send: CanSendCallable, set_obd_multiplexing: ObdCallback,
+                       car_fw: list[CarParams.CarFw], timeout: float = 0.1) -> bool:
+  """Checks FW versions from a previous query are still current, re-querying only their essential ECUs.
+  False if there are none to check, or any ECU doesn't answer with the same version"""
+  jobs: dict[tuple, FwQueryJob] = {}
+  expected: dict[tuple, dict[AddrType, bytes]] = defaultdict(dict)
+  for fw in car_fw:
+    if fw.logging or fw.ecu not in ESSENTIAL_ECUS or fw.brand not in FW_QUERY_CONFIGS:
+      continue
+
+    config = FW_QUERY_CONFIGS[fw.brand]
+    request = next((r for r in config.requests if r.request == list(fw.request) and r.bus == fw.bus and
+                    r.obd_multiplexing == fw.obdMultiplexing and not r.logging), None)
+    if request is None:
+      continue
+
+    key = (fw.brand, config.requests.index(request))
+    addr = (fw.address, fw.subAddress if fw.subAddress != 0 else None)
+    jobs.setdefault(key, FwQueryJob(fw.brand, config, request, [])).addrs.append(addr)
+    expected[key][addr] = fw.fwVersion
+
+  if not len(jobs):
+    return False
+
+  # ECUs with a subaddress need to be queried one by one
+  split_jobs = []
+  for key, job in jobs.items():
+    parallel_addrs = [a for a in job.addrs if a[1] is None]
+    for addrs in ([parallel_addrs] if len(parallel_addrs) else []) + [[a] for a in job.addrs if a[1] is not None]:
+      split_jobs.append((key, FwQueryJob(job.brand, job.config, job.request, addrs)))
+
+  results = run_fw_queries(can_recv, can_send, set_obd_multiplexing, [job for _, job in split_jobs], timeout)
+  return all(job_results.get(addr) == expected[key][addr] for (key, job), job_results in zip(split_jobs, results, strict=True) for addr in job.addrs)
+
+
+def build_car_fw(job: FwQueryJob, tx_addr: int, sub_addr: int | None, version: bytes,
+                 ecu_types: dict[tuple[str, int, int | None], CarParams.Ecu]) -> CarParams.CarFw:
+  r = job.request
+  f = CarParams.CarFw()
+
+  f.ecu = ecu_types.get((job.brand, tx_addr, sub_addr), Ecu.unknown)
+  f.fwVersion = version
+  f.address = tx_addr
+  f.responseAddress = uds.get_rx_addr_for_tx_addr(tx_addr, r.rx_offset)
+  f.request = r.request
+  f.brand = job.brand
+  f.bus = r.bus
+  f.logging = r.logging or (f.ecu, tx_addr, sub_addr) in job.config.extra_ecus
+  f.obdMultiplexing = r.obd_multiplexing
+
+  if sub_addr is not None:
+    f.subAddress = sub_addr
+  return f
@@ -227,7 +227,7 @@ def spam_buttons_command(packer, CAN, button_val, car_fingerprint):
   return packer.make_can_msg("SCM_BUTTONS", bus, values)
 
 
-def honda_checksum(address: int, sig, d: bytearray) -> int:
+def honda_checksum(address: int, sig, d: bytes | bytearray | memoryview) -> int:
   s = 0
   extended = address > 0x7FF
   addr = address
@@ -1,6 +1,6 @@
 import numpy as np
 from opendbc.car import CanBusBase
-from opendbc.car.crc import CRC16_XMODEM
+from opendbc.car.crc import CRC16_XMODEM, crc16_batch
 from opendbc.car.hyundai.values import HyundaiFlags
 
 
@@ -233,18 +233,24 @@ def create_adrv_messages(packer, CAN, frame):
   return ret
 
 
-def hkg_can_fd_checksum(address: int, sig, d: bytearray) -> int:
+HKG_CAN_FD_LENGTH_XOR = {
+  8: 0x5F29,
+  16: 0x041D,
+  24: 0x819D,
+  32: 0x9F5B,
+}
+
+
+def hkg_can_fd_checksum(address: int, sig, d: bytes | bytearray | memoryview) -> int:
   crc = 0
   for i in range(2, len(d)):
     crc = ((crc << 8) ^ CRC16_XMODEM[(crc >> 8) ^ d[i]]) & 0xFFFF
   crc = ((crc << 8) ^ CRC16_XMODEM[(crc >> 8) ^ ((address >> 0) & 0xFF)]) & 0xFFFF
   crc = ((crc << 8) ^ CRC16_XMODEM[(crc >> 8) ^ ((address >> 8) & 0xFF)]) & 0xFFFF
-  if len(d) == 8:
-    crc ^= 0x5F29
-  elif len(d) == 16:
-    crc ^= 0x041D
-  elif len(d) == 24:
-    crc ^= 0x819D
-  elif len(d) == 32:
-    crc ^= 0x9F5B
-  return crc
+  return crc ^ HKG_CAN_FD_LENGTH_XOR.get(len(d), 0)
+
+
+def hkg_can_fd_checksum_batch(address: int, sig, data: np.ndarray) -> np.ndarray:
+  addr = np.full((len(data), 2), [address & 0xFF, (address >> 8) & 0xFF], dtype=np.uint8)
+  crc = crc16_batch(CRC16_XMODEM, np.hstack((data[:, 2:], addr)))
+  return crc ^ HKG_CAN_FD_LENGTH_XOR.get(data.shape[1], 0)
@@ -11,7 +11,11 @@ from opendbc.car.fw_query_definitions import AddrType
 class IsoTpParallelQuery:
   def __init__(self, can_send: CanSendCallable, can_recv: CanRecvCallable, bus: int, addrs: list[int] | list[AddrType],
                request: list[bytes], response: list[bytes], response_offset: int = 0x8,
-               functional_addrs: list[int] | None = None, response_pending_timeout: float = 10) -> None:
+               functional_addrs: list[int] | None = None, response_pending_timeout: float = 10,
+               early_exit_grace: float | None = None, expected_latency: float = 0.) -> None:
+    """With early_exit_grace set, addresses that haven't answered are given up on once the grace period has passed
+    after the expected latency, or the latency of the slowest response so far, rather than waiting out the timeout.
+    This only ends the wait early once there is a latency to go on, from a past query or an answer in this one."""
     self.can_send = can_send
     self.can_recv = can_recv
     self.bus = bus
@@ -19,22 +23,40 @@ class IsoTpParallelQuery:
     self.response = response
     self.functional_addrs = functional_addrs or []
     self.response_pending_timeout = response_pending_timeout
+    self.early_exit_grace = early_exit_grace
+    self.expected_latency = expected_latency
+    self.response_latencies: dict[AddrType, float] = {}  # time to the first frame from each address that answered
 
     real_addrs = [a if isinstance(a, tuple) else (a, None) for a in addrs]
     for tx_addr, _ in real_addrs:
       assert tx_addr not in uds.FUNCTIONAL_ADDRS, f"Functional address should be defined in functional_addrs: {hex(tx_addr)}"
 
     self.msg_addrs = {tx_addr: uds.get_rx_addr_for_tx_addr(tx_addr[0], rx_offset=response_offset) for tx_addr in real_addrs}
-    self.msg_buffer: dict[int, list[CanData]] = defaultdict(list)
+    self.msg_buffer: dict[AddrType, list[CanData]] = defaultdict(list)  # by rx address and subaddress
+
+    # rx address -> subaddress -> tx address, to route each frame straight to the message waiting on it
+    self.rx_routes: dict[int, dict[int | None, AddrType]] = defaultdict(dict)
+    for tx_addr, rx_addr in self.msg_addrs.items():
+      self.rx_routes[rx_addr][tx_addr[1]] = tx_addr
+    self._rx_pending: set[AddrType] = set()  # tx addresses with frames to process
 
   def rx(self) -> None:
     """Drain can socket and sort messages into buffers based on address"""
-    can_packets = self.can_recv(wait_for_one=True)
+    self._sort_packets(self.can_recv(wait_for_one=True))
 
+  def _sort_packets(self, can_packets: list[list[CanData]]) -> None:
     for packet in can_packets:
       for msg in packet:
-        if msg.src == self.bus and msg.address in self.msg_addrs.values():
-          self.msg_buffer[msg.address].append(CanData(msg.address, msg.dat, msg.src))
+        if msg.src == self.bus and msg.address in self.rx_routes:
+          self._route(msg)
+
+  def _route(self, msg: CanData) -> None:
+    """Buffer a frame from one of our rx addresses for the message with its subaddress"""
+    routes = self.rx_routes[msg.address]
+    sub_addr = msg.dat[0] if len(msg.dat) and msg.dat[0] in routes else None
+    if sub_addr in routes:
+      self.msg_buffer[(msg.address, sub_addr)].append(CanData(msg.address, msg.dat, msg.src))
+      self._rx_pending.add(routes[sub_addr])
 
   def _can_tx(self, tx_addr: int, dat: bytes, bus: int):
     """Helper function to send single message"""
@@ -43,47 +65,30 @@ class IsoTpParallelQuery:
 
   def _can_rx(self, addr, sub_addr=None):
     """Helper function to retrieve message with specified address and subaddress from buffer"""
-    keep_msgs = []
-
-    if sub_addr is None:
-      msgs = self.msg_buffer[addr]
-    else:
-      # Filter based on subaddress
-      msgs = []
-      for m in self.msg_buffer[addr]:
-        first_byte = m[1][0]
-        if first_byte == sub_addr:
-          msgs.append(m)
-        else:
-          keep_msgs.append(m)
-
-    self.msg_buffer[addr] = keep_msgs
-    return msgs
-
-  def _drain_rx(self) -> None:
-    self.can_recv()
-    self.msg_buffer = defaultdict(list)
+    return self.msg_buffer.pop((addr, sub_addr), [])
 
   def _create_isotp_msg(self, tx_addr: int, sub_addr: int | None, rx_addr: int):
     can_client = uds.CanClient(self._can_tx, partial(self._can_rx, rx_addr, sub_addr=sub_addr), tx_addr, rx_addr,
                                self.bus, sub_addr=sub_addr)
+    self._can_clients[(tx_addr, sub_addr)] = can_client
 
     # uses iso-tp frame separation time of 10 ms
     # TODO: use single_frame_mode so ECUs can send as fast as they want,
     # as well as reduces chances we process messages from previous queries
     return uds.IsoTpMessage(can_client, timeout=0, separation_time=0.01)
 
-  def get_data(self, timeout: float, total_timeout: float = 60.) -> dict[AddrType, bytes]:
-    self._drain_rx()
+  def _start(self, timeout: float) -> None:
+    self._results: dict[AddrType, bytes] = {}
 
     # Create message objects
-    msgs = {}
-    request_counter = {}
-    request_done = {}
+    self._can_clients: dict[AddrType, uds.CanClient] = {}
+    self._msgs = {}
+    self._request_counter = {}
+    self._request_done = {}
     for tx_addr, rx_addr in self.msg_addrs.items():
-      msgs[tx_addr] = self._create_isotp_msg(*tx_addr, rx_addr)
-      request_counter[tx_addr] = 0
-      request_done[tx_addr] = False
+      self._msgs[tx_addr] = self._create_isotp_msg(*tx_addr, rx_addr)
+      self._request_counter[tx_addr] = 0
+      self._request_done[tx_addr] = False
 
     # Send first request to functional addrs, subsequent responses are handled on physical addrs
     if len(self.functional_addrs):
@@ -92,79 +97,145 @@ class IsoTpParallelQuery:
 
     # Send first frame (single or first) to all addresses and receive asynchronously in the loop below.
     # If querying functional addrs, only set up physical IsoTpMessages to send consecutive frames
-    for msg in msgs.values():
+    for msg in self._msgs.values():
       msg.send(self.request[0], setup_only=len(self.functional_addrs) > 0)
 
-    results = {}
-    start_time = time.monotonic()
-    addrs_responded = set()  # track addresses that have ever sent a valid iso-tp frame for timeout logging
-    response_timeouts = {tx_addr: start_time + timeout for tx_addr in self.msg_addrs}
-    while True:
-      self.rx()
+    self._addrs_responded = set()  # track addresses that have ever sent a valid iso-tp frame for timeout logging
+    self._start_time = time.monotonic()
+    self._response_timeouts = {tx_addr: self._start_time + timeout for tx_addr in self.msg_addrs}
+    self.response_latencies = {}
+
+  def _update(self, timeout: float) -> bool:
+    """Process received frames and timeouts, returns True once all requests are done (finished or timed out)"""
+    # only messages with new frames can make progress
+    pending, self._rx_pending = self._rx_pending, set()
+    for tx_addr in pending:
+      msg = self._msgs[tx_addr]
+      try:
+        dat, rx_in_progress = msg.recv()
+      except Exception:
+        carlog.exception(f"Error processing UDS response: {tx_addr}")
+        self._request_done[tx_addr] = True
+        continue
+      finally:
+        # recv stops at the end of a response, frames after it are processed next update
+        if len(self._can_clients[tx_addr].rx_buff):
+          self._rx_pending.add(tx_addr)
+
+      if (rx_in_progress or dat is not None) and tx_addr not in self.response_latencies:
+        self.response_latencies[tx_addr] = time.monotonic() - self._start_time
+
+      # Extend timeout for each consecutive ISO-TP frame to avoid timing out on long responses
+      if rx_in_progress:
+        self._addrs_responded.add(tx_addr)
+        self._response_timeouts[tx_addr] = time.monotonic() + timeout
+
+      if dat is None:
+        continue
+
+      # Log unexpected empty responses
+      if len(dat) == 0:
+        carlog.error(f"iso-tp query empty response: {tx_addr}")
+        self._request_done[tx_addr] = True
+        continue
+
+      counter = self._request_counter[tx_addr]
+      expected_response = self.response[counter]
+      response_valid = dat.startswith(expected_response)
+
+      if response_valid:
+        if counter + 1 < len(self.request):
+          self._response_timeouts[tx_addr] = time.monotonic() + timeout
+          msg.send(self.request[counter + 1])
+          self._request_counter[tx_addr] += 1
+        else:
+          self._results[tx_addr] = dat[len(expected_response):]
+          self._request_done[tx_addr] = True
+      else:
+        error_code = dat[2] if len(dat) > 2 else -1
+        if error_code == 0x78:
+          self._response_timeouts[tx_addr] = time.monotonic() + self.response_pending_timeout
+          carlog.error(f"iso-tp query response pending: {tx_addr}")
+        else:
+          self._request_done[tx_addr] = True
+          carlog.error(f"iso-tp query bad response: {tx_addr} - 0x{dat.hex()}")
+
+    # Mark request done if address timed out
+    cur_time = time.monotonic()
+    if self.early_exit_grace is not None and (self.expected_latency > 0 or len(self.response_latencies)):
+      # the addresses that were going to answer have had time to, stop waiting on the silent ones
+      latency = max([self.expected_latency, *self.response_latencies.values()])
+      if cur_time - self._start_time > latency + self.early_exit_grace:
+        for tx_addr in self._response_timeouts:
+          if tx_addr not in self.response_latencies:
+            self._request_done[tx_addr] = True
+
+    for tx_addr in self._response_timeouts:
+      if cur_time - self._response_timeouts[tx_addr] > 0:
+        if not self._request_done[tx_addr]:
+          if self._request_counter[tx_addr] > 0:
+            carlog.error(f"iso-tp query timeout after receiving partial response: {tx_addr}")
+          elif tx_addr in self._addrs_responded:
+            carlog.error(f"iso-tp query timeout while receiving response: {tx_addr}")
+          # TODO: handle functional addresses
+          # else:
+          #   carlog.error(f"iso-tp query timeout with no response: {tx_addr}")
+        self._request_done[tx_addr] = True
+
+    return all(self._request_done.values())
+
+  def get_data(self, timeout: float, total_timeout: float = 60.) -> dict[AddrType, bytes]:
+    return get_data_concurrently([self], timeout, total_timeout)[0]
+
+
+def get_data_concurrently(queries: list[IsoTpParallelQuery], timeout: float, total_timeout: float = 60.) -> list[dict[AddrType, bytes]]:
+  """Run queries sharing one can_recv stream in a single receive loop, returning each one's results.
+  Takes as long as the slowest query, rather than their sum. Queries on the same bus must not share any addresses."""
+  if not len(queries):
+    return []
+
+  can_recv = queries[0].can_recv
+  assert all(q.can_recv == can_recv for q in queries), "queries must share a CAN stream"
+
+  # every frame goes straight to the one query waiting on its bus and address
+  routes: dict[tuple[int, int], int] = {}
+  for i, query in enumerate(queries):
+    for rx_addr in query.rx_routes:
+      assert routes.setdefault((query.bus, rx_addr), i) == i, f"queries share an rx address: {hex(rx_addr)}"
+
+  # drain once, then start every query
+  can_recv()
+  for query in queries:
+    query.msg_buffer = defaultdict(list)
+    query._rx_pending = set()
+
+  # a query that raises is finished with the results it got so far, without ending the others
+  done = [False] * len(queries)
+  for i, query in enumerate(queries):
+    try:
+      query._start(timeout)
+    except Exception:
+      carlog.exception(f"iso-tp query exception: bus {query.bus}")
+      done[i] = True
+
+  start_time = time.monotonic()
+  while not all(done):
+    for packet in can_recv(wait_for_one=True):
+      for msg in packet:
+        i = routes.get((msg.src, msg.address))
+        if i is not None and not done[i]:
+          queries[i]._route(msg)
 
-      for tx_addr, msg in msgs.items():
+    for i, query in enumerate(queries):
+      if not done[i]:
         try:
-          dat, rx_in_progress = msg.recv()
+          done[i] = query._update(timeout)
         except Exception:
-          carlog.exception(f"Error processing UDS response: {tx_addr}")
-          request_done[tx_addr] = True
-          continue
-
-        # Extend timeout for each consecutive ISO-TP frame to avoid timing out on long responses
-        if rx_in_progress:
-          addrs_responded.add(tx_addr)
-          response_timeouts[tx_addr] = time.monotonic() + timeout
-
-        if dat is None:
-          continue
-
-        # Log unexpected empty responses
-        if len(dat) == 0:
-          carlog.error(f"iso-tp query empty response: {tx_addr}")
-          request_done[tx_addr] = True
-          continue
-
-        counter = request_counter[tx_addr]
-        expected_response = self.response[counter]
-        response_valid = dat.startswith(expected_response)
-
-        if response_valid:
-          if counter + 1 < len(self.request):
-            response_timeouts[tx_addr] = time.monotonic() + timeout
-            msg.send(self.request[counter + 1])
-            request_counter[tx_addr] += 1
-          else:
-            results[tx_addr] = dat[len(expected_response):]
-            request_done[tx_addr] = True
-        else:
-          error_code = dat[2] if len(dat) > 2 else -1
-          if error_code == 0x78:
-            response_timeouts[tx_addr] = time.monotonic() + self.response_pending_timeout
-            carlog.error(f"iso-tp query response pending: {tx_addr}")
-          else:
-            request_done[tx_addr] = True
-            carlog.error(f"iso-tp query bad response: {tx_addr} - 0x{dat.hex()}")
-
-      # Mark request done if address timed out
-      cur_time = time.monotonic()
-      for tx_addr in response_timeouts:
-        if cur_time - response_timeouts[tx_addr] > 0:
-          if not request_done[tx_addr]:
-            if request_counter[tx_addr] > 0:
-              carlog.error(f"iso-tp query timeout after receiving partial response: {tx_addr}")
-            elif tx_addr in addrs_responded:
-              carlog.error(f"iso-tp query timeout while receiving response: {tx_addr}")
-            # TODO: handle functional addresses
-            # else:
-            #   carlog.error(f"iso-tp query timeout with no response: {tx_addr}")
-          request_done[tx_addr] = True
-
-      # Break if all requests are done (finished or timed out)
-      if all(request_done.values()):
-        break
-
-      if cur_time - start_time > total_timeout:
-        carlog.error("iso-tp query timeout while receiving data")
-        break
-
-    return results
+          carlog.exception(f"iso-tp query exception: bus {query.bus}")
+          done[i] = True
+
+    if time.monotonic() - start_time > total_timeout:
+      carlog.error("iso-tp query timeout while receiving data")
+      break
+
+  return [query._results for query in queries]
@@ -1,15 +1,30 @@
 #!/usr/bin/env python3
+import hashlib
+import heapq
+import io
+import mmap
+import numpy as np
 import os
+import tempfile
+import struct
 import capnp
 import urllib.parse
 import warnings
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from urllib.request import urlopen
 import zstandard as zstd
+from dataclasses import dataclass, field
+from functools import partial
 
+from opendbc import get_cache_dir
 from opendbc.car.common.basedir import BASEDIR
 
 capnp_log = capnp.load(os.path.join(BASEDIR, "rlog.capnp"))
 
+ZSTD_MAGIC = b'\x28\xB5\x2F\xFD'  # https://github.com/facebook/zstd/blob/dev/doc/zstd_compression_format.md#zstandard-frames
+STREAM_CHUNK_SIZE = 1 << 20
+
 
 def decompress_stream(data: bytes):
   dctx = zstd.ZstdDecompressor()
@@ -21,22 +36,322 @@ def decompress_stream(data: bytes):
   return decompressed_data
 
 
+def open_log(fn: str):
+  """Open a local or remote log as a binary stream, decompressing zstd logs on the fly."""
+  _, ext = os.path.splitext(urllib.parse.urlparse(fn).path)
+  f = urlopen(fn) if fn.startswith("http") else open(fn, "rb")
+  if ext == ".zst" or f.peek(4)[:4] == ZSTD_MAGIC:
+    return zstd.ZstdDecompressor().stream_reader(f, closefd=True)
+  return f
+
+
+def map_file(f):
+  """Read-only memory map of an open file. Capnp readers reference it in place, so the
+  page cache is shared by every process reading the same file."""
+  if os.fstat(f.fileno()).st_size == 0:
+    return b""
+  return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def get_log_cache_path(fn: str, suffix: str = ".rlog") -> str:
+  if fn.startswith("http"):
+    # drop the query string, signed URLs change on every request
+    url = urllib.parse.urlparse(fn)
+    key = f"{url.netloc}{url.path}"
+  else:
+    st = os.stat(fn)
+    key = f"{os.path.realpath(fn)}:{st.st_size}:{st.st_mtime_ns}"
+  return os.path.join(get_cache_dir("logs"), hashlib.sha256(key.encode()).hexdigest()[:32] + suffix)
+
+
+def cache_log(cache_path: str, dat: bytes) -> bool:
+  # publish atomically so concurrent processes never map a partial file
+  try:
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(cache_path), suffix=".tmp")
+  except OSError:
+    return False
+  try:
+    with os.fdopen(fd, 'wb') as f:
+      f.write(dat)
+    os.replace(tmp_path, cache_path)
+  except OSError:
+    os.unlink(tmp_path)
+    return False
+  return True
+
+
+def read_log(fn: str, cache: bool = False):
+  """Decompressed log contents. Uncompressed local logs are memory-mapped instead of read.
+  With cache, remote and compressed logs are decompressed once into the cache dir and mapped from there."""
+  _, ext = os.path.splitext(urllib.parse.urlparse(fn).path)
+  remote = fn.startswith("http")
+
+  cache_path = get_log_cache_path(fn) if cache else None
+  if cache_path is not None:
+    try:
+      with open(cache_path, "rb") as f:
+        return map_file(f)
+    except OSError:
+      pass
+
+  if remote:
+    with urlopen(fn) as f:
+      dat = f.read()
+  else:
+    with open(fn, "rb") as f:
+      if ext != ".zst" and f.peek(4)[:4] != ZSTD_MAGIC:
+        return map_file(f)
+      dat = f.read()
+
+  if ext == ".zst" or dat.startswith(ZSTD_MAGIC):
+    dat = decompress_stream(dat)
+
+  if cache_path is not None and cache_log(cache_path, dat):
+    with open(cache_path, "rb") as f:
+      return map_file(f)
+  return dat
+
+
+_EVENT_STRUCT = capnp_log.Event.schema.node.struct
+EVENT_DISCRIMINANT_OFFSET = _EVENT_STRUCT.discriminantOffset * 2  # in bytes, into the Event data section
+EVENT_UNION_TAGS = {f.name: f.discriminantValue for f in _EVENT_STRUCT.fields if f.discriminantValue != 0xFFFF}  # 0xFFFF: not in the union
+
+
+def get_event_tags(types) -> set[int]:
+  unknown = set(types) - EVENT_UNION_TAGS.keys()
+  if unknown:
+    raise ValueError(f"unknown event types: {sorted(unknown)}")
+  return {EVENT_UNION_TAGS[t] for t in types}
+
+
+def get_message_size(buf, pos: int = 0) -> int | None:
+  """Size of the framed capnp message starting at pos, or None if its segment table isn't complete yet."""
+  if len(buf) - pos < 4:
+    return None
+  n_segments = struct.unpack_from('<I', buf, pos)[0] + 1
+  header_size = (4 + 4 * n_segments + 7) & ~7
+  if len(buf) - pos < header_size:
+    return None
+  return header_size + 8 * sum(struct.unpack_from(f'<{n_segments}I', buf, pos + 4))
+
+
+def get_root_struct(buf, pos: int = 0) -> tuple[int, int] | None:
+  """Position and size of the root struct's data section of the framed message at pos.
+  Returns None if the root isn't a plain struct pointer into the first segment."""
+  n_segments = struct.unpack_from('<I', buf, pos)[0] + 1
+  segment = pos + ((4 + 4 * n_segments + 7) & ~7)
+  ptr = struct.unpack_from('<Q', buf, segment)[0]
+  if ptr & 0x3 != 0:
+    return None
+  offset = (ptr & 0xFFFFFFFF) >> 2
+  if offset & (1 << 29):
+    offset -= 1 << 30
+  return segment + 8 + offset * 8, ((ptr >> 32) & 0xFFFF) * 8
+
+
+def get_event_tag(buf, pos: int = 0) -> int | None:
+  """Union tag of the framed Event at pos, read straight from its root struct.
+  Returns None if the root isn't a plain struct pointer into the first segment."""
+  root = get_root_struct(buf, pos)
+  if root is None:
+    return None
+  data, data_size = root
+  if EVENT_DISCRIMINANT_OFFSET + 2 > data_size:
+    # truncated data section, defaults to the first union member
+    return 0
+  return struct.unpack_from('<H', buf, data + EVENT_DISCRIMINANT_OFFSET)[0]
+
+
+_SINGLE_SEGMENT_HEADER = struct.Struct('<IIQ')  # segment count - 1, first segment size, root pointer
+_UINT16 = struct.Struct('<H')
+_UINT64 = struct.Struct('<Q')
+
+
+def select_messages(buf, tags: set[int] | None = None) -> tuple[bytes, int]:
+  """Frame the complete messages in buf, keeping only Events with a union tag in tags (all if None).
+  Returns the kept messages and the number of bytes framed."""
+  mv = memoryview(buf)
+  end = 0
+  parts = []
+  while len(buf) - end >= _SINGLE_SEGMENT_HEADER.size:
+    n_segments_minus_one, segment_words, ptr = _SINGLE_SEGMENT_HEADER.unpack_from(buf, end)
+    if n_segments_minus_one == 0:
+      size = 8 + segment_words * 8
+    elif (size := get_message_size(buf, end)) is None:
+      break
+    if end + size > len(buf):
+      break
+
+    if tags is not None:
+      if n_segments_minus_one == 0 and ptr & 0xFFFFFFFF == 0 and ((ptr >> 32) & 0xFFFF) * 8 >= EVENT_DISCRIMINANT_OFFSET + 2:
+        # common case: root struct right after the root pointer, in the only segment
+        tag = _UINT16.unpack_from(buf, end + 16 + EVENT_DISCRIMINANT_OFFSET)[0]
+      else:
+        tag = get_event_tag(buf, end)
+      if tag is None:
+        # uncommon layout, fall back to decoding it
+        tag = EVENT_UNION_TAGS.get(next(iter(capnp_log.Event.read_multiple_bytes(bytes(mv[end:end + size])))).which())
+      if tag in tags:
+        parts.append(mv[end:end + size])
+    end += size
+  return (bytes(mv[:end]) if tags is None else b"".join(parts)), end
+
+
+LOG_INDEX_VERSION = 2
+LOG_MONO_TIME_OFFSET = next(f.slot.offset for f in _EVENT_STRUCT.fields if f.name == "logMonoTime") * 8
+
+
+@dataclass
+class LogIndex:
+  """Byte offset, size, union tag and logMonoTime of each event in a decompressed log, in log order."""
+  offsets: np.ndarray
+  sizes: np.ndarray
+  tags: np.ndarray
+  mono_times: np.ndarray
+  end: int  # bytes indexed, the log size unless it's truncated
+  size: int  # size of the log it was built from
+  by_time: np.ndarray = field(init=False)
+
+  def __post_init__(self):
+    self.by_time = np.argsort(self.mono_times, kind='stable')
+
+  @classmethod
+  def build(cls, buf) -> 'LogIndex':
+    offsets, sizes, tags, mono_times = [], [], [], []
+    pos = 0
+    while len(buf) - pos >= _SINGLE_SEGMENT_HEADER.size:
+      n_segments_minus_one, segment_words, ptr = _SINGLE_SEGMENT_HEADER.unpack_from(buf, pos)
+      if n_segments_minus_one == 0:
+        size = 8 + segment_words * 8
+      elif (size := get_message_size(buf, pos)) is None:
+        break
+      if pos + size > len(buf):
+        break
+
+      if n_segments_minus_one == 0 and ptr & 0xFFFFFFFF == 0:
+        root = pos + 16, ((ptr >> 32) & 0xFFFF) * 8
+      else:
+        root = get_root_struct(buf, pos)
+
+      if root is None:
+        # uncommon layout, fall back to decoding it
+        evt = next(iter(capnp_log.Event.read_multiple_bytes(bytes(buf[pos:pos + size]))))
+        tag, mono_time = EVENT_UNION_TAGS.get(evt.which()), evt.logMonoTime
+      else:
+        data, data_size = root
+        tag = _UINT16.unpack_from(buf, data + EVENT_DISCRIMINANT_OFFSET)[0] if EVENT_DISCRIMINANT_OFFSET + 2 <= data_size else 0
+        mono_time = _UINT64.unpack_from(buf, data + LOG_MONO_TIME_OFFSET)[0] if LOG_MONO_TIME_OFFSET + 8 <= data_size else 0
+
+      offsets.append(pos)
+      sizes.append(size)
+      tags.append(tag)
+      mono_times.append(mono_time)
+      pos += size
+
+    return cls(np.array(offsets, dtype=np.uint64), np.array(sizes, dtype=np.uint64), np.array(tags, dtype=np.uint16),
+               np.array(mono_times, dtype=np.uint64), pos, len(buf))
+
+  def to_bytes(self) -> bytes:
+    f = io.BytesIO()
+    np.savez(f, offsets=self.offsets, sizes=self.sizes, tags=self.tags, mono_times=self.mono_times, end=self.end, size=self.size)
+    return f.getvalue()
+
+  @classmethod
+  def from_bytes(cls, dat: bytes) -> 'LogIndex':
+    with np.load(io.BytesIO(dat)) as f:
+      return cls(f['offsets'], f['sizes'], f['tags'], f['mono_times'], int(f['end']), int(f['size']))
+
+  def first(self, tag: int, sort_by_time: bool = False) -> int | None:
+    """Position of the first event with this union tag, in log order or by logMonoTime."""
+    order = self.by_time if sort_by_time else np.arange(len(self.tags))
+    idxs = order[self.tags[order] == tag]
+    return int(idxs[0]) if len(idxs) else None
+
+  def window(self, start_nanos: int, end_nanos: int, tags: set[int] | None = None) -> np.ndarray:
+    """Positions of the events with start_nanos <= logMonoTime < end_nanos, sorted by time."""
+    sorted_times = self.mono_times[self.by_time]
+    idxs = self.by_time[np.searchsorted(sorted_times, start_nanos, 'left'):np.searchsorted(sorted_times, end_nanos, 'left')]
+    if tags is not None:
+      idxs = idxs[np.isin(self.tags[idxs], list(tags))]
+    return idxs
+
+
+def load_log_index(fn: str, dat) -> LogIndex:
+  """Sidecar index of a log, kept in the cache dir next to its decompressed copy."""
+  cache_path = get_log_cache_path(fn, f".idx{LOG_INDEX_VERSION}.npz")
+  try:
+    with open(cache_path, "rb") as f:
+      index = LogIndex.from_bytes(f.read())
+    # compared to the whole log rather than end, so truncated logs don't reindex on every open
+    if index.size == len(dat):
+      return index
+  except Exception:
+    # missing, stale or corrupt index, rebuild it
+    pass
+
+  index = LogIndex.build(dat)
+  cache_log(cache_path, index.to_bytes())
+  return index
+
+
+def stream_events(fn: str, chunk_size: int = STREAM_CHUNK_SIZE, types=None):
+  """Yield events as they are framed, decompressing chunk_size bytes at a time to keep memory bounded.
+  If types is given, other events are skipped without being decoded."""
+  tags = get_event_tags(types) if types is not None else None
+  with open_log(fn) as f:
+    buf = bytearray()
+    while True:
+      chunk = f.read(chunk_size)
+      buf += chunk
+
+      dat, end = select_messages(buf, tags)
+      if end > 0:
+        try:
+          yield from capnp_log.Event.read_multiple_bytes(dat)
+        except capnp.KjException:
+          warnings.warn("Corrupted events detected", RuntimeWarning, stacklevel=1)
+          return
+        del buf[:end]
+
+      if not chunk:
+        if len(buf):
+          warnings.warn("Corrupted events detected", RuntimeWarning, stacklevel=1)
+        return
+
+
 class LogReader:
-  def __init__(self, fn, only_union_types=False, sort_by_time=False):
+  def __init__(self, fn, only_union_types=False, sort_by_time=False, streaming=False, types=None, cache=False, index=False):
     self._only_union_types = only_union_types
-    _, ext = os.path.splitext(urllib.parse.urlparse(fn).path)
+    self._fn = fn
+    self._streaming = streaming
+    self._types = types
+    self._tags = get_event_tags(types) if types is not None else None
+    self._sort_by_time = sort_by_time
+    self._index: LogIndex | None = None
 
-    if fn.startswith("http"):
-      with urlopen(fn) as f:
-        dat = f.read()
-    else:
-      with open(fn, "rb") as f:
-        dat = f.read()
+    # streaming mode decodes on each iteration instead of keeping every event in memory
+    if streaming:
+      if sort_by_time or index:
+        raise ValueError("sort_by_time and index need the whole log, not supported when streaming")
+      return
+
+    dat = read_log(fn, cache)
 
-    if ext == ".zst" or dat.startswith(b'\x28\xB5\x2F\xFD'):
-      # https://github.com/facebook/zstd/blob/dev/doc/zstd_compression_format.md#zstandard-frames
-      dat = decompress_stream(dat)
+    # indexed mode only decodes the events that are asked for
+    if index:
+      self._dat = dat
+      # the index is only persisted alongside the cached log
+      self._index = load_log_index(fn, dat) if cache else LogIndex.build(dat)
+      if self._index.end != len(dat):
+        warnings.warn("Corrupted events detected", RuntimeWarning, stacklevel=1)
+      return
 
+    if self._tags is not None:
+      selected, end = select_messages(dat, self._tags)
+      if end != len(dat):
+        warnings.warn("Corrupted events detected", RuntimeWarning, stacklevel=1)
+      dat = selected
     ents = capnp_log.Event.read_multiple_bytes(dat)
 
     self._ents = []
@@ -49,8 +364,129 @@ class LogReader:
     if sort_by_time:
       self._ents.sort(key=lambda x: x.logMonoTime)
 
+  def _read_event(self, i: int):
+    offset, size = int(self._index.offsets[i]), int(self._index.sizes[i])
+    return next(iter(capnp_log.Event.read_multiple_bytes(memoryview(self._dat)[offset:offset + size])))
+
+  def _indexed_events(self):
+    idxs = self._index.by_time if self._sort_by_time else np.arange(len(self._index.offsets))
+    if self._tags is not None:
+      idxs = idxs[np.isin(self._index.tags[idxs], list(self._tags))]
+    return (self._read_event(i) for i in idxs)
+
+  def __iter__(self):
+    if self._streaming:
+      ents = stream_events(self._fn, types=self._types)
+    elif self._index is not None:
+      ents = self._indexed_events()
+    else:
+      ents = self._ents
+
+    for ent in ents:
+      if self._only_union_types:
+        try:
+          ent.which()
+          yield ent
+        except capnp.lib.capnp.KjException:
+          pass
+      else:
+        yield ent
+
+  def filter(self, msg_type: str):
+    return (getattr(m, m.which()) for m in filter(lambda m: m.which() == msg_type, self))
+
+  def first(self, msg_type: str):
+    if self._index is not None:
+      tag = EVENT_UNION_TAGS.get(msg_type)
+      if tag is None or (self._tags is not None and tag not in self._tags):
+        return None
+      i = self._index.first(tag, self._sort_by_time)
+      return getattr(self._read_event(i), msg_type) if i is not None else None
+    return next(self.filter(msg_type), None)
+
+  def time_window(self, start_nanos: int, end_nanos: int, msg_type: str | None = None):
+    """Events with start_nanos <= logMonoTime < end_nanos, optionally only of msg_type.
+    With an index this seeks straight to them, in time order."""
+    if self._index is not None:
+      tags = self._tags
+      if msg_type is not None:
+        tags = get_event_tags({msg_type}) if tags is None else tags & get_event_tags({msg_type})
+      return (self._read_event(i) for i in self._index.window(start_nanos, end_nanos, tags))
+    return (m for m in self if start_nanos <= m.logMonoTime < end_nanos and (msg_type is None or m.which() == msg_type))
+
+
+def read_sorted_events(fn: str, tags: set[int] | None = None, cache: bool = False) -> bytes:
+  """Framed events of a log sorted by logMonoTime, keeping only union tags in tags (all if None)."""
+  dat = read_log(fn, cache)
+  index = load_log_index(fn, dat) if cache else LogIndex.build(dat)
+  if index.end != len(dat):
+    warnings.warn("Corrupted events detected", RuntimeWarning, stacklevel=1)
+
+  idxs = index.by_time
+  if tags is not None:
+    idxs = idxs[np.isin(index.tags[idxs], list(tags))]
+  mv = memoryview(dat)
+  return b"".join(mv[offset:offset + size] for offset, size in zip(index.offsets[idxs].tolist(), index.sizes[idxs].tolist(), strict=True))
+
+
+class RouteReader:
+  """Events of a route's segment logs, decoded on a process pool and merged in logMonoTime order.
+  Segments must be in route order. At most lookahead segments are read ahead of the merge.
+  With workers=0 segments are read in this process, e.g. from daemonic processes that can't start a pool."""
+  def __init__(self, fns, only_union_types=False, types=None, cache=False, workers: int | None = None, lookahead: int = 2):
+    self._fns = list(fns)
+    self._only_union_types = only_union_types
+    self._tags = get_event_tags(types) if types is not None else None
+    self._cache = cache
+    self._workers = workers
+    self._lookahead = lookahead
+
+  def _merged_events(self):
+    pool = ProcessPoolExecutor(self._workers) if self._workers != 0 else None
+    try:
+      fns = iter(enumerate(self._fns))
+      pending = deque()
+
+      def submit():
+        if (nxt := next(fns, None)) is not None:
+          seg, fn = nxt
+          if pool is None:
+            pending.append((seg, partial(read_sorted_events, fn, self._tags, self._cache)))
+          else:
+            pending.append((seg, pool.submit(read_sorted_events, fn, self._tags, self._cache).result))
+
+      for _ in range(max(self._lookahead, 1)):
+        submit()
+
+      # (logMonoTime, segment, event, rest of the segment's events)
+      heap = []
+
+      def pop():
+        _, seg, evt, ents = heapq.heappop(heap)
+        if (nxt := next(ents, None)) is not None:
+          heapq.heappush(heap, (nxt.logMonoTime, seg, nxt, ents))
+        return evt
+
+      while pending:
+        seg, get_result = pending.popleft()
+        ents = iter(capnp_log.Event.read_multiple_bytes(get_result()))
+        submit()
+        if (first := next(ents, None)) is None:
+          continue
+
+        # everything before the next segment starts is final
+        while heap and heap[0][0] <= first.logMonoTime:
+          yield pop()
+        heapq.heappush(heap, (first.logMonoTime, seg, first, ents))
+
+      while heap:
+        yield pop()
+    finally:
+      if pool is not None:
+        pool.shutdown(cancel_futures=True)
+
   def __iter__(self):
-    for ent in self._ents:
+    for ent in self._merged_events():
       if self._only_union_types:
         try:
           ent.which()
@@ -1,8 +1,9 @@
-def psa_checksum(address: int, sig, d: bytearray) -> int:
+def psa_checksum(address: int, sig, d: bytes | bytearray | memoryview) -> int:
   chk_ini = {0x452: 0x4, 0x38D: 0x7, 0x42D: 0xC}.get(address, 0xB)
-  byte = sig.start_bit // 8
-  d[byte] &= 0x0F if sig.start_bit % 8 >= 4 else 0xF0
   checksum = sum((b >> 4) + (b & 0xF) for b in d)
+  # exclude the checksum nibble itself, without modifying the payload
+  b = d[sig.start_bit // 8]
+  checksum -= (b >> 4) if sig.start_bit % 8 >= 4 else (b & 0xF)
   return (chk_ini - checksum) & 0xF
 
 
@@ -326,7 +326,7 @@ def create_preglobal_es_distance(packer, cruise_button, es_distance_msg):
   return packer.make_can_msg("ES_Distance", CanBus.main, values)
 
 
-def subaru_checksum(address: int, sig, d: bytearray) -> int:
+def subaru_checksum(address: int, sig, d: bytes | bytearray | memoryview) -> int:
   s = 0
   addr = address
   while addr:
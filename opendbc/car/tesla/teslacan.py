@@ -51,7 +51,7 @@ class TeslaCAN:
     return self.packer.make_can_msg("APS_eacMonitor", CANBUS.party, values)
 
 
-def tesla_checksum(address: int, sig, d: bytearray) -> int:
+def tesla_checksum(address: int, sig, d: bytes | bytearray | memoryview) -> int:
   checksum = (address & 0xFF) + ((address >> 8) & 0xFF)
   checksum_byte = sig.start_bit // 8
   for i in range(len(d)):
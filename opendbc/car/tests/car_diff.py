@@ -19,7 +19,8 @@ from typing import Any
 from opendbc.car import structs
 from opendbc.car.can_definitions import CanData
 from opendbc.car.car_helpers import can_fingerprint, interfaces
-from opendbc.car.logreader import LogReader, decompress_stream
+from opendbc.car.canlog import load_can_log
+from opendbc.car.logreader import decompress_stream
 
 
 TOLERANCE = 1e-4
@@ -50,16 +51,15 @@ def dict_diff(d1: dict[str, Any], d2: dict[str, Any], path: str = "", ignore: li
   return diffs
 
 
-def load_can_messages(seg: str) -> list[Any]:
+def load_can_messages(seg: str) -> list[tuple[int, list[CanData]]]:
   from comma_car_segments import get_url
   parts = seg.split("/")
   url = get_url(f"{parts[0]}/{parts[1]}", parts[2])
-  msgs = LogReader(url, only_union_types=True, sort_by_time=True)
-  return [m for m in msgs if m.which() == 'can']
+  return list(load_can_log(url))
 
 
-def replay_segment(platform: str, can_msgs: list[Any]) -> tuple[structs.CarParams, list[structs.CarState], list[int]]:
-  _can_msgs = ([CanData(can.address, can.dat, can.src) for can in m.can] for m in can_msgs)
+def replay_segment(platform: str, can_msgs: list[tuple[int, list[CanData]]]) -> tuple[structs.CarParams, list[structs.CarState], list[int]]:
+  _can_msgs = (frames for _, frames in can_msgs)
 
   def can_recv(wait_for_one: bool = False) -> list[list[CanData]]:
     return [next(_can_msgs, [])]
@@ -72,11 +72,10 @@ def replay_segment(platform: str, can_msgs: list[Any]) -> tuple[structs.CarParam
   CC = structs.CarControl().as_reader()
 
   states, timestamps = [], []
-  for msg in can_msgs:
-    frames = [CanData(c.address, c.dat, c.src) for c in msg.can]
-    states.append(CI.update([(msg.logMonoTime, frames)]))
-    CI.apply(CC, msg.logMonoTime)
-    timestamps.append(msg.logMonoTime)
+  for nanos, frames in can_msgs:
+    states.append(CI.update([(nanos, frames)]))
+    CI.apply(CC, nanos)
+    timestamps.append(nanos)
   return CP, states, timestamps
 
 
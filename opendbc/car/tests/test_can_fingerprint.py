@@ -1,7 +1,8 @@
+import random
 import unittest
 from opendbc.car.can_definitions import CanData
 from opendbc.car.car_helpers import FRAME_FINGERPRINT, can_fingerprint
-from opendbc.car.fingerprints import _FINGERPRINTS as FINGERPRINTS
+from opendbc.car.fingerprints import _DEBUG_ADDRESS, _FINGERPRINTS as FINGERPRINTS, eliminate_incompatible_cars, is_valid_for_fingerprint
 from opendbc.testing import parameterized
 
 
@@ -22,6 +23,18 @@ class TestCanFingerprint(unittest.TestCase):
       assert finger[1] == fingerprint
       assert finger[2] == {}
 
+  def test_eliminate_incompatible_cars(self):
+    # the index eliminates exactly the cars that no fingerprint of theirs allows
+    random.seed(0)
+    addresses = {address for fingerprints in FINGERPRINTS.values() for fingerprint in fingerprints for address in fingerprint}
+    addresses = sorted(addresses | {1880, 0x800, 0x18DAF110})
+    for _ in range(500):
+      candidate_cars = random.sample(list(FINGERPRINTS), random.randint(0, len(FINGERPRINTS)))
+      msg = CanData(random.choice(addresses), b'\x00' * random.randint(0, 8), 0)
+      expected = [car_model for car_model in candidate_cars
+                  if any(is_valid_for_fingerprint(msg, fingerprint | _DEBUG_ADDRESS) for fingerprint in FINGERPRINTS[car_model])]
+      assert eliminate_incompatible_cars(msg, candidate_cars) == expected
+
   def test_timing(self):
     # just pick any CAN fingerprinting car
     car_model = "CHEVROLET_BOLT_EUV"
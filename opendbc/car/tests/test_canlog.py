@@ -0,0 +1,50 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+import numpy as np
+
+from opendbc.car.can_definitions import CanData
+from opendbc.car.canlog import CAN_LOG_VERSION, CanLog, load_can_log
+from opendbc.car.logreader import LogReader, get_log_cache_path
+from opendbc.car.tests.test_logreader import make_log
+
+
+class TestCanLog(unittest.TestCase):
+  @classmethod
+  def setUpClass(cls):
+    cls.tmpdir = tempfile.TemporaryDirectory()
+    cls.rlog = os.path.join(cls.tmpdir.name, "rlog")
+    with open(cls.rlog, "wb") as f:
+      f.write(make_log())
+    cls.expected = [(m.logMonoTime, [CanData(c.address, c.dat, c.src) for c in m.can])
+                    for m in LogReader(cls.rlog, sort_by_time=True, types={'can'})]
+
+  @classmethod
+  def tearDownClass(cls):
+    cls.tmpdir.cleanup()
+
+  def test_round_trip(self):
+    can_log = CanLog.from_log(self.rlog)
+    assert len(can_log) == len(self.expected)
+    assert list(can_log) == self.expected
+
+    for fn in ("can.npz", "can"):
+      path = os.path.join(self.tmpdir.name, fn)
+      can_log.save(path)
+      loaded = CanLog.load(path)
+      assert isinstance(loaded.payload, np.memmap) == (fn == "can")
+      assert list(loaded) == self.expected
+
+  def test_empty(self):
+    assert list(CanLog.from_events([])) == []
+
+  def test_cache(self):
+    with tempfile.TemporaryDirectory() as cache_dir, mock.patch.dict(os.environ, {"OPENDBC_CACHE_DIR": cache_dir}):
+      assert list(load_can_log(self.rlog)) == self.expected
+      assert os.path.isdir(get_log_cache_path(self.rlog, f".can{CAN_LOG_VERSION}"))
+
+      # later loads never touch capnp
+      with mock.patch.object(CanLog, "from_log") as from_log:
+        assert list(load_can_log(self.rlog)) == self.expected
+        from_log.assert_not_called()
@@ -0,0 +1,90 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from opendbc.car.car_helpers import fingerprint
+from opendbc.car.fingerprint_cache import get_fingerprint_cache_path, load_cached_fw, save_cached_fw
+from opendbc.car.structs import CarParams
+
+CarFw = CarParams.CarFw
+Ecu = CarParams.Ecu
+
+VIN = "1HGBH41JXMN109186"
+ECU_RX_ADDRS = {(0x7e8, None, 0), (0x7e9, None, 0)}
+
+
+class TestFingerprintCache(unittest.TestCase):
+  def setUp(self):
+    self.cache_dir = tempfile.TemporaryDirectory()
+    self.addCleanup(self.cache_dir.cleanup)
+    env = patch.dict(os.environ, {"OPENDBC_CACHE_DIR": self.cache_dir.name})
+    env.start()
+    self.addCleanup(env.stop)
+
+    self.car_fw = [CarFw(ecu=Ecu.engine, fwVersion=b'engine', brand='honda', address=0x7e0),
+                   CarFw(ecu=Ecu.eps, fwVersion=b'eps', brand='honda', address=0x18da30f1, subAddress=0x1)]
+
+  def test_round_trip(self):
+    assert load_cached_fw(VIN, ECU_RX_ADDRS) is None
+    save_cached_fw(VIN, ECU_RX_ADDRS, self.car_fw)
+    assert [fw.to_dict() for fw in load_cached_fw(VIN, ECU_RX_ADDRS)] == [fw.to_dict() for fw in self.car_fw]
+
+  def test_different_car(self):
+    save_cached_fw(VIN, ECU_RX_ADDRS, self.car_fw)
+    assert load_cached_fw("1HGBH41JXMN109187", ECU_RX_ADDRS) is None
+    assert load_cached_fw(VIN, ECU_RX_ADDRS | {(0x7e2, None, 0)}) is None
+    assert load_cached_fw(VIN, set()) is None
+
+  def test_corrupt(self):
+    path = get_fingerprint_cache_path(VIN, ECU_RX_ADDRS)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+      f.write(b'\x01\x02\x03')
+    assert load_cached_fw(VIN, ECU_RX_ADDRS) is None
+
+  def test_failed_save(self):
+    # best effort, a failed write leaves nothing behind
+    with patch("opendbc.car.fingerprint_cache.os.replace", side_effect=OSError):
+      save_cached_fw(VIN, ECU_RX_ADDRS, self.car_fw)
+    assert load_cached_fw(VIN, ECU_RX_ADDRS) is None
+    assert os.listdir(os.path.dirname(get_fingerprint_cache_path(VIN, ECU_RX_ADDRS))) == []
+
+  def patch_fw_queries(self):
+    patches = [patch("opendbc.car.car_helpers.get_vin", return_value=(0x7e8, 0, VIN)),
+               patch("opendbc.car.car_helpers.get_present_ecus", return_value=ECU_RX_ADDRS),
+               patch("opendbc.car.car_helpers.can_fingerprint", return_value=(None, {})),
+               patch("opendbc.car.car_helpers.get_fw_versions_ordered", return_value=self.car_fw),
+               patch("opendbc.car.car_helpers.verify_fw_versions", return_value=True)]
+    mocks = [p.start() for p in patches]
+    for p in patches:
+      self.addCleanup(p.stop)
+    return mocks[-2:]
+
+  def test_fingerprint_disabled(self):
+    # opt-in, the FW versions are queried every time
+    get_fw_versions_ordered, verify_fw_versions = self.patch_fw_queries()
+    for _ in range(2):
+      fingerprint(lambda **kwargs: [], lambda msgs: None, lambda obd: None, None)
+    assert get_fw_versions_ordered.call_count == 2
+    verify_fw_versions.assert_not_called()
+    assert load_cached_fw(VIN, ECU_RX_ADDRS) is None
+
+  def test_fingerprint(self):
+    # the first drive queries and saves, the next one only verifies
+    get_fw_versions_ordered, verify_fw_versions = self.patch_fw_queries()
+    with patch.dict(os.environ, {"ENABLE_FW_CACHE": "1"}):
+      for _ in range(2):
+        _, _, _, car_fw, _, _ = fingerprint(lambda **kwargs: [], lambda msgs: None, lambda obd: None, None)
+        assert [fw.to_dict() for fw in car_fw] == [fw.to_dict() for fw in self.car_fw]
+      assert get_fw_versions_ordered.call_count == 1
+      assert verify_fw_versions.call_count == 1
+
+      # re-queried once the essential ECUs change
+      verify_fw_versions.return_value = False
+      fingerprint(lambda **kwargs: [], lambda msgs: None, lambda obd: None, None)
+      assert get_fw_versions_ordered.call_count == 2
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -1,3 +1,5 @@
+import os
+import tempfile
 import unittest
 from unittest.mock import patch
 import random
@@ -8,8 +10,12 @@ from opendbc.car.can_definitions import CanData
 from opendbc.car.car_helpers import interfaces
 from opendbc.car.structs import CarParams
 from opendbc.car.fingerprints import FW_VERSIONS
-from opendbc.car.fw_versions import FW_QUERY_CONFIGS, FUZZY_EXCLUDE_ECUS, VERSIONS, build_fw_dict, \
-                                    match_fw_to_car, get_brand_ecu_matches, get_fw_versions, get_present_ecus
+from opendbc.car.fw_query_definitions import ESSENTIAL_ECUS, FwQueryConfig, Request
+from opendbc.car.fw_versions import FW_QUERY_CONFIGS, FUZZY_EXCLUDE_ECUS, VERSIONS, FwQueryJob, FwQueryLatencies, build_fw_dict, get_fw_index, \
+                                    match_fw_to_car, match_fw_to_car_exact, match_fw_to_car_fuzzy, get_brand_ecu_matches, \
+                                    get_fw_versions, get_present_ecus, schedule_fw_queries, verify_fw_versions
+from opendbc.car.isotp_parallel_query import IsoTpParallelQuery, get_data_concurrently
+from opendbc.car.uds import IsoTpMessage
 from opendbc.car.vin import get_vin
 from opendbc.testing import parameterized
 
@@ -50,6 +56,31 @@ class TestFwFingerprint(unittest.TestCase):
         if len(matches) != 0:
           self.assertFingerprints(matches, car_model)
 
+  def test_fw_index(self):
+    # the all brands index is the union of the per-brand ones
+    brand_indexes = [get_fw_index(brand) for brand in VERSIONS]
+    assert get_fw_index(None) is get_fw_index(None)
+    assert get_fw_index(None).expected == {c: e for index in brand_indexes for c, e in index.expected.items()}
+    assert set(get_fw_index(None).fuzzy) == {k for index in brand_indexes for k in index.fuzzy}
+
+  def test_exact_match_extra_fw_versions(self):
+    car_model = "TOYOTA_RAV4_TSS2"
+    ecus = FW_VERSIONS[car_model]
+    live_fw_versions = {(addr, sub_addr): {fws[0]} for (_, addr, sub_addr), fws in ecus.items()}
+    assert car_model in match_fw_to_car_exact(live_fw_versions, "toyota")
+
+    ecu = next(ecu for ecu in ecus if ecu[1] == 0x700)  # engine
+    live_fw_versions[ecu[1:]] = {b'\xffunknown'}
+    assert car_model not in match_fw_to_car_exact(live_fw_versions, "toyota")
+    assert car_model in match_fw_to_car_exact(live_fw_versions, "toyota", extra_fw_versions={car_model: {ecu: [b'\xffunknown']}})
+
+  def test_fuzzy_match_exclude(self):
+    car_model = "TOYOTA_RAV4_TSS2"
+    live_fw_versions = build_fw_dict([CarFw(ecu=ecu, fwVersion=fws[0], brand="toyota", address=addr, subAddress=sub_addr or 0)
+                                      for (ecu, addr, sub_addr), fws in FW_VERSIONS[car_model].items()])
+    assert match_fw_to_car_fuzzy(live_fw_versions, "toyota", log=False) == {car_model}
+    assert match_fw_to_car_fuzzy(live_fw_versions, "toyota", log=False, exclude=car_model) != {car_model}
+
   @parameterized("brand, car_model, ecus", [(b, c, e[c]) for b, e in VERSIONS.items() for c in e])
   def test_custom_fuzzy_match(self, brand, car_model, ecus):
     # Assert brand-specific fuzzy fingerprinting function doesn't disagree with standard fuzzy function
@@ -218,9 +249,14 @@ class TestFwFingerprintTiming(unittest.TestCase):
     self.total_time += timeout
     return {}
 
+  def fake_get_data_concurrently(self, queries, timeout):
+    # concurrent queries share one receive loop, so each round takes one timeout
+    self.total_time += timeout
+    return [{} for _ in queries]
+
   def _benchmark_brand(self, brand):
     self.total_time = 0
-    with patch("opendbc.car.isotp_parallel_query.IsoTpParallelQuery.get_data", self.fake_get_data):
+    with patch("opendbc.car.fw_versions.get_data_concurrently", self.fake_get_data_concurrently):
       for _ in range(self.N):
         # Treat each brand as the most likely (aka, the first) brand with OBD multiplexing initially on
         self.current_obd_multiplexing = True
@@ -262,20 +298,20 @@ class TestFwFingerprintTiming(unittest.TestCase):
         print(f'get_vin {name} case, query time={self.total_time / self.N} seconds')
 
   def test_fw_query_timing(self):
-    total_ref_time = 8.2
+    total_ref_time = 6.3
     brand_ref_times = {
       'gm': 1.0,
       'body': 0.1,
       'chrysler': 0.3,
-      'ford': 1.5,
-      'honda': 0.45,
-      'hyundai': 0.65,
+      'ford': 1.4,
+      'honda': 0.35,
+      'hyundai': 0.35,
       'mazda': 0.1,
-      'nissan': 1.6,
-      'subaru': 0.65,
+      'nissan': 1.1,
+      'subaru': 0.45,
       'tesla': 0.1,
-      'toyota': 0.7,
-      'volkswagen': 0.65,
+      'toyota': 0.4,
+      'volkswagen': 0.25,
       'rivian': 0.3,
       'psa': 0.1,
     }
@@ -296,6 +332,155 @@ class TestFwFingerprintTiming(unittest.TestCase):
       self._assert_timing(total_time, total_ref_time)
       print(f'all brands, total FW query time={total_time} seconds')
 
+  def test_schedule_fw_queries(self):
+    config = FwQueryConfig(requests=[])
+
+    def job(bus, addr, obd_multiplexing=True, request=b'\x22'):
+      return FwQueryJob('any', config, Request([request], [b'\x62'], bus=bus, obd_multiplexing=obd_multiplexing), [(addr, None)])
+
+    a, b, c, d, e = job(0, 0x7e0), job(0, 0x7e0, request=b'\x1a'), job(1, 0x7e0), job(1, 0x7e1, obd_multiplexing=False), job(0, 0x7e1)
+    # b waits for a on the same ECU, d for the next OBD multiplexing mode
+    assert schedule_fw_queries([a, b, c, d, e]) == [[0, 2, 4], [1, 3]]
+    # the response address of one query is the request address of another
+    f, g = job(0, 0x7e0), job(0, 0x7e8)
+    assert schedule_fw_queries([f, g]) == [[0], [1]]
+
+  def test_fw_query_rounds(self):
+    # every round only runs non-conflicting queries, all in the OBD multiplexing mode set for it
+    round_obd_multiplexing = []
+
+    def fake_get_data_concurrently(queries, timeout):
+      round_obd_multiplexing.append(self.current_obd_multiplexing)
+      return [{} for _ in queries]
+
+    for brand in FW_QUERY_CONFIGS:
+      with self.subTest(brand=brand):
+        round_obd_multiplexing.clear()
+        self.current_obd_multiplexing = True
+        self.total_time = 0.0
+        with patch("opendbc.car.fw_versions.get_data_concurrently", fake_get_data_concurrently), \
+             patch("opendbc.car.fw_versions.schedule_fw_queries", wraps=schedule_fw_queries) as schedule:
+          get_fw_versions(self.fake_can_recv, self.fake_can_send, self.fake_set_obd_multiplexing, brand)
+
+        all_jobs = schedule.call_args.args[0]
+        rounds = [[all_jobs[i] for i in idxs] for idxs in schedule_fw_queries(all_jobs)]
+        assert len(rounds) == len(round_obd_multiplexing) > 0
+        for jobs, obd_multiplexing in zip(rounds, round_obd_multiplexing, strict=True):
+          assert all(job.obd_multiplexing in (None, obd_multiplexing) for job in jobs)
+          assert not any(job.conflicts(other) for i, job in enumerate(jobs) for other in jobs[i + 1:])
+
+  @staticmethod
+  def fake_ecus(silent=()):
+    """can_send and can_recv for ECUs answering single frame requests, each with its address and bus in the version"""
+    responses = []
+
+    def can_send(msgs):
+      for msg in msgs:
+        if msg.address not in silent:
+          version = b'%d%x' % (msg.src, msg.address)
+          dat = bytes([3 + len(version)]) + b'\x62\xf1\x88' + version
+          responses.append(CanData(msg.address + 8, dat.ljust(8, b'\x00'), msg.src))
+
+    def can_recv(wait_for_one: bool = False):
+      packet = responses.copy()
+      responses.clear()
+      return [packet]
+
+    return can_send, can_recv
+
+  def test_get_data_concurrently(self):
+    can_send, can_recv = self.fake_ecus()
+    queries = [IsoTpParallelQuery(can_send, can_recv, bus, addrs, [b'\x22\xf1\x88'], [b'\x62\xf1\x88'])
+               for bus, addrs in ((0, [0x7e0, 0x7e1]), (1, [0x7e0]), (0, [0x7e2]))]
+    assert get_data_concurrently(queries, 0.1) == [
+      {(0x7e0, None): b'07e0', (0x7e1, None): b'07e1'},
+      {(0x7e0, None): b'17e0'},
+      {(0x7e2, None): b'07e2'},
+    ]
+
+  def test_rx_dispatch(self):
+    # ECUs behind one rx address are told apart by subaddress, silent ones are never woken
+    responses = []
+
+    def can_send(msgs):
+      for msg in msgs:
+        if msg.dat[0] != 0x3:
+          dat = bytes([msg.dat[0], 0x4]) + b'\x62\xf1\x88' + b'%x' % msg.dat[0]
+          responses.append(CanData(msg.address + 8, dat.ljust(8, b'\x00'), msg.src))
+        responses.append(CanData(msg.address + 8, b'\x04\x04\x62\xf1\x88', msg.src + 1))  # other bus
+
+    def can_recv(wait_for_one: bool = False):
+      packet = responses.copy()
+      responses.clear()
+      return [packet]
+
+    query = IsoTpParallelQuery(can_send, can_recv, 0, [(0x750, 0x1), (0x750, 0x2), (0x750, 0x3)], [b'\x22\xf1\x88'], [b'\x62\xf1\x88'])
+    with patch.object(IsoTpMessage, 'recv', autospec=True, side_effect=IsoTpMessage.recv) as recv:
+      assert query.get_data(timeout=0.1) == {(0x750, 0x1): b'1', (0x750, 0x2): b'2'}
+    assert {m._can_client.sub_addr for m, *_ in (c.args for c in recv.call_args_list)} == {0x1, 0x2}
+    assert not len(query.msg_buffer)
+
+  def test_query_exception(self):
+    # a query that fails doesn't lose the results of the others running with it
+    can_send, can_recv = self.fake_ecus()
+
+    def failing_can_send(msgs):
+      if any(msg.address == 0x7e1 for msg in msgs):
+        raise Exception("send failed")
+      can_send(msgs)
+
+    queries = [IsoTpParallelQuery(failing_can_send, can_recv, 0, addrs, [b'\x22\xf1\x88'], [b'\x62\xf1\x88']) for addrs in ([0x7e0], [0x7e1], [0x7e2])]
+    assert get_data_concurrently(queries, 0.1) == [{(0x7e0, None): b'07e0'}, {}, {(0x7e2, None): b'07e2'}]
+
+  def test_early_exit(self):
+    can_send, can_recv = self.fake_ecus(silent=(0x7e1, 0x7e2))
+    for addrs, expected_latency, results in (([0x7e0, 0x7e1], 0., {(0x7e0, None): b'07e0'}),  # from the answer in this query
+                                             ([0x7e1, 0x7e2], 0.01, {})):  # from past queries
+      with self.subTest(addrs=addrs, expected_latency=expected_latency):
+        query = IsoTpParallelQuery(can_send, can_recv, 0, addrs, [b'\x22\xf1\x88'], [b'\x62\xf1\x88'],
+                                   early_exit_grace=0.01, expected_latency=expected_latency)
+        t = time.monotonic()
+        assert query.get_data(timeout=5.) == results
+        assert time.monotonic() - t < 2.5
+        assert set(query.response_latencies) == set(results)
+
+  def test_fw_query_latencies(self):
+    config = FwQueryConfig(requests=[])
+    job = FwQueryJob('toyota', config, Request([b'\x22\xf1\x88'], [b'\x62\xf1\x88'], bus=0), [(0x7e0, None), (0x7e1, None)])
+    other_job = FwQueryJob('toyota', config, job.request, [(0x7e2, None)])
+    with tempfile.TemporaryDirectory() as cache_dir, patch.dict(os.environ, {"OPENDBC_CACHE_DIR": cache_dir}):
+      latencies = FwQueryLatencies.load()
+      assert latencies.expected(job) == 0.
+
+      latencies.update(job, {(0x7e0, None): 0.01})
+      latencies.update(other_job, {(0x7e2, None): 0.03})
+      latencies.save()
+
+      # its own ECUs' latency if they answered before, else the slowest for the request
+      latencies = FwQueryLatencies.load()
+      assert latencies.expected(job) == 0.01
+      assert latencies.expected(FwQueryJob('toyota', config, job.request, [(0x7e3, None)])) == 0.03
+      assert latencies.expected(FwQueryJob('honda', config, job.request, [(0x7e0, None)])) == 0.
+
+      # get_fw_versions learns them as it queries
+      can_send, can_recv = self.fake_ecus()
+      get_fw_versions(can_recv, can_send, lambda obd: None, 'hyundai', adaptive_timeout=True)
+      assert any(key.startswith('hyundai:') for key in FwQueryLatencies.load().latencies)
+
+  def test_verify_fw_versions(self):
+    can_send, can_recv = self.fake_ecus()
+    car_fw = get_fw_versions(can_recv, can_send, lambda obd: None, 'mazda')
+    assert any(fw.ecu in ESSENTIAL_ECUS for fw in car_fw)
+    assert verify_fw_versions(can_recv, can_send, lambda obd: None, car_fw)
+
+    # an essential ECU was replaced
+    changed_fw = [fw.copy() for fw in car_fw]
+    next(fw for fw in changed_fw if fw.ecu in ESSENTIAL_ECUS).fwVersion = b'other'
+    assert not verify_fw_versions(can_recv, can_send, lambda obd: None, changed_fw)
+
+    # nothing to check
+    assert not verify_fw_versions(can_recv, can_send, lambda obd: None, [fw for fw in car_fw if fw.ecu not in ESSENTIAL_ECUS])
+
   def test_get_fw_versions(self):
     # some coverage on IsoTpParallelQuery and panda UDS library
     # TODO: replace this with full fingerprint simulation testing
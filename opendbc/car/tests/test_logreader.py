@@ -0,0 +1,165 @@
+import mmap
+import multiprocessing
+import os
+import random
+import tempfile
+import unittest
+from unittest import mock
+import warnings
+import zstandard as zstd
+
+from opendbc.car.logreader import LOG_INDEX_VERSION, LogIndex, LogReader, RouteReader, capnp_log, get_log_cache_path, read_log, stream_events
+
+
+def make_log(n: int = 500, start_nanos: int = 0) -> bytes:
+  dat = b""
+  for i in range(n):
+    evt = capnp_log.Event.new_message(logMonoTime=start_nanos + i * 10_000_000)
+    if i % 3 == 0:
+      evt.frame = None
+    else:
+      can = evt.init('can', random.randint(1, 20))
+      for c in can:
+        c.address = random.randint(0, 0x7FF)
+        c.dat = random.randbytes(random.choice((8, 64)))
+        c.src = random.randint(0, 2)
+    dat += evt.to_bytes()
+  return dat
+
+
+def events(lr) -> list:
+  return [e.to_dict() for e in lr]
+
+
+class TestLogReader(unittest.TestCase):
+  @classmethod
+  def setUpClass(cls):
+    cls.tmpdir = tempfile.TemporaryDirectory()
+    cls.dat = make_log()
+    cls.rlog = os.path.join(cls.tmpdir.name, "rlog")
+    with open(cls.rlog, "wb") as f:
+      f.write(cls.dat)
+    cls.rlog_zst = os.path.join(cls.tmpdir.name, "rlog.zst")
+    with open(cls.rlog_zst, "wb") as f:
+      f.write(zstd.compress(cls.dat))
+
+  @classmethod
+  def tearDownClass(cls):
+    cls.tmpdir.cleanup()
+
+  def test_streaming(self):
+    expected = events(LogReader(self.rlog))
+    assert len(expected) == 500
+    for fn in (self.rlog, self.rlog_zst):
+      assert events(LogReader(fn)) == expected
+      assert events(LogReader(fn, streaming=True)) == expected
+      # messages split across chunks
+      for chunk_size in (7, 1000):
+        assert [e.to_dict() for e in stream_events(fn, chunk_size)] == expected
+
+    with self.assertRaises(ValueError):
+      LogReader(self.rlog, streaming=True, sort_by_time=True)
+
+  def test_types(self):
+    expected = [e for e in events(LogReader(self.rlog)) if 'can' in e]
+    assert 0 < len(expected) < 500
+    for fn in (self.rlog, self.rlog_zst):
+      assert events(LogReader(fn, types={'can'})) == expected
+      assert events(LogReader(fn, types={'can'}, streaming=True)) == expected
+      assert events(LogReader(fn, types={'can', 'frame'})) == events(LogReader(fn))
+      assert events(LogReader(fn, types=set())) == []
+
+    with self.assertRaises(ValueError):
+      LogReader(self.rlog, types={'can', 'notAnEvent'})
+
+  def test_mmap(self):
+    assert isinstance(read_log(self.rlog), mmap.mmap)
+    assert isinstance(read_log(self.rlog_zst), bytes)
+
+    expected = events(LogReader(self.rlog))
+    with tempfile.TemporaryDirectory() as cache_dir, mock.patch.dict(os.environ, {"OPENDBC_CACHE_DIR": cache_dir}):
+      cache_path = get_log_cache_path(self.rlog_zst)
+      assert events(LogReader(self.rlog_zst, cache=True)) == expected
+      assert os.path.isfile(cache_path)
+
+      # later reads map the decompressed copy
+      with mock.patch("opendbc.car.logreader.decompress_stream") as decompress:
+        assert isinstance(read_log(self.rlog_zst, cache=True), mmap.mmap)
+        assert events(LogReader(self.rlog_zst, cache=True, types={'can'})) == [e for e in expected if 'can' in e]
+        decompress.assert_not_called()
+
+  def test_index(self):
+    lr = LogReader(self.rlog)
+    expected = events(lr)
+    window = [e.to_dict() for e in lr.time_window(1_000_000_000, 2_000_000_000, 'can')]
+    assert 0 < len(window) < 100
+
+    with tempfile.TemporaryDirectory() as cache_dir, mock.patch.dict(os.environ, {"OPENDBC_CACHE_DIR": cache_dir}):
+      for fn in (self.rlog, self.rlog_zst):
+        ilr = LogReader(fn, cache=True, index=True)
+        assert os.path.isfile(get_log_cache_path(fn, f".idx{LOG_INDEX_VERSION}.npz"))
+        assert events(ilr) == expected
+        assert [e.to_dict() for e in ilr.time_window(1_000_000_000, 2_000_000_000, 'can')] == window
+        assert [c.to_dict() for c in ilr.first('can')] == [c.to_dict() for c in lr.first('can')]
+        assert LogReader(fn, index=True, types={'frame'}).first('can') is None
+        assert events(LogReader(fn, index=True, types={'can'})) == [e for e in expected if 'can' in e]
+        assert events(LogReader(fn, index=True, sort_by_time=True)) == events(LogReader(fn, sort_by_time=True))
+
+        # later readers load the persisted index
+        with mock.patch.object(LogIndex, "build") as build:
+          assert events(LogReader(fn, cache=True, index=True)) == expected
+          build.assert_not_called()
+
+    # without cache nothing is persisted
+    with tempfile.TemporaryDirectory() as cache_dir, mock.patch.dict(os.environ, {"OPENDBC_CACHE_DIR": cache_dir}):
+      assert events(LogReader(self.rlog_zst, index=True)) == expected
+      assert os.listdir(cache_dir) == []
+
+  def test_index_first_by_time(self):
+    fn = os.path.join(self.tmpdir.name, "unsorted")
+    with open(fn, "wb") as f:
+      for t in (30, 20, 10):
+        f.write(capnp_log.Event.new_message(logMonoTime=t, can=[{'address': t}]).to_bytes())
+    for sort_by_time, address in ((False, 30), (True, 10)):
+      assert LogReader(fn, sort_by_time=sort_by_time).first('can')[0].address == address
+      assert LogReader(fn, index=True, sort_by_time=sort_by_time).first('can')[0].address == address
+
+  def test_index_truncated(self):
+    fn = os.path.join(self.tmpdir.name, "truncated.zst")
+    with open(fn, "wb") as f:
+      f.write(zstd.compress(self.dat[:-10]))
+    with tempfile.TemporaryDirectory() as cache_dir, mock.patch.dict(os.environ, {"OPENDBC_CACHE_DIR": cache_dir}), warnings.catch_warnings(record=True) as w:
+      warnings.simplefilter("always")
+      assert len(list(LogReader(fn, cache=True, index=True))) == 499
+
+      # the persisted index is reused even though it doesn't cover the whole log
+      with mock.patch.object(LogIndex, "build") as build:
+        assert len(list(LogReader(fn, cache=True, index=True))) == 499
+        build.assert_not_called()
+      assert len(w) == 2
+
+  def test_route_reader(self):
+    # segments overlap by a few events at their boundaries
+    fns = []
+    for seg in range(4):
+      fns.append(os.path.join(self.tmpdir.name, f"{seg}--rlog.zst"))
+      with open(fns[-1], "wb") as f:
+        f.write(zstd.compress(make_log(100, seg * 950_000_000)))
+
+    expected = sorted((e for fn in fns for e in events(LogReader(fn))), key=lambda e: e['logMonoTime'])
+    assert events(RouteReader(fns, workers=0, lookahead=1)) == expected
+    assert events(RouteReader(fns, workers=0, types={'can'})) == [e for e in expected if 'can' in e]
+    assert events(RouteReader([], workers=0)) == []
+
+    # parallel test runners use daemonic workers, which can't start a pool
+    if not multiprocessing.current_process().daemon:
+      assert events(RouteReader(fns, workers=2, lookahead=1)) == expected
+
+  def test_streaming_truncated(self):
+    fn = os.path.join(self.tmpdir.name, "truncated")
+    with open(fn, "wb") as f:
+      f.write(self.dat[:-10])
+    with warnings.catch_warnings(record=True) as w:
+      warnings.simplefilter("always")
+      assert len(list(stream_events(fn))) == 499
+      assert len(w) == 1
@@ -155,7 +155,7 @@ def create_ui_command(packer, steer, chime, left_line, right_line, left_lane_dep
   return packer.make_can_msg("LKAS_HUD", 0, values)
 
 
-def toyota_checksum(address: int, sig, d: bytearray) -> int:
+def toyota_checksum(address: int, sig, d: bytes | bytearray | memoryview) -> int:
   s = len(d)
   addr = address
   while addr:
@@ -1,4 +1,6 @@
-from opendbc.car.crc import CRC8H2F
+import numpy as np
+
+from opendbc.car.crc import CRC8H2F, crc8_batch
 
 
 def create_steering_control(packer, bus, apply_torque, lkas_enabled):
@@ -172,7 +174,7 @@ def create_aeb_hud(packer, aeb_supported, fcw_active):
   return packer.make_can_msg("ACC_15", 0, values)
 
 
-def volkswagen_mqb_meb_checksum(address: int, sig, d: bytearray) -> int:
+def volkswagen_mqb_meb_checksum(address: int, sig, d: bytes | bytearray | memoryview) -> int:
   crc = 0xFF
   for i in range(1, len(d)):
     crc ^= d[i]
@@ -185,7 +187,16 @@ def volkswagen_mqb_meb_checksum(address: int, sig, d: bytearray) -> int:
   return crc ^ 0xFF
 
 
-def xor_checksum(address: int, sig, d: bytearray, initial_value: int = 0) -> int:
+def volkswagen_mqb_meb_checksum_batch(address: int, sig, data: np.ndarray) -> np.ndarray:
+  payload = data[:, 1:]
+  const = VOLKSWAGEN_MQB_MEB_CONSTANTS.get(address)
+  if const:
+    counter = data[:, 1] & 0x0F
+    payload = np.hstack((payload, np.array(const, dtype=np.uint8)[counter][:, None]))
+  return crc8_batch(CRC8H2F, payload, xor_out=0xFF)
+
+
+def xor_checksum(address: int, sig, d: bytes | bytearray | memoryview, initial_value: int = 0) -> int:
   checksum = initial_value
   checksum_byte = sig.start_bit // 8
   for i in range(len(d)):
@@ -2,6 +2,7 @@
 import importlib
 import os
 import re
+from functools import cache
 from pathlib import Path
 
 generator_path = os.path.dirname(os.path.realpath(__file__))
@@ -31,35 +32,32 @@ def _create_dbc_content(src_dir: str, filename: str, extra_files: dict[str, str]
   return ''.join(parts)
 
 
-def _collect_script_outputs() -> dict[str, dict[str, str]]:
-  """Import and call generate() from each sub-generator script.
-  Returns {dir_name: {filename: content}}."""
-  outputs: dict[str, dict[str, str]] = {}
+@cache
+def _script_outputs(src_dir: str) -> dict[str, str]:
+  """Import and call generate() from each sub-generator script in src_dir.
+  Returns {filename: content}."""
+  outputs: dict[str, str] = {}
 
-  for py_file in sorted(Path(generator_path).rglob("*.py")):
+  for py_file in sorted(Path(src_dir).glob("*.py")):
     if py_file.name.startswith("test_") or py_file.name == "generator.py":
       continue
 
-    dir_name = py_file.parent.name
-    module_name = f"opendbc.dbc.generator.{dir_name}.{py_file.stem}"
+    module_name = f"opendbc.dbc.generator.{py_file.parent.name}.{py_file.stem}"
     mod = importlib.import_module(module_name)
     if hasattr(mod, 'generate'):
-      outputs.setdefault(dir_name, {}).update(mod.generate())
+      outputs.update(mod.generate())
 
   return outputs
 
 
 def generate_all() -> dict[str, str]:
   """Generate all DBC content in memory. Returns {name: content} where name has no .dbc extension."""
-  script_outputs = _collect_script_outputs()
-
   result = {}
   for src_dir, _, filenames in os.walk(generator_path):
     if src_dir == generator_path:
       continue
 
-    dir_name = os.path.basename(src_dir)
-    extra = script_outputs.get(dir_name, {})
+    extra = _script_outputs(src_dir)
 
     # all non-_ .dbc files: on-disk templates + script-generated
     all_dbc_files = {f for f in filenames if f.endswith('.dbc') and not f.startswith('_')}
@@ -73,6 +71,38 @@ def generate_all() -> dict[str, str]:
   return result
 
 
+@cache
+def _generated_dbc_index() -> dict[str, tuple[str, str]]:
+  """Map each generated DBC name to its (src_dir, filename) recipe without reading or importing anything.
+  Sub-generator scripts are expected to output a DBC named after themselves."""
+  index = {}
+  for src_dir, _, filenames in os.walk(generator_path):
+    if src_dir == generator_path:
+      continue
+
+    dbc_files = {f for f in filenames if f.endswith('.dbc') and not f.startswith('_')}
+    dbc_files |= {f.replace('.py', '.dbc') for f in filenames if f.endswith('.py') and not f.startswith(('_', 'test_'))}
+    for filename in dbc_files:
+      index[filename.replace('.dbc', '_generated')] = (src_dir, filename)
+  return index
+
+
+@cache
+def generate_dbc(name: str) -> str | None:
+  """Generate a single DBC with its includes, only importing the sub-generator scripts of its own directory.
+  Returns None if name is not a generated DBC."""
+  if not name.endswith('_generated'):
+    return None
+
+  recipe = _generated_dbc_index().get(name)
+  if recipe is None:
+    # not named after a template or script, need to run everything to find it
+    return generate_all().get(name)
+
+  src_dir, filename = recipe
+  return _create_dbc_content(src_dir, filename, _script_outputs(src_dir))
+
+
 def create_all(output_path: str):
   """Generate all DBC files and write them to output_path (for backward compatibility)."""
   import glob
@@ -103,30 +103,102 @@ static bool is_msg_valid(RxCheck addr_list[], int index) {
   return valid;
 }
 
+// (addr, bus, len) -> rx_checks index hash table with linear probing, built when the safety mode is set.
+// saves scanning every RxCheck on every received message. sized for the largest safety mode (12 msgs),
+// configs too large for it fall back to the scan
+#define RX_CHECK_LOOKUP_BITS 5U
+#define RX_CHECK_LOOKUP_SIZE (1U << RX_CHECK_LOOKUP_BITS)
+#define RX_CHECK_LOOKUP_MAX_ENTRIES (RX_CHECK_LOOKUP_SIZE / 2U)  // keeps empty slots to end probing
+
+typedef struct {
+  int8_t check;  // index into rx_checks, -1 if the slot is empty
+  uint8_t msg;   // index into that RxCheck's messages
+} RxCheckLookupSlot;
+
+static RxCheckLookupSlot rx_check_lookup[RX_CHECK_LOOKUP_SIZE];
+static bool rx_check_lookup_valid = false;
+static const RxCheck *rx_check_lookup_list = NULL;  // the rx_checks the table was built for
+static int rx_check_lookup_len = 0;
+
+static uint32_t rx_check_lookup_slot(int addr, unsigned int bus, int len) {
+  uint32_t key = (uint32_t)addr ^ (bus << 29U) ^ ((uint32_t)len << 21U);
+  return (key * 2654435761U) >> (32U - RX_CHECK_LOOKUP_BITS);
+}
+
+static void rx_check_lookup_build(const RxCheck addr_list[], const int len) {
+  for (uint32_t slot = 0U; slot < RX_CHECK_LOOKUP_SIZE; slot++) {
+    rx_check_lookup[slot].check = -1;
+    rx_check_lookup[slot].msg = 0U;
+  }
+  rx_check_lookup_valid = true;
+  rx_check_lookup_list = addr_list;
+  rx_check_lookup_len = len;
+
+  // insert in rx_checks order, so slots with the same key are probed in the order the scan checks them
+  uint32_t entries = 0U;
+  for (int i = 0; i < len; i++) {
+    for (uint8_t j = 0U; (j < MAX_ADDR_CHECK_MSGS) && (addr_list[i].msg[j].addr != 0); j++) {
+      entries++;
+      if (entries > RX_CHECK_LOOKUP_MAX_ENTRIES) {
+        rx_check_lookup_valid = false;
+      } else {
+        const CanMsgCheck *m = &addr_list[i].msg[j];
+        uint32_t slot = rx_check_lookup_slot(m->addr, m->bus, m->len);
+        while (rx_check_lookup[slot].check != -1) {
+          slot = (slot + 1U) % RX_CHECK_LOOKUP_SIZE;
+        }
+        rx_check_lookup[slot].check = (int8_t)i;
+        rx_check_lookup[slot].msg = j;
+      }
+    }
+  }
+}
+
 static int get_addr_check_index(const CANPacket_t *msg, RxCheck addr_list[], const int len) {
   int addr = msg->addr;
   int length = GET_LEN(msg);
 
   int index = -1;
-  for (int i = 0; i < len; i++) {
-    // if multiple msgs are allowed, determine which one is present on the bus
-    if (!addr_list[i].status.msg_seen) {
-      for (uint8_t j = 0U; (j < MAX_ADDR_CHECK_MSGS) && (addr_list[i].msg[j].addr != 0); j++) {
-        if ((addr == addr_list[i].msg[j].addr) && (msg->bus == addr_list[i].msg[j].bus) &&
-              (length == addr_list[i].msg[j].len)) {
+  if (rx_check_lookup_valid && (addr_list == rx_check_lookup_list) && (len == rx_check_lookup_len)) {
+    uint32_t slot = rx_check_lookup_slot(addr, msg->bus, length);
+    while ((index == -1) && (rx_check_lookup[slot].check != -1)) {
+      int i = rx_check_lookup[slot].check;
+      uint8_t j = rx_check_lookup[slot].msg;
+      if ((addr == addr_list[i].msg[j].addr) && (msg->bus == addr_list[i].msg[j].bus) && (length == addr_list[i].msg[j].len)) {
+        // if multiple msgs are allowed, the first one seen on the bus is used
+        if (!addr_list[i].status.msg_seen) {
           addr_list[i].status.index = j;
           addr_list[i].status.msg_seen = true;
-          break;
+          index = i;
+        } else if (addr_list[i].status.index == (int)j) {
+          index = i;
+        } else {
+          // another msg of this check was seen first
         }
       }
+      slot = (slot + 1U) % RX_CHECK_LOOKUP_SIZE;
     }
+  } else {
+    for (int i = 0; i < len; i++) {
+      // if multiple msgs are allowed, determine which one is present on the bus
+      if (!addr_list[i].status.msg_seen) {
+        for (uint8_t j = 0U; (j < MAX_ADDR_CHECK_MSGS) && (addr_list[i].msg[j].addr != 0); j++) {
+          if ((addr == addr_list[i].msg[j].addr) && (msg->bus == addr_list[i].msg[j].bus) &&
+                (length == addr_list[i].msg[j].len)) {
+            addr_list[i].status.index = j;
+            addr_list[i].status.msg_seen = true;
+            break;
+          }
+        }
+      }
 
-    if (addr_list[i].status.msg_seen) {
-      int idx = addr_list[i].status.index;
-      if ((addr == addr_list[i].msg[idx].addr) && (msg->bus == addr_list[i].msg[idx].bus) &&
-          (length == addr_list[i].msg[idx].len)) {
-        index = i;
-        break;
+      if (addr_list[i].status.msg_seen) {
+        int idx = addr_list[i].status.index;
+        if ((addr == addr_list[i].msg[idx].addr) && (msg->bus == addr_list[i].msg[idx].bus) &&
+            (length == addr_list[i].msg[idx].len)) {
+          index = i;
+          break;
+        }
       }
     }
   }
@@ -481,6 +553,7 @@ int set_safety_hooks(uint16_t mode, uint16_t param) {
       current_safety_config.rx_checks[j].status = (RxStatus){0};
     }
   }
+  rx_check_lookup_build(current_safety_config.rx_checks, current_safety_config.rx_checks_len);
   return set_status;
 }
 
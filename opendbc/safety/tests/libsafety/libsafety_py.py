@@ -1,38 +1,118 @@
+import fcntl
+import glob
+import hashlib
 import os
 import subprocess
 import tempfile
 from pathlib import Path
 
+import numpy as np
 from cffi import FFI
 
-from opendbc.safety import LEN_TO_DLC
+from opendbc import get_cache_dir
+from opendbc.safety import DLC_TO_LEN, LEN_TO_DLC
 
 libsafety_dir = os.path.dirname(os.path.abspath(__file__))
 
 
-def _build_libsafety() -> str:
-  """Compile libsafety.so to a temp file and return its path."""
+# (cflags, ldflags) on top of the common flags
+BUILD_PROFILES = {
+  # unit tests and coverage
+  "debug": (
+    ['-g', '-O0', '-fno-omit-frame-pointer', '-fprofile-arcs', '-ftest-coverage'],
+    ['-fsanitize=undefined', '-fno-sanitize-recover=undefined', '-fprofile-arcs', '-ftest-coverage'],
+  ),
+  # replays and benchmarks, optimized and not instrumented
+  "fast": (['-O2'], []),
+}
+
+
+def get_profile(default: str = "debug") -> str:
+  """Build profile to use, overridable with LIBSAFETY_PROFILE."""
+  return os.environ.get("LIBSAFETY_PROFILE", default)
+
+
+def get_build_key(cflags: list[str], ldflags: list[str]) -> str:
+  """Hash of everything that goes into a libsafety build: the safety sources, the flags and the compiler."""
+  h = hashlib.sha256()
+  h.update(repr((cflags, ldflags)).encode())
+  h.update(subprocess.check_output(['cc', '--version']))
+  safety_dir = str(Path(libsafety_dir).parents[1])
+  for fn in sorted(glob.glob(os.path.join(safety_dir, "**", "*.[ch]"), recursive=True)):
+    h.update(os.path.relpath(fn, safety_dir).encode())
+    with open(fn, 'rb') as f:
+      h.update(f.read())
+  return h.hexdigest()[:32]
+
+
+def get_build_dir(profile: str) -> str:
+  """Directory a build profile is cached in. Instrumented builds write coverage data to the absolute path
+  of their object file, so they're kept in this checkout rather than shared with others."""
+  return libsafety_dir if '-ftest-coverage' in BUILD_PROFILES[profile][0] else get_cache_dir("libsafety")
+
+
+def _compile(safety_os: str, libsafety_so: str, cflags: list[str], ldflags: list[str]):
   root = str(Path(libsafety_dir).parents[3])
   safety_c = os.path.join(libsafety_dir, "safety.c")
+  subprocess.check_call(['cc', '-fPIC', *cflags, '-I', root, '-c', safety_c, '-o', safety_os])
+  subprocess.check_call(['cc', '-shared', safety_os, '-o', libsafety_so, *ldflags])
+
+
+def _build_libsafety(profile: str | None = None) -> str:
+  """Compile libsafety.so with a build profile and return its path.
+  Builds are cached by content hash and shared between processes, set DISABLE_LIBSAFETY_CACHE to always rebuild."""
+  profile = profile or get_profile()
+  if profile not in BUILD_PROFILES:
+    raise ValueError(f"unknown libsafety build profile: {profile}")
+  profile_cflags, profile_ldflags = BUILD_PROFILES[profile]
 
   cflags = [
     '-Wall', '-Wextra', '-Werror', '-nostdlib', '-fno-builtin',
     '-std=gnu11', '-Wfatal-errors', '-Wno-pointer-to-int-cast',
-    '-g', '-O0', '-fno-omit-frame-pointer', '-DALLOW_DEBUG',
-    '-fprofile-arcs', '-ftest-coverage',
-  ]
-  ldflags = [
-    '-fsanitize=undefined', '-fno-sanitize-recover=undefined',
-    '-fprofile-arcs', '-ftest-coverage',
+    '-DALLOW_DEBUG', *profile_cflags,
   ]
+  ldflags = profile_ldflags
 
-  fd, safety_os = tempfile.mkstemp(suffix='.os', dir=libsafety_dir)
-  os.close(fd)
-  fd, libsafety_so = tempfile.mkstemp(suffix='.so')
-  os.close(fd)
+  if os.environ.get("DISABLE_LIBSAFETY_CACHE"):
+    fd, safety_os = tempfile.mkstemp(suffix='.os', dir=libsafety_dir)
+    os.close(fd)
+    fd, libsafety_so = tempfile.mkstemp(suffix='.so')
+    os.close(fd)
+    _compile(safety_os, libsafety_so, cflags, ldflags)
+    return libsafety_so
 
-  subprocess.check_call(['cc', '-fPIC', *cflags, '-I', root, '-c', safety_c, '-o', safety_os])
-  subprocess.check_call(['cc', '-shared', safety_os, '-o', libsafety_so, *ldflags])
+  name = f"libsafety-{profile}-{get_build_key(cflags, ldflags)}"
+  cache_dir = get_cache_dir("libsafety")
+
+  coverage = '-ftest-coverage' in cflags
+  build_dir = get_build_dir(profile)
+  libsafety_so = os.path.join(build_dir, f"{name}.so")
+  safety_os = os.path.join(build_dir, f"{name}.os")
+  gcno = os.path.splitext(safety_os)[0] + ".gcno"
+  lock_path = os.path.join(cache_dir, f"{name}-{hashlib.sha256(build_dir.encode()).hexdigest()[:8]}.lock")
+
+  def is_built() -> bool:
+    return os.path.isfile(libsafety_so) and (not coverage or os.path.isfile(gcno))
+
+  if is_built():
+    return libsafety_so
+
+  # one process builds while the others wait for it
+  os.makedirs(cache_dir, exist_ok=True)
+  with open(lock_path, 'w') as lock:
+    fcntl.flock(lock, fcntl.LOCK_EX)
+    if not is_built():
+      fd, tmp_so = tempfile.mkstemp(suffix='.so.tmp', dir=build_dir)
+      os.close(fd)
+      try:
+        _compile(safety_os, tmp_so, cflags, ldflags)
+        os.replace(tmp_so, libsafety_so)
+      except BaseException:
+        os.unlink(tmp_so)
+        raise
+      finally:
+        if not coverage and os.path.exists(safety_os):
+          os.unlink(safety_os)
   return libsafety_so
 
 
@@ -114,6 +194,17 @@ int mutation_get_active_mutant(void);
 void ignition_can_hook(const CANPacket_t *msg);
 bool get_ignition_can(void);
 void set_ignition_can(bool c);
+
+int get_can_packet_size(void);
+void safety_rx_hook_batch(const CANPacket_t *msgs, const uint32_t *timestamps, int n, bool *results);
+void safety_tx_hook_batch(CANPacket_t *msgs, const uint32_t *timestamps, int n, bool *results, bool *controls_allowed_after);
+
+void set_rx_check_lookup(bool enabled);
+bool get_rx_check_lookup(void);
+void set_test_rx_checks(int len);
+int get_rx_check_index(const CANPacket_t *msg);
+int get_rx_check_lookup_slot(int addr, int bus, int len);
+int get_rx_check_lookup_size(void);
 """)
 
 class LibSafety:
@@ -124,6 +215,10 @@ def load(path):
   global libsafety
   libsafety = ffi.dlopen(str(path))
 
+def load_profile(profile: str):
+  """Build and load libsafety with a build profile, e.g. load_profile("fast")."""
+  load(_build_libsafety(profile))
+
 def __getattr__(name):
   if name == "libsafety":
     load(_build_libsafety())
@@ -138,3 +233,72 @@ def make_CANPacket(addr: int, bus: int, dat):
   ret[0].bus = bus
   ret[0].data = bytes(dat)
   return ret
+
+
+# bit position of each CANPacket_t header field, packed into its first bytes
+_HEADER_BITS = {name: f.offset * 8 + f.bitshift for name, f in ffi.typeof('CANPacket_t').fields if f.bitshift >= 0}
+_DATA_OFFSET = ffi.offsetof('CANPacket_t', 'data')
+_LEN_TO_DLC = np.full(max(DLC_TO_LEN) + 1, -1, dtype=np.int64)
+_LEN_TO_DLC[DLC_TO_LEN] = np.arange(len(DLC_TO_LEN))
+
+
+def pad_payloads(dats: list[bytes]) -> tuple[np.ndarray, np.ndarray]:
+  """Payloads as a zero padded (n, 64) array and their lengths, for PacketBatch."""
+  lengths = np.array([len(d) for d in dats], dtype=np.int64)
+  data = np.frombuffer(b"".join(d.ljust(64, b"\0") for d in dats), dtype=np.uint8).reshape(len(dats), 64)
+  return data, lengths
+
+
+class PacketBatch:
+  """Preallocated array of CANPacket_t, filled from numpy arrays and run through the batched hooks in one FFI call."""
+  def __init__(self, safety, capacity: int):
+    self.safety = safety
+    self.capacity = capacity
+    stride = safety.get_can_packet_size()
+    self._buf = ffi.new('uint8_t[]', capacity * stride)
+    self.packets = ffi.cast('CANPacket_t *', self._buf)
+    self.timestamps = ffi.new('uint32_t[]', capacity)
+    self.results = ffi.new('bool[]', capacity)
+    self.controls_allowed = ffi.new('bool[]', capacity)
+
+    self._packets_np = np.frombuffer(ffi.buffer(self._buf), dtype=np.uint8).reshape(capacity, stride)
+    self._timestamps_np = np.frombuffer(ffi.buffer(self.timestamps), dtype=np.uint32)
+    self._results_np = np.frombuffer(ffi.buffer(self.results), dtype=np.bool_)
+    self._controls_allowed_np = np.frombuffer(ffi.buffer(self.controls_allowed), dtype=np.bool_)
+
+  def fill(self, addresses, buses, data: np.ndarray, lengths, timestamps) -> int:
+    """Fill the first n packets like make_CANPacket does, data is (n, width) with width <= 64. Returns n."""
+    addresses = np.asarray(addresses, dtype=np.int64)
+    n = len(addresses)
+    if n > self.capacity:
+      raise ValueError(f"batch of {n} packets is over capacity {self.capacity}")
+    dlc = _LEN_TO_DLC[lengths]
+    if n and dlc.min() < 0:
+      raise ValueError("invalid CAN payload length")
+
+    header = addresses << _HEADER_BITS['addr']
+    header |= np.asarray(buses, dtype=np.int64) << _HEADER_BITS['bus']
+    header |= dlc << _HEADER_BITS['data_len_code']
+    header |= (addresses >= 0x800).astype(np.int64) << _HEADER_BITS['extended']
+
+    # the header is under 6 bytes, so its high bytes also clear the checksum, then the data goes over the rest
+    width = data.shape[1]
+    packets = self._packets_np[:n]
+    packets[:, :8] = header.astype('<i8').view(np.uint8).reshape(n, 8)
+    packets[:, _DATA_OFFSET:_DATA_OFFSET + width] = data
+    packets[:, _DATA_OFFSET + width:_DATA_OFFSET + 64] = 0
+    self._timestamps_np[:n] = timestamps
+    return n
+
+  def rx_hook(self, addresses, buses, data, lengths, timestamps) -> np.ndarray:
+    """Run the fwd and rx hooks on each packet in order, setting the timer first. Returns the rx hook results."""
+    n = self.fill(addresses, buses, data, lengths, timestamps)
+    self.safety.safety_rx_hook_batch(self.packets, self.timestamps, n, self.results)
+    return self._results_np[:n].copy()
+
+  def tx_hook(self, addresses, buses, data, lengths, timestamps) -> tuple[np.ndarray, np.ndarray]:
+    """Run the tx hook on each packet in order, setting the timer first.
+    Returns the tx hook results and whether controls were allowed after each one."""
+    n = self.fill(addresses, buses, data, lengths, timestamps)
+    self.safety.safety_tx_hook_batch(self.packets, self.timestamps, n, self.results, self.controls_allowed)
+    return self._results_np[:n].copy(), self._controls_allowed_np[:n].copy()
@@ -214,3 +214,71 @@ void init_tests(void){
   ignition_can = false;
   ignition_can_cnt = 0U;
 }
+
+
+// ***** batched hooks *****
+// one call per batch instead of per packet. msgs is an array with a stride of sizeof(CANPacket_t)
+
+int get_can_packet_size(void){
+  return sizeof(CANPacket_t);
+}
+
+void safety_rx_hook_batch(const CANPacket_t *msgs, const uint32_t *timestamps, int n, bool *results){
+  for (int i = 0; i < n; i++) {
+    set_timer(timestamps[i]);
+    (void)safety_fwd_hook(msgs[i].bus, msgs[i].addr);
+    results[i] = safety_rx_hook(&msgs[i]);
+  }
+}
+
+void safety_tx_hook_batch(CANPacket_t *msgs, const uint32_t *timestamps, int n, bool *results, bool *controls_allowed_after){
+  for (int i = 0; i < n; i++) {
+    set_timer(timestamps[i]);
+    results[i] = safety_tx_hook(&msgs[i]);
+    controls_allowed_after[i] = controls_allowed;
+  }
+}
+
+
+// ***** rx check lookup *****
+
+#define TEST_RX_CHECKS_LEN 40
+
+// every check allows either of the same two messages, more entries than the lookup table holds.
+// both messages hash to the same lookup slot, so finding them relies on probing
+static RxCheck test_rx_checks[TEST_RX_CHECKS_LEN] = {
+  [0 ... (TEST_RX_CHECKS_LEN - 1)] = {.msg = {{0x123, 0, 8, 10U, .ignore_checksum = true, .ignore_counter = true, .ignore_quality_flag = true},
+                                              {0x145, 0, 8, 10U, .ignore_checksum = true, .ignore_counter = true, .ignore_quality_flag = true}, { 0 }}},
+};
+
+void set_rx_check_lookup(bool enabled){
+  rx_check_lookup_build(current_safety_config.rx_checks, current_safety_config.rx_checks_len);
+  if (!enabled) {
+    rx_check_lookup_valid = false;
+  }
+}
+
+bool get_rx_check_lookup(void){
+  return rx_check_lookup_valid;
+}
+
+void set_test_rx_checks(int len){
+  for (int i = 0; i < TEST_RX_CHECKS_LEN; i++) {
+    test_rx_checks[i].status = (RxStatus){0};
+  }
+  current_safety_config.rx_checks = test_rx_checks;
+  current_safety_config.rx_checks_len = len;
+  rx_check_lookup_build(current_safety_config.rx_checks, current_safety_config.rx_checks_len);
+}
+
+int get_rx_check_index(const CANPacket_t *msg){
+  return get_addr_check_index(msg, current_safety_config.rx_checks, current_safety_config.rx_checks_len);
+}
+
+int get_rx_check_lookup_slot(int addr, int bus, int len){
+  return (int)rx_check_lookup_slot(addr, (unsigned int)bus, len);
+}
+
+int get_rx_check_lookup_size(void){
+  return (int)RX_CHECK_LOOKUP_SIZE;
+}
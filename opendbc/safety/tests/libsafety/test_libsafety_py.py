@@ -0,0 +1,163 @@
+import os
+import random
+import re
+import tempfile
+import unittest
+from functools import partial
+from unittest import mock
+import numpy as np
+
+from opendbc.car.structs import CarParams
+from opendbc.safety import DLC_TO_LEN
+from opendbc.safety.tests.libsafety import libsafety_py
+
+
+class TestLibsafetyBuild(unittest.TestCase):
+  def test_build_cache(self):
+    with tempfile.TemporaryDirectory() as cache_dir, mock.patch.dict(os.environ, {"OPENDBC_CACHE_DIR": cache_dir}):
+      libsafety_so = libsafety_py._build_libsafety("fast")
+      assert libsafety_so.startswith(cache_dir)
+      mtime = os.stat(libsafety_so).st_mtime_ns
+
+      # later builds reuse it without compiling
+      with mock.patch.object(libsafety_py, "_compile") as compile_:
+        assert libsafety_py._build_libsafety("fast") == libsafety_so
+        compile_.assert_not_called()
+      assert os.stat(libsafety_so).st_mtime_ns == mtime
+
+      # coverage builds stay in the checkout that compiled them
+      assert libsafety_py.get_build_dir("debug") == libsafety_py.libsafety_dir
+      assert libsafety_py.get_build_dir("fast") == os.path.dirname(libsafety_so)
+
+      lib = libsafety_py.ffi.dlopen(libsafety_so)
+      lib.set_controls_allowed(True)
+      assert lib.get_controls_allowed()
+
+  def test_unknown_profile(self):
+    with self.assertRaises(ValueError):
+      libsafety_py._build_libsafety("notAProfile")
+
+
+class TestBatchedHooks(unittest.TestCase):
+  def setUp(self):
+    self.safety = libsafety_py.libsafety
+    random.seed(0)
+    n = 2000
+    self.addresses = [random.choice((0x1D2, 0x224, 0x260, 0x2E4, 0x343, 0xAA, random.randint(0, 0x1FFFFFFF))) for _ in range(n)]
+    self.buses = [random.randint(0, 2) for _ in range(n)]
+    self.dats = [random.randbytes(random.choice(DLC_TO_LEN)) for _ in range(n)]
+    self.timestamps = [i * 1000 for i in range(n)]
+
+  def reset(self):
+    self.safety.set_safety_hooks(CarParams.SafetyModel.toyota, 73)
+    self.safety.init_tests()
+    self.safety.set_controls_allowed(True)
+
+  def test_rx_tx_batch(self):
+    for tx in (False, True):
+      self.reset()
+      expected, expected_controls = [], []
+      for addr, bus, dat, t in zip(self.addresses, self.buses, self.dats, self.timestamps, strict=True):
+        self.safety.set_timer(t)
+        msg = libsafety_py.make_CANPacket(addr, bus, dat)
+        if tx:
+          expected.append(self.safety.safety_tx_hook(msg))
+          expected_controls.append(self.safety.get_controls_allowed())
+        else:
+          self.safety.safety_fwd_hook(bus, addr)
+          expected.append(self.safety.safety_rx_hook(msg))
+
+      self.reset()
+      batch = libsafety_py.PacketBatch(self.safety, 512)
+      data, lengths = libsafety_py.pad_payloads(self.dats)
+      results, controls = [], []
+      for i in range(0, len(self.addresses), batch.capacity):
+        s = slice(i, i + batch.capacity)
+        if tx:
+          r, c = batch.tx_hook(self.addresses[s], self.buses[s], data[s], lengths[s], self.timestamps[s])
+          controls.extend(c.tolist())
+        else:
+          r = batch.rx_hook(self.addresses[s], self.buses[s], data[s], lengths[s], self.timestamps[s])
+        results.extend(r.tolist())
+
+      assert results == expected
+      assert controls == (expected_controls if tx else [])
+      assert 0 < sum(expected) < len(expected)
+
+  def test_over_capacity(self):
+    batch = libsafety_py.PacketBatch(self.safety, 4)
+    with self.assertRaises(ValueError):
+      batch.rx_hook([1] * 5, [0] * 5, np.zeros((5, 8), dtype=np.uint8), [8] * 5, [0] * 5)
+    with self.assertRaises(ValueError):
+      batch.rx_hook([1], [0], np.zeros((1, 8), dtype=np.uint8), [9], [0])
+
+
+class TestRxCheckLookup(unittest.TestCase):
+  def setUp(self):
+    self.safety = libsafety_py.libsafety
+    self.safety.init_tests()
+
+  def tearDown(self):
+    self.safety.set_safety_hooks(CarParams.SafetyModel.noOutput, 0)
+
+  def check_indexes(self, setup, msgs):
+    # the lookup table finds the same rx checks as scanning them, including which alternative msg gets latched
+    indexes = {}
+    for enabled in (False, True):
+      setup()
+      self.safety.set_rx_check_lookup(enabled)
+      assert self.safety.get_rx_check_lookup() == enabled
+      indexes[enabled] = [self.safety.get_rx_check_index(libsafety_py.make_CANPacket(addr, bus, b"\x00" * length)) for addr, bus, length in msgs]
+    assert indexes[True] == indexes[False]
+    return indexes[True]
+
+  def test_all_modes(self):
+    # every address the safety modes reference
+    modes_dir = os.path.join(os.path.dirname(libsafety_py.__file__), "../../modes")
+    addresses = set()
+    for fn in os.listdir(modes_dir):
+      with open(os.path.join(modes_dir, fn)) as f:
+        addresses |= {int(a, 16) for a in re.findall(r"\b0x[0-9A-Fa-f]+\b", f.read()) if int(a, 16) < 0x20000000}
+
+    random.seed(0)
+    msgs = [(random.choice(sorted(addresses)), random.randint(0, 2), random.choice(DLC_TO_LEN[:9])) for _ in range(5000)]
+    for mode in CarParams.SafetyModel.schema.enumerants.values():
+      for param in (0, 1, 2, 4, 8, 64):
+        with self.subTest(mode=mode, param=param):
+          self.check_indexes(partial(self.safety.set_safety_hooks, mode, param), msgs)
+
+  def test_slots(self):
+    # probing finds the right check whatever slot it starts from, but the hash still has to spread keys over the table
+    size = self.safety.get_rx_check_lookup_size()
+    slot = self.safety.get_rx_check_lookup_slot
+    for bus in range(3):
+      for length in DLC_TO_LEN:
+        slots = [slot(addr, bus, length) for addr in range(0x800)]
+        assert set(slots) == set(range(size)), f"{bus=} {length=}"
+        assert all(0 <= slot(addr, bus, length) < size for addr in (0x18DAF1A0, 0x1FFFFFFF))
+
+    # bus and length are part of the key
+    addrs = range(0x100, 0x200)
+    for other_bus, other_length in ((1, 8), (2, 8), (0, 5), (0, 64)):
+      moved = sum(slot(addr, 0, 8) != slot(addr, other_bus, other_length) for addr in addrs)
+      assert moved > len(addrs) // 2, f"{other_bus=} {other_length=}"
+
+  def test_alternative_msgs(self):
+    self.safety.set_test_rx_checks(2)
+    assert self.safety.get_rx_check_lookup()
+    # both msgs of both checks collide in the table
+    assert self.safety.get_rx_check_lookup_slot(0x123, 0, 8) == self.safety.get_rx_check_lookup_slot(0x145, 0, 8)
+
+    # the first check latches 0x123, so 0x145 goes to the second
+    msgs = [(0x123, 0, 8), (0x145, 0, 8), (0x145, 0, 8), (0x123, 0, 8), (0x123, 1, 8), (0x145, 0, 6)]
+    assert self.check_indexes(partial(self.safety.set_test_rx_checks, 2), msgs) == [0, 1, 1, 0, -1, -1]
+
+    # same when the alternative msg is seen first
+    msgs = [(0x145, 0, 8), (0x123, 0, 8), (0x123, 0, 8), (0x145, 0, 8)]
+    assert self.check_indexes(partial(self.safety.set_test_rx_checks, 2), msgs) == [0, 1, 1, 0]
+
+  def test_too_many_checks(self):
+    # too large for the table, falls back to the scan
+    self.safety.set_test_rx_checks(40)
+    assert not self.safety.get_rx_check_lookup()
+    assert [self.safety.get_rx_check_index(libsafety_py.make_CANPacket(0x145, 0, b"\x00" * 8)) for _ in range(2)] == [0, 0]
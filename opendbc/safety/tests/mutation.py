@@ -1,6 +1,8 @@
 #!/usr/bin/env python3
 import argparse
+import hashlib
 import io
+import json
 import os
 import re
 import subprocess
@@ -11,16 +13,24 @@ import unittest
 from concurrent.futures import ProcessPoolExecutor, as_completed
 from collections import Counter, namedtuple
 from dataclasses import dataclass
+from functools import cache
 from pathlib import Path
 
 import tree_sitter_c as ts_c
 import tree_sitter as ts
 
+from opendbc import get_cache_dir
+
 
 ROOT = Path(__file__).resolve().parents[3]
 SAFETY_DIR = ROOT / "opendbc" / "safety"
 SAFETY_TESTS_DIR = ROOT / "opendbc" / "safety" / "tests"
 SAFETY_C_REL = Path("opendbc/safety/tests/libsafety/safety.c")
+MODES_DIR = SAFETY_DIR / "modes"
+
+# bump to invalidate cached mutant results
+MUTATION_CACHE_VERSION = 1
+MUTATION_CFLAGS = ["-shared", "-fPIC", "-w", "-fno-builtin", "-std=gnu11", "-g0", "-O0", "-DALLOW_DEBUG"]
 
 ANSI_RESET = "\033[0m"
 ANSI_BOLD = "\033[1m"
@@ -367,10 +377,12 @@ def print_live_status(text, *, final=False):
 def _discover_test_catalog():
   loader = unittest.TestLoader()
   catalog = {}
-  for test_file in sorted(SAFETY_TESTS_DIR.glob("test_*.py")):
+  # the libsafety hook tests cover safety.h internals like the rx check lookup. its build tests compile their own library
+  test_files = sorted(SAFETY_TESTS_DIR.glob("test_*.py")) + [SAFETY_TESTS_DIR / "libsafety" / "test_libsafety_py.py"]
+  for test_file in test_files:
     module_name = ".".join(test_file.relative_to(ROOT).with_suffix("").parts)
     suite = loader.loadTestsFromName(module_name)
-    catalog[test_file.name] = [t.id() for group in suite for t in group]
+    catalog[test_file.name] = [t.id() for group in suite for t in group if ".TestLibsafetyBuild." not in t.id()]
   return catalog
 
 
@@ -469,11 +481,114 @@ def compile_mutated_library(preprocessed_source, sites, output_so):
   mutation_source = output_so.with_suffix(".c")
   mutation_source.write_text(instrumented)
 
-  subprocess.run([
-    "cc", "-shared", "-fPIC", "-w", "-fno-builtin", "-std=gnu11",
-    "-g0", "-O0", "-DALLOW_DEBUG",
-    str(mutation_source), "-o", str(output_so),
-  ], cwd=ROOT, check=True)
+  subprocess.run(["cc", *MUTATION_CFLAGS, str(mutation_source), "-o", str(output_so)], cwd=ROOT, check=True)
+
+
+def get_mutated_library(preprocessed_source, sites, cache_dir, tmp_dir):
+  """Instrumented library with every site switchable at runtime, compiled once per distinct source."""
+  if cache_dir is None:
+    output_so = Path(tmp_dir) / "libsafety_mutation.so"
+    compile_mutated_library(preprocessed_source, sites, output_so)
+    return output_so
+
+  h = hashlib.sha256(preprocessed_source.encode())
+  h.update(" ".join(MUTATION_CFLAGS).encode())
+  for site in sites:
+    h.update(f"{site.site_id}:{_site_key(site)}:{site.mutated_op}\n".encode())
+  output_so = Path(cache_dir) / f"libsafety_mutation-{h.hexdigest()[:32]}.so"
+  if not output_so.exists():
+    # only the latest library is kept, older ones are for sources that are gone
+    for old_so in Path(cache_dir).glob("libsafety_mutation-*.so"):
+      old_so.unlink(missing_ok=True)
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_so = Path(cache_dir) / f"{output_so.stem}.{os.getpid()}.tmp.so"
+    compile_mutated_library(preprocessed_source, sites, tmp_so)
+    tmp_so.with_suffix(".c").unlink()
+    os.replace(tmp_so, output_so)
+  return output_so
+
+
+def _hash_files(paths):
+  h = hashlib.sha256()
+  for path in sorted(paths):
+    h.update(str(path.relative_to(ROOT)).encode())
+    h.update(path.read_bytes())
+  return h.hexdigest()
+
+
+INCLUDE_RE = re.compile(r'^\s*#\s*include\s+"([^"]+)"', re.MULTILINE)
+
+
+@cache
+def include_closure(path):
+  """The file and every local header it includes, directly or through other headers."""
+  deps = set()
+  stack = [path]
+  while stack:
+    p = stack.pop()
+    if p in deps:
+      continue
+    deps.add(p)
+    for inc in INCLUDE_RE.findall(p.read_text()):
+      for candidate in (ROOT / inc, p.parent / inc):
+        if candidate.is_file():
+          stack.append(candidate.resolve())
+          break
+  return deps
+
+
+def compute_site_hashes(sites, preprocessed_source):
+  """Cache key of each mutant's outcome: the mutation, the sources it is compiled with, and everything that judges it.
+
+  A site in a mode file depends on the core sources and the headers that mode includes, a site anywhere else on
+  every safety source. The tests are judged together with all the Python, DBCs and schemas in opendbc they can reach
+  (car values, the CAN packer, the DBCs it encodes with), so any change there reruns every mutant.
+  """
+  safety_sources = [p.resolve() for p in SAFETY_DIR.rglob("*") if p.suffix in (".c", ".h") and p.is_file()]
+  core_sources = [p for p in safety_sources if p.parent != MODES_DIR]
+  test_deps = [p.resolve() for p in (ROOT / "opendbc").rglob("*") if p.suffix in (".py", ".dbc", ".capnp") and p.is_file()]
+
+  file_hashes = {}
+
+  def deps_hash(paths):
+    key = tuple(sorted(paths))
+    if key not in file_hashes:
+      file_hashes[key] = _hash_files(key)
+    return file_hashes[key]
+
+  line_starts = [0] + [m.end() for m in re.finditer("\n", preprocessed_source)]
+  hashes = {}
+  for site in sites:
+    if site.origin_file.parent == MODES_DIR:
+      sources = set(core_sources) | include_closure(site.origin_file.resolve())
+    else:
+      sources = safety_sources
+
+    # the preprocessed line pins down the mutation with macros expanded, independent of where other code moved it
+    line_start = line_starts[site.line - 1]
+    line_text = preprocessed_source[line_start:preprocessed_source.find("\n", line_start)]
+    mutation = f"{site.origin_file.relative_to(ROOT)}:{site.origin_line}:{site.op_start - line_start}:{line_text}:{site.mutator}:{site.mutated_op}"
+    h = hashlib.sha256(f"{MUTATION_CACHE_VERSION}:{mutation}".encode())
+    h.update(deps_hash(sources).encode())
+    h.update(deps_hash(test_deps).encode())
+    hashes[site.site_id] = h.hexdigest()
+  return hashes
+
+
+def load_results_cache(path):
+  try:
+    with open(path) as f:
+      return json.load(f)
+  except (OSError, ValueError):
+    return {}
+
+
+def save_results_cache(path, cache):
+  os.makedirs(os.path.dirname(path), exist_ok=True)
+  tmp_path = f"{path}.{os.getpid()}.tmp"
+  with open(tmp_path, "w") as f:
+    json.dump(cache, f)
+  os.replace(tmp_path, path)
 
 
 def eval_mutant(site, targets, lib_path, verbose):
@@ -494,6 +609,7 @@ def main():
   parser.add_argument("--max-mutants", type=int, default=0, help="optional limit for debugging (0 means all)")
   parser.add_argument("--list-only", action="store_true", help="list discovered candidates and exit")
   parser.add_argument("--verbose", action="store_true", help="print extra debug output")
+  parser.add_argument("--no-cache", action="store_true", help="rerun every mutant instead of reusing results from unchanged mutants")
   args = parser.parse_args()
 
   start = time.perf_counter()
@@ -502,6 +618,7 @@ def main():
     preprocessed_file = Path(run_tmp_dir) / "safety_preprocessed.c"
     sites, mutator_counts, build_incompatible_ids, preprocessed_source = enumerate_sites(ROOT / SAFETY_C_REL, preprocessed_file)
     assert len(sites) > 0
+    site_hashes = compute_site_hashes(sites, preprocessed_source)
 
     if args.max_mutants > 0:
       sites = sites[: args.max_mutants]
@@ -527,55 +644,72 @@ def main():
       print("Failed to build mutation library: all sites were pruned as build-incompatible", flush=True)
       return 2
 
-    mutation_lib = Path(run_tmp_dir) / "libsafety_mutation.so"
-    compile_mutated_library(preprocessed_source, sites, mutation_lib)
-
-    # Discover all tests by importing modules in the main process.
-    # Forked workers inherit these imports, eliminating per-worker import cost.
-    catalog = _discover_test_catalog()
-
-    # Baseline smoke check
-    baseline_ids = catalog.get("test_defaults.py", [])[:5]
-    baseline_failed = run_unittest(baseline_ids, mutation_lib, mutant_id=-1, verbose=args.verbose)
-    if baseline_failed is not None:
-      print("Baseline smoke failed with mutant_id=-1; aborting to avoid false kill signals.", flush=True)
-      print(f"  failed_test: {baseline_failed}", flush=True)
-      return 2
-
-    # Pre-compute test targets per mutation site
-    core_tests = _build_core_tests(catalog)
-    site_targets = {site.site_id: build_priority_tests(site, catalog, core_tests) for site in sites}
-
-    results = []
-    counts = Counter()
-
-    with ProcessPoolExecutor(max_workers=args.j) as pool:
-      future_map = {
-        pool.submit(eval_mutant, site, site_targets[site.site_id], mutation_lib, args.verbose): site for site in sites
-      }
-      print_live_status(render_progress(0, len(sites), 0, 0, 0, 0.0))
-      try:
-        for fut in as_completed(future_map):
-          try:
-            res = fut.result()
-          except Exception:
-            site = future_map[fut]
-            res = MutantResult(site, "killed", 0.0, "worker process crashed")
-          results.append(res)
-          counts[res.outcome] += 1
+    # reuse the outcome of every mutant whose code and tests are unchanged since it last ran
+    cache_dir = None if args.no_cache else get_cache_dir("mutation")
+    results_cache_path = None if cache_dir is None else os.path.join(cache_dir, f"results-v{MUTATION_CACHE_VERSION}.json")
+    results_cache = {} if results_cache_path is None else load_results_cache(results_cache_path)
+    results = [MutantResult(site, results_cache[site_hashes[site.site_id]], 0.0, "cached") for site in sites if site_hashes[site.site_id] in results_cache]
+    counts = Counter(r.outcome for r in results)
+    cached_count = len(results)
+    pending = [site for site in sites if site_hashes[site.site_id] not in results_cache]
+    if cached_count > 0:
+      print(f"Reusing {cached_count} cached results, running {len(pending)} mutants", flush=True)
+
+    if pending:
+      # one library with only the mutants left to run, each switched on at runtime by its site id
+      mutation_lib = get_mutated_library(preprocessed_source, pending, cache_dir, run_tmp_dir)
+
+      # Discover all tests by importing modules in the main process.
+      # Forked workers inherit these imports, eliminating per-worker import cost.
+      catalog = _discover_test_catalog()
+
+      # Baseline smoke check
+      baseline_ids = catalog.get("test_defaults.py", [])[:5]
+      baseline_failed = run_unittest(baseline_ids, mutation_lib, mutant_id=-1, verbose=args.verbose)
+      if baseline_failed is not None:
+        print("Baseline smoke failed with mutant_id=-1; aborting to avoid false kill signals.", flush=True)
+        print(f"  failed_test: {baseline_failed}", flush=True)
+        return 2
+
+      # Pre-compute test targets per mutation site
+      core_tests = _build_core_tests(catalog)
+      site_targets = {site.site_id: build_priority_tests(site, catalog, core_tests) for site in pending}
+
+      with ProcessPoolExecutor(max_workers=args.j) as pool:
+        future_map = {
+          pool.submit(eval_mutant, site, site_targets[site.site_id], mutation_lib, args.verbose): site for site in pending
+        }
+        print_live_status(render_progress(len(results), len(sites), counts["killed"], counts["survived"], counts["infra_error"], 0.0))
+        try:
+          for fut in as_completed(future_map):
+            try:
+              res = fut.result()
+            except Exception:
+              site = future_map[fut]
+              res = MutantResult(site, "killed", 0.0, "worker process crashed")
+            results.append(res)
+            counts[res.outcome] += 1
+            elapsed_now = time.perf_counter() - start
+            done = len(results) == len(sites)
+            print_live_status(render_progress(len(results), len(sites), counts["killed"], counts["survived"],
+                                              counts["infra_error"], elapsed_now), final=done)
+        except Exception:
+          # Pool broken — mark all unfinished mutants as killed (crash = behavioral change detected)
+          completed_ids = {r.site.site_id for r in results}
+          for site in sites:
+            if site.site_id not in completed_ids:
+              results.append(MutantResult(site, "killed", 0.0, "pool broken"))
+              counts["killed"] += 1
           elapsed_now = time.perf_counter() - start
-          done = len(results) == len(sites)
-          print_live_status(render_progress(len(results), len(sites), counts["killed"], counts["survived"],
-                                            counts["infra_error"], elapsed_now), final=done)
-      except Exception:
-        # Pool broken — mark all unfinished mutants as killed (crash = behavioral change detected)
-        completed_ids = {r.site.site_id for r in results}
-        for site in sites:
-          if site.site_id not in completed_ids:
-            results.append(MutantResult(site, "killed", 0.0, "pool broken"))
-            counts["killed"] += 1
-        elapsed_now = time.perf_counter() - start
-        print_live_status(render_progress(len(results), len(sites), counts["killed"], counts["survived"], counts["infra_error"], elapsed_now), final=True)
+          print_live_status(render_progress(len(results), len(sites), counts["killed"], counts["survived"], counts["infra_error"], elapsed_now), final=True)
+
+    if results_cache_path is not None:
+      # keep results of mutants that still exist, a mutant that wasn't actually evaluated is never cached
+      live_hashes = set(site_hashes.values())
+      results_cache = {h: outcome for h, outcome in results_cache.items() if h in live_hashes}
+      evaluated = [r for r in results if r.outcome != "infra_error" and r.details not in ("pool broken", "worker process crashed")]
+      results_cache.update({site_hashes[r.site.site_id]: r.outcome for r in evaluated})
+      save_results_cache(results_cache_path, results_cache)
 
     survivors = sorted((r for r in results if r.outcome == "survived"), key=lambda r: r.site.site_id)
     if survivors:
@@ -603,6 +737,7 @@ def main():
     print(f"  discovered: {discovered_count}", flush=True)
     print(f"  pruned_build_incompatible: {pruned_compile_sites}", flush=True)
     print(f"  total: {len(sites)}", flush=True)
+    print(f"  cached: {cached_count}", flush=True)
     print(f"  killed: {colorize(str(counts['killed']), ANSI_GREEN)}", flush=True)
     print(f"  survived: {colorize(str(counts['survived']), ANSI_RED)}", flush=True)
     print(f"  infra_error: {colorize(str(counts['infra_error']), ANSI_YELLOW)}", flush=True)
@@ -85,6 +85,12 @@ def package_can_msg(msg):
   return libsafety_py.make_CANPacket(msg.address, msg.src % 4, msg.dat)
 
 
+def package_can_msgs(msgs, timer):
+  """Columns for PacketBatch hooks, all at the same timer."""
+  data, lengths = libsafety_py.pad_payloads([msg.dat for msg in msgs])
+  return [msg.address for msg in msgs], [msg.src % 4 for msg in msgs], data, lengths, [timer] * len(msgs)
+
+
 def init_segment(safety, msgs, mode, param):
   sendcan = (msg for msg in msgs if msg.which() == 'sendcan')
   steering_msgs = (can for msg in sendcan for can in msg.sendcan if is_steering_msg(mode, param, can.address))
@@ -1,15 +1,50 @@
 #!/usr/bin/env python3
 import argparse
 from collections import Counter
+from dataclasses import dataclass, field
 from tqdm import tqdm
 
 from opendbc.car.carlog import carlog
 from opendbc.safety.tests.libsafety import libsafety_py
-from opendbc.safety.tests.safety_replay.helpers import package_can_msg, init_segment
-
-
-# replay a drive to check for safety violations
-def replay_drive(msgs, safety_mode, param, alternative_experience):
+from opendbc.safety.tests.safety_replay.helpers import init_segment, package_can_msgs
+
+
+@dataclass
+class ReplayResult:
+  rx_tot: int = 0
+  rx_invalid: int = 0
+  safety_tick_rx_invalid: bool = False
+  invalid_addrs: set[int] = field(default_factory=set)
+  tx_tot: int = 0
+  tx_controls: int = 0
+  tx_blocked: int = 0
+  tx_controls_blocked: int = 0
+  blocked_addrs: Counter = field(default_factory=Counter)
+
+  @property
+  def passed(self) -> bool:
+    return self.tx_controls_blocked == 0 and self.rx_invalid == 0 and not self.safety_tick_rx_invalid
+
+  def __add__(self, other: 'ReplayResult') -> 'ReplayResult':
+    return ReplayResult(self.rx_tot + other.rx_tot, self.rx_invalid + other.rx_invalid, self.safety_tick_rx_invalid or other.safety_tick_rx_invalid,
+                        self.invalid_addrs | other.invalid_addrs, self.tx_tot + other.tx_tot, self.tx_controls + other.tx_controls,
+                        self.tx_blocked + other.tx_blocked, self.tx_controls_blocked + other.tx_controls_blocked, self.blocked_addrs + other.blocked_addrs)
+
+  def print_report(self):
+    print("\nRX")
+    print("total rx msgs:", self.rx_tot)
+    print("invalid rx msgs:", self.rx_invalid)
+    print("safety tick rx invalid:", self.safety_tick_rx_invalid)
+    print("invalid addrs:", self.invalid_addrs)
+    print("\nTX")
+    print("total openpilot msgs:", self.tx_tot)
+    print("total msgs with controls allowed:", self.tx_controls)
+    print("blocked msgs:", self.tx_blocked)
+    print("blocked with controls allowed:", self.tx_controls_blocked)
+    print("blocked addrs:", self.blocked_addrs)
+
+
+def replay_segment(msgs, safety_mode, param, alternative_experience, progress=True) -> ReplayResult:
   safety = libsafety_py.libsafety
   msgs.sort(key=lambda m: m.logMonoTime)
 
@@ -19,58 +54,66 @@ def replay_drive(msgs, safety_mode, param, alternative_experience):
 
   init_segment(safety, msgs, safety_mode, param)
 
-  rx_tot, rx_invalid, tx_tot, tx_blocked, tx_controls, tx_controls_blocked = 0, 0, 0, 0, 0, 0
-  safety_tick_rx_invalid = False
-  blocked_addrs = Counter()
-  invalid_addrs = set()
+  ret = ReplayResult()
 
   can_msgs = [m for m in msgs if m.which() in ('can', 'sendcan')]
   start_t = can_msgs[0].logMonoTime
   end_t = can_msgs[-1].logMonoTime
-  for msg in tqdm(can_msgs):
-    safety.set_timer((msg.logMonoTime // 1000) % 0xFFFFFFFF)
+
+  # frames of each event go through the hooks in one call
+  batch = libsafety_py.PacketBatch(safety, max(len(getattr(m, m.which())) for m in can_msgs))
+  for msg in tqdm(can_msgs, disable=not progress):
+    timer = (msg.logMonoTime // 1000) % 0xFFFFFFFF
+    safety.set_timer(timer)
 
     # skip start and end of route, warm up/down period
     if msg.logMonoTime - start_t > 1e9 and end_t - msg.logMonoTime > 1e9:
       safety.safety_tick_current_safety_config()
-      safety_tick_rx_invalid |= not safety.safety_config_valid() or safety_tick_rx_invalid
+      ret.safety_tick_rx_invalid |= not safety.safety_config_valid() or ret.safety_tick_rx_invalid
 
     if msg.which() == 'sendcan':
-      for canmsg in msg.sendcan:
-        _msg = package_can_msg(canmsg)
-        sent = safety.safety_tx_hook(_msg)
-        if not sent:
-          tx_blocked += 1
-          tx_controls_blocked += safety.get_controls_allowed()
-          blocked_addrs[canmsg.address] += 1
+      frames = list(msg.sendcan)
+      sent, controls_allowed = batch.tx_hook(*package_can_msgs(frames, timer))
+      for canmsg, tx_ok, allowed in zip(frames, sent.tolist(), controls_allowed.tolist(), strict=True):
+        if not tx_ok:
+          ret.tx_blocked += 1
+          ret.tx_controls_blocked += allowed
+          ret.blocked_addrs[canmsg.address] += 1
 
           carlog.debug("blocked bus %d msg %d at %f" % (canmsg.src, canmsg.address, (msg.logMonoTime - start_t) / 1e9))
-        tx_controls += safety.get_controls_allowed()
-        tx_tot += 1
+        ret.tx_controls += allowed
+        ret.tx_tot += 1
     elif msg.which() == 'can':
       # ignore msgs we sent
-      for canmsg in filter(lambda m: m.src < 128, msg.can):
-        safety.safety_fwd_hook(canmsg.src, canmsg.address)
-        _msg = package_can_msg(canmsg)
-        recv = safety.safety_rx_hook(_msg)
-        if not recv:
-          rx_invalid += 1
-          invalid_addrs.add(canmsg.address)
-        rx_tot += 1
-
-  print("\nRX")
-  print("total rx msgs:", rx_tot)
-  print("invalid rx msgs:", rx_invalid)
-  print("safety tick rx invalid:", safety_tick_rx_invalid)
-  print("invalid addrs:", invalid_addrs)
-  print("\nTX")
-  print("total openpilot msgs:", tx_tot)
-  print("total msgs with controls allowed:", tx_controls)
-  print("blocked msgs:", tx_blocked)
-  print("blocked with controls allowed:", tx_controls_blocked)
-  print("blocked addrs:", blocked_addrs)
-
-  return tx_controls_blocked == 0 and rx_invalid == 0 and not safety_tick_rx_invalid
+      frames = [m for m in msg.can if m.src < 128]
+      recv = batch.rx_hook(*package_can_msgs(frames, timer))
+      for canmsg, rx_ok in zip(frames, recv.tolist(), strict=True):
+        if not rx_ok:
+          ret.rx_invalid += 1
+          ret.invalid_addrs.add(canmsg.address)
+      ret.rx_tot += len(frames)
+
+  return ret
+
+
+# replay a drive to check for safety violations
+def replay_drive(msgs, safety_mode, param, alternative_experience):
+  result = replay_segment(msgs, safety_mode, param, alternative_experience)
+  result.print_report()
+  return result.passed
+
+
+def get_safety_config(lr, mode=None, param=None, alternative_experience=None) -> tuple[int, int, int]:
+  """Safety mode, param and alternative experience from the log's carParams, unless overridden."""
+  if None in (mode, param, alternative_experience):
+    CP = lr.first('carParams')
+    if mode is None:
+      mode = CP.safetyConfigs[-1].safetyModel.raw
+    if param is None:
+      param = CP.safetyConfigs[-1].safetyParam
+    if alternative_experience is None:
+      alternative_experience = CP.alternativeExperience
+  return mode, param, alternative_experience
 
 
 if __name__ == "__main__":
@@ -86,14 +129,8 @@ if __name__ == "__main__":
 
   lr = LogReader(args.route_or_segment_name[0])
 
-  if None in (args.mode, args.param, args.alternative_experience):
-    CP = lr.first('carParams')
-    if args.mode is None:
-      args.mode = CP.safetyConfigs[-1].safetyModel.raw
-    if args.param is None:
-      args.param = CP.safetyConfigs[-1].safetyParam
-    if args.alternative_experience is None:
-      args.alternative_experience = CP.alternativeExperience
+  args.mode, args.param, args.alternative_experience = get_safety_config(lr, args.mode, args.param, args.alternative_experience)
 
+  libsafety_py.load_profile(libsafety_py.get_profile("fast"))
   print(f"replaying {args.route_or_segment_name[0]} with safety mode {args.mode}, param {args.param}, alternative experience {args.alternative_experience}")
   replay_drive(list(lr), args.mode, args.param, args.alternative_experience)
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+import argparse
+import os
+import sys
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from tqdm import tqdm
+
+from opendbc.safety.tests.libsafety import libsafety_py
+from opendbc.safety.tests.safety_replay.replay_drive import ReplayResult, get_safety_config, replay_segment
+
+SegmentResult = tuple[str, ReplayResult | None, str | None]
+
+
+def init_worker(libsafety_so: str):
+  # libsafety keeps its state in globals, so every worker process loads its own instance
+  libsafety_py.load(libsafety_so)
+
+
+def replay_one(args: tuple) -> SegmentResult:
+  from openpilot.tools.lib.logreader import LogReader
+
+  segment, mode, param, alternative_experience = args
+  try:
+    lr = LogReader(segment)
+    config = get_safety_config(lr, mode, param, alternative_experience)
+    return segment, replay_segment(list(lr), *config, progress=False), None
+  except Exception:
+    return segment, None, traceback.format_exc()
+
+
+def replay_segments(segments: list[str], mode=None, param=None, alternative_experience=None, workers: int | None = None) -> list[SegmentResult]:
+  """Replay segments through their safety modes, sharded across worker processes."""
+  # compile once, each worker only dlopens it
+  libsafety_so = libsafety_py._build_libsafety(libsafety_py.get_profile("fast"))
+  work = [(segment, mode, param, alternative_experience) for segment in segments]
+  with ProcessPoolExecutor(workers, initializer=init_worker, initargs=(libsafety_so,)) as pool:
+    return list(tqdm(pool.map(replay_one, work), total=len(work)))
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Replay many segments through their safety modes in parallel",
+                                   formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+  parser.add_argument("segments", nargs='*', help="Segment names or log URLs")
+  parser.add_argument("--database", action="store_true", help="Replay every segment in the comma car segments database")
+  parser.add_argument("--mode", type=int, help="Override the safety mode from the logs")
+  parser.add_argument("--param", type=int, help="Override the safety param from the logs")
+  parser.add_argument("--alternative-experience", type=int, help="Override the alternative experience from the logs")
+  parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Number of worker processes")
+  args = parser.parse_args()
+
+  segments = list(args.segments)
+  if args.database:
+    from comma_car_segments import get_comma_car_segments_database, get_url
+    for platform_segments in get_comma_car_segments_database().values():
+      for seg in platform_segments:
+        parts = seg.split("/")
+        segments.append(get_url(f"{parts[0]}/{parts[1]}", parts[2]))
+
+  results = replay_segments(segments, args.mode, args.param, args.alternative_experience, args.workers)
+  total = sum((result for _, result, _ in results if result is not None), ReplayResult())
+  failed = [segment for segment, result, _ in results if result is not None and not result.passed]
+  errors = [(segment, err) for segment, _, err in results if err]
+
+  print(f"\nreplayed {len(results) - len(errors)} segments: {len(failed)} failed, {len(errors)} errors")
+  total.print_report()
+  for segment in failed:
+    print("\nFAILED", segment)
+  for segment, err in errors:
+    print(f"\nERROR {segment}: {err}")
+  sys.exit(1 if failed or errors else 0)